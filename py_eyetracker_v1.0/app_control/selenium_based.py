@@ -1,3 +1,5 @@
+import logging
+
 from selenium import webdriver
 from selenium.webdriver.common.keys import Keys
 
@@ -6,6 +8,9 @@ from app_control.interface import AppControlInterface
 
 landing_page = "http://thoreau.eserver.org/walden1a.html"
 
+# scrolling happens on every frame the gaze is in a scroll area: see the "frames" logger in main.py
+logger = logging.getLogger("frames.app_control")
+
 
 class SeleniumScroller(AppControlInterface):
 
@@ -16,11 +21,11 @@ class SeleniumScroller(AppControlInterface):
         self.body = self.browser.find_element_by_xpath('/html/body')
 
     def scroll_down(self, amount):
-        print("scrolling down")
+        logger.debug("scrolling down")
         self.body.send_keys(Keys.DOWN)
 
     def scroll_up(self, amount):
-        print("scrolling up")
+        logger.debug("scrolling up")
         self.body.send_keys(Keys.UP)
 
 
@@ -0,0 +1,65 @@
+"""
+Memory benchmark of process_frame: measures, with tracemalloc, how much memory one frame needs
+on top of what is already allocated (peak), and how much it leaves allocated afterwards.
+
+usage: python benchmark_frame_memory.py [image] [-a ALGO] [-e EQUALIZATION] [-n FRAMES]
+(without an image, a noise frame is used: no face is found, so only the preprocessing and the
+face detection are measured)
+"""
+import argparse
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from main import algos, equaliz
+from utils.process_frame import process_frame
+
+
+def measure(image_cv2, algo, frames, roi_equalization=False):
+    """
+    :return: list of tuples (peak bytes, retained bytes), one per frame
+    """
+    results = []
+    tracemalloc.start()
+    for n in range(frames):
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        result = process_frame(image_cv2, algo, None, roi_equalization=roi_equalization)
+        after, peak = tracemalloc.get_traced_memory()
+        results.append((peak - before, after - before))
+        del result
+    tracemalloc.stop()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="process_frame memory benchmark")
+    parser.add_argument('file', help='picture to process', type=str, nargs='?', default=None)
+    parser.add_argument('-a', '--algo', type=str, default="hough", choices=algos.keys())
+    parser.add_argument('-e', '--equalization', type=str, default="ah", choices=equaliz.keys())
+    parser.add_argument('-n', '--frames', type=int, default=10)
+    parser.add_argument('--roi-equalization', action='store_true')
+    cli = parser.parse_args()
+
+    if cli.file is None:
+        image_cv2 = (np.random.RandomState(0).rand(480, 640, 3) * 255).astype(np.uint8)
+    else:
+        image_cv2 = cv2.imread(cli.file)
+
+    algo = algos[cli.algo]()
+    algo.equalization = equaliz[cli.equalization]
+
+    results = measure(image_cv2, algo, cli.frames, roi_equalization=cli.roi_equalization)
+    # the first frame also allocates the work buffers (and loads the detector)
+    print("frame      peak KiB   retained KiB")
+    for n, (peak, retained) in enumerate(results):
+        print("%5d %12.1f %14.1f" % (n, peak / 1024.0, retained / 1024.0))
+    steady = results[1:] or results
+    print("steady state: peak %.1f KiB, retained %.1f KiB per frame" % (
+        np.mean([peak for peak, _ in steady]) / 1024.0,
+        np.mean([retained for _, retained in steady]) / 1024.0))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Latency versus jitter benchmark of the smoothers (see utils/smoothing.py): replays a stream of eye vectors
+through every smoother, as Tracker does with --smoother (the parameters not given default to
+smoothing.eye_vector_params, as with --eye-smoother-param), and measures
+    lag: delay of the smoothed stream behind the raw one, in ms (the delay minimizing the squared error
+        between the two)
+    jitter: RMS of the second differences of the smoothed stream (frame to frame), in eye vector units;
+        on the synthetic stream, during the fixations only
+    error: RMS distance from the true eye vectors (synthetic stream only)
+    us/update: time per frame spent in the smoother
+
+usage: python benchmark_smoothing.py [results.npz] [-c "SMOOTHER NAME=VALUE ..." ...] [--fps F]
+The stream comes from the per-frame results of an offline run (main.py --output results.npz, frames without
+a face are skipped); without a file, a synthetic stream of fixations and saccades with noise is used.
+
+example: python benchmark_smoothing.py results.npz -c "average window=3" -c "one_euro beta=2 min_cutoff=0.5"
+"""
+import argparse
+import shlex
+import time
+
+import numpy as np
+
+from utils.smoothing import make_eye_vector_smoother, parse_params
+
+
+# smoothers compared when none is given
+default_configurations = [
+    "average window=3",
+    "average window=5",
+    "average window=10",
+    "kalman",
+    "kalman process_noise=0.2",
+    "kalman process_noise=2",
+    "one_euro",
+    "one_euro min_cutoff=1 beta=5",
+    "one_euro min_cutoff=0.3 beta=20",
+]
+
+
+def synthetic_stream(frames=3000, fps=30.0, noise=0.01, seed=0):
+    """
+    Fixations of 0.2 to 1.5 s at random eye vectors, joined by 50 ms saccades, plus gaussian noise
+    :return: tuple (timestamps, noisy eye vectors, true eye vectors)
+    """
+    random = np.random.RandomState(seed)
+    timestamps = np.arange(frames) / fps
+    truth = np.empty((frames, 4))
+    target = random.uniform(-0.3, 0.3, 4)
+    n = 0
+    while n < frames:
+        fixation = int(random.uniform(0.2, 1.5) * fps)
+        truth[n:n + fixation] = target
+        n += fixation
+        saccade = max(int(0.05 * fps), 1)
+        next_target = random.uniform(-0.3, 0.3, 4)
+        ramp = np.linspace(0, 1, saccade + 1)[1:, np.newaxis]
+        truth[n:n + saccade] = (target + ramp * (next_target - target))[:len(truth[n:n + saccade])]
+        n += saccade
+        target = next_target
+    return timestamps, truth + random.normal(0, noise, truth.shape), truth
+
+
+def recorded_stream(path, fps):
+    """
+    :return: tuple (timestamps, eye vectors, None), from the per-frame results of an offline run
+    """
+    arrays = np.load(path)
+    vectors = np.hstack([arrays["right_eye_vector"], arrays["left_eye_vector"]])
+    timestamps = arrays["timestamp"]
+    if np.isnan(timestamps).any():
+        timestamps = arrays["frame_id"] / fps
+    keep = arrays["detected"] & np.isfinite(vectors).all(axis=1)
+    return timestamps[keep], vectors[keep], None
+
+
+def replay(smoother, timestamps, vectors):
+    """
+    :return: tuple (smoothed vectors, seconds per update)
+    """
+    smoothed = np.empty_like(vectors)
+    started = time.perf_counter()
+    for n in range(len(vectors)):
+        smoother.update(vectors[n], timestamps[n])
+        smoothed[n] = smoother.estimate()
+    return smoothed, (time.perf_counter() - started) / max(len(vectors), 1)
+
+
+def lag_frames(raw, smoothed, max_lag=30):
+    """
+    :return: delay (in frames) of smoothed behind raw which minimizes their squared error
+    """
+    errors = [np.mean((smoothed[lag:] - raw[:len(raw) - lag]) ** 2) for lag in range(min(max_lag, len(raw) - 1) + 1)]
+    return int(np.argmin(errors))
+
+
+def jitter(vectors, still=None):
+    """
+    :param still: boolean mask of the second differences to use (None: all)
+    """
+    squares = np.sum(np.diff(vectors, n=2, axis=0) ** 2, axis=1)
+    return np.sqrt(np.mean(squares[still] if still is not None else squares))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Smoothers latency versus jitter benchmark")
+    parser.add_argument('file', help='per-frame results of an offline run (.npz)', type=str, nargs='?', default=None)
+    parser.add_argument('-c', '--configuration', metavar='"SMOOTHER NAME=VALUE ..."', action='append', default=None,
+                        help='smoother to test, with its parameters (repeatable)')
+    parser.add_argument('--fps', help='frame rate of the synthetic stream (or of a recording without timestamps)',
+                        type=float, default=30.0)
+    parser.add_argument('--noise', help='standard deviation of the noise of the synthetic stream',
+                        type=float, default=0.01)
+    cli = parser.parse_args()
+
+    if cli.file is None:
+        timestamps, vectors, truth = synthetic_stream(fps=cli.fps, noise=cli.noise)
+    else:
+        timestamps, vectors, truth = recorded_stream(cli.file, cli.fps)
+    if len(vectors) < 3:
+        raise Exception("not enough frames with a face in \"%s\"" % cli.file)
+    frame_ms = np.median(np.diff(timestamps)) * 1000
+    # the frames in the middle of a fixation
+    still = (np.abs(np.diff(truth, n=2, axis=0)) < 1e-12).all(axis=1) if truth is not None else None
+
+    rows = [("raw", 0, jitter(vectors, still),
+             np.sqrt(np.mean(np.sum((vectors - truth) ** 2, axis=1))) if truth is not None else None, 0.0)]
+    for configuration in cli.configuration or default_configurations:
+        name, *pairs = shlex.split(configuration)
+        smoother = make_eye_vector_smoother(name, **parse_params(pairs))
+        smoothed, seconds = replay(smoother, timestamps, vectors)
+        error = np.sqrt(np.mean(np.sum((smoothed - truth) ** 2, axis=1))) if truth is not None else None
+        rows.append((configuration, lag_frames(vectors, smoothed) * frame_ms, jitter(smoothed, still), error, seconds))
+
+    print("%d frames, %.1f ms per frame" % (len(vectors), frame_ms))
+    width = max(len(row[0]) for row in rows)
+    print("%s  %8s  %10s  %10s  %9s" % ("smoother".ljust(width), "lag ms", "jitter", "error", "us/update"))
+    for configuration, lag, jitter_value, error, seconds in rows:
+        print("%s  %8.1f  %10.5f  %10s  %9.1f" % (configuration.ljust(width), lag, jitter_value,
+                                                 "%.5f" % error if error is not None else "-", seconds * 1e6))
+
+
+if __name__ == "__main__":
+    main()
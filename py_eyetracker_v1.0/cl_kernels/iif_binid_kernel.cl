@@ -19,6 +19,7 @@
     float intensity = image[gid];
     
     uchar bin_number = floor(intensity * nbins);
+    if (bin_number >= nbins) bin_number = nbins - 1;  // intensity 1.0 (solid white) goes in the last bin
     
     for (size_t b = 0; b < nbins; b++) {
         output_binid[PIXELID_OUT(XCOORD_IN(gid), 
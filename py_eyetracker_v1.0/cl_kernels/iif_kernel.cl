@@ -20,6 +20,7 @@
     float intensity = image[gid];
     
     int bin_number = floor(intensity * NBINS);
+    if (bin_number >= NBINS) bin_number = NBINS - 1;  // intensity 1.0 (solid white) goes in the last bin
     
     unsigned int x = XCOORD_IN(gid);
     unsigned int y = YCOORD_IN(gid);
@@ -43,3 +44,80 @@
     transform[PIXELID_IN(x, y)] = accum;
     
 }
+
+
+// Same as IIF, but takes the un-normalized locality sensitive histogram together with its
+// normalization factor, so that the division can happen on the device.
+// The normalization factor is the same for every bin, so it is read from bin 0 only.
+ __kernel void IIF_normalized(
+    unsigned int image_width,
+    unsigned int image_height,
+    float k,
+    __global float* image,
+    __global float* hist,
+    __global float* norm,
+    __global float* transform)
+{
+    size_t gid = get_global_id(0);
+    float intensity = image[gid];
+    
+    int bin_number = floor(intensity * NBINS);
+    if (bin_number >= NBINS) bin_number = NBINS - 1;  // intensity 1.0 (solid white) goes in the last bin
+    
+    unsigned int x = XCOORD_IN(gid);
+    unsigned int y = YCOORD_IN(gid);
+    
+    float intensity_adjusted = k * intensity * 100;
+    if (intensity_adjusted < k) intensity_adjusted = k;
+    float intensity_adjusted_2 = intensity_adjusted * intensity_adjusted;
+    
+    float accum = 0.0f;
+    
+    __attribute__((opencl_unroll_hint))
+    for (int b = 0; b < NBINS; b++) {
+        accum += exp( -(                                \
+                ((b - bin_number)*(b - bin_number))     \
+                                /                       \
+                (2 * intensity_adjusted_2)              \
+            ) )                                         \
+        * hist[PIXELID_OUT(x, y, b)];
+    }
+    
+    transform[PIXELID_IN(x, y)] = accum / norm[PIXELID_OUT(x, y, 0)];
+    
+}
+
+
+// Contribution of the chunk_bins bins starting at first_bin, added to transform.
+// hist and norm are the un-normalized histogram and its normalization factor for those bins only.
+ __kernel void IIF_accumulate(
+    unsigned int image_width,
+    unsigned int image_height,
+    float k,
+    int first_bin,
+    int chunk_bins,
+    __global float* image,
+    __global float* hist,
+    __global float* norm,
+    __global float* transform)
+{
+    size_t gid = get_global_id(0);
+    float intensity = image[gid];
+    
+    int bin_number = floor(intensity * NBINS);
+    if (bin_number >= NBINS) bin_number = NBINS - 1;  // intensity 1.0 (solid white) goes in the last bin
+    
+    float intensity_adjusted = k * intensity * 100;
+    if (intensity_adjusted < k) intensity_adjusted = k;
+    float intensity_adjusted_2 = intensity_adjusted * intensity_adjusted;
+    
+    float accum = 0.0f;
+    
+    for (int b = 0; b < chunk_bins; b++) {
+        int distance = first_bin + b - bin_number;
+        accum += exp( -((distance * distance) / (2 * intensity_adjusted_2)) ) * hist[gid * chunk_bins + b];
+    }
+    
+    transform[gid] += accum / norm[gid * chunk_bins];
+    
+}
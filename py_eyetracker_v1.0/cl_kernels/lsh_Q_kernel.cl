@@ -18,9 +18,33 @@
     float intensity = image[gid];
     
     uchar bin_number = floor(intensity * nbins);
+    if (bin_number >= nbins) bin_number = nbins - 1;  // intensity 1.0 (solid white) goes in the last bin
     
     output_Q[PIXELID_OUT(XCOORD_IN(gid), 
                          YCOORD_IN(gid), 
                          bin_number)
             ] = 1.0;
 }
+
+
+// Same as lsh_Q, but only for the chunk_bins bins starting at first_bin:
+// the output volume has just chunk_bins bins, and must be cleared by the host beforehand
+ __kernel void lsh_Q_chunk(
+    unsigned int image_width,
+    unsigned int image_height,
+    uchar nbins,
+    uchar first_bin,
+    uchar chunk_bins,
+    __global float* image,
+    __global float* output_Q)
+{
+    size_t gid = get_global_id(0);
+    float intensity = image[gid];
+    
+    uchar bin_number = floor(intensity * nbins);
+    if (bin_number >= nbins) bin_number = nbins - 1;  // intensity 1.0 (solid white) goes in the last bin
+    
+    if (bin_number >= first_bin && bin_number < first_bin + chunk_bins) {
+        output_Q[gid * chunk_bins + (bin_number - first_bin)] = 1.0;
+    }
+}
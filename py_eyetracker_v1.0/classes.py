@@ -1,10 +1,14 @@
+import time
 import dill as pickle
-from collections import namedtuple, deque
-from functools import reduce
+from collections import namedtuple
 
 from math import cos, sqrt
 import numpy as np
 
+from utils.profiling import timed
+from utils.smoothing import MovingAverage
+from utils import metrics
+
 
 # Named tuples for "dumb" data objects
 
@@ -13,46 +17,94 @@ Point = namedtuple("Point", ["x", "y"])
 Observation = namedtuple("Observation", ["screen_point", "left_eyevectors", "right_eyevectors"])
 
 
+# Structured array layout of many faces (see faces_to_records), e.g. the frames of a long recording.
+# Every field is float64 and the fields are packed in the order of Face.as_vector, so an array of records
+# can be viewed as a (number of faces, Face.vector_size) float64 matrix.
+
+eye_dtype = np.dtype([
+    ("area", np.float64, 4),
+    ("pupil_relative", np.float64, 2),
+    ("inner_corner_relative", np.float64, 2),
+    ("outer_corner_relative", np.float64, 2),
+])
+face_dtype = np.dtype([
+    ("dlib68_points", np.float64, (68, 2)),
+    ("right_eye", eye_dtype),
+    ("left_eye", eye_dtype),
+    ("orientation", np.float64, 3),
+    ("translation", np.float64, 3),
+    ("head_pose", np.float64, 2),
+])
+
+# shared by the faces created empty (they are usually overwritten right away): read-only, so that they
+# cannot be modified in place by mistake
+zero_points = np.zeros((68, 2))
+zero_points.flags.writeable = False
+zero_vector3 = np.zeros((3, 1))
+zero_vector3.flags.writeable = False
+
+
 
 class Tracker:
 
     """
         Object representing the face-to-screen mapping data, in the current frame and possibly in the last
-        N past frames for the purpose of stabilizing through a weighted sum function.
+        N past frames for the purpose of stabilizing through a smoothing filter (see utils/smoothing.py).
 
         _face: current-frame face object
-        smooth_weight_fun: function generating the weights for the face-averaging process
         cal_model_right: model which computes the right eyevector-to-screen mapping
         cal_model_left: model which computes the left eyevector-to-screen mapping
-        smooth_frames: number of frames to average across
-        history: fixed-size queue with the most recend faces captured
-        centroid_history: fixed-size queue with the most recent left eye and right eye screen positions computed
+        face_smoother: moving average of the face data (see Face.as_vector), None to disable smoothing
+        eye_vector_smoother: smoother of the normalized eye vectors of the current-frame face (right x, right y,
+            left x, left y), which are then mapped to the screen; None to map the ones of the smoothed face
+        gaze_smoother: smoother of the gaze centroid on the screen (the midpoint of the left eye and right eye
+            screen positions)
+        timestamp: time of the current-frame face
 
     """
 
-    def __init__(self, model_class, smooth_frames=5, centroid_history_frames=5, smooth_weight_fun=lambda x: 1.0):
+    def __init__(self, model_class, smooth_frames=5, centroid_history_frames=5, smooth_weight_fun=lambda x: 1.0,
+                 eye_vector_smoother=None, gaze_smoother=None):
         """
         :param model_class: class implementing MapperInterface
         :param smooth_frames: smooth the tracking data averaging across N frames. 1 to disable smoothing
         :param centroid_history_frames: calculate the centroid using the eye data from the last N frames
         :param smooth_weight_fun: weight function to use in computing the smoothing
+        :param eye_vector_smoother: smoother of the eye vectors to map (see utils/smoothing.py
+            eye_vector_params), instead of the ones of the face averaged across smooth_frames
+        :param gaze_smoother: smoother of the gaze centroid, instead of the average across centroid_history_frames
         """
         self._face = Face()
-        self.smooth_weight_fun = smooth_weight_fun
         self.cal_model_right = model_class()
         self.cal_model_left = model_class()
-        self.smooth_frames = smooth_frames
-        self.history = deque(maxlen=smooth_frames)
-        self.centroid_history = deque(maxlen=centroid_history_frames*2)
-
-    def update(self, face):
+        self.face_smoother = MovingAverage(smooth_frames, smooth_weight_fun) if smooth_frames > 1 else None
+        self.eye_vector_smoother = eye_vector_smoother
+        if gaze_smoother is None:
+            gaze_smoother = MovingAverage(centroid_history_frames)
+        self.gaze_smoother = gaze_smoother
+        self.face_vector = np.zeros(Face.vector_size)
+        self.eye_vectors = np.zeros(4)
+        self._smooth_face = None
+        self.timestamp = None
+
+    def update(self, face, timestamp=None):
+        """
+        :param timestamp: time the face was captured at, in seconds (default: now)
+        """
         assert(isinstance(face, Face))
-        self.history.append(face)
+        self.timestamp = timestamp if timestamp is not None else time.perf_counter()
+        if self.face_smoother is not None:
+            self.face_smoother.update(face.as_vector(out=self.face_vector), self.timestamp)
+        if self.eye_vector_smoother is not None:
+            self.eye_vectors[0:2] = face.normalized_right_eye_vector
+            self.eye_vectors[2:4] = face.normalized_left_eye_vector
+            self.eye_vector_smoother.update(self.eye_vectors, self.timestamp)
         self._face = face
+        self._smooth_face = None
 
     @property
     def smoothing_enabled(self):
-        return self.smooth_frames > 1
+        return self.face_smoother is not None
 
     @property
     def face(self):
@@ -66,17 +118,14 @@ class Tracker:
             return self._face
 
     def _get_smooth_face(self):
-        if len(self.history) > 0:
-            facesum = reduce(lambda a,b: a + b,
-                             map(lambda i: self.smooth_weight_fun(i[0])*i[1],
-                                 enumerate(self.history)),
-                             Face.zero())
-            avgface = facesum / sum(map(lambda n: self.smooth_weight_fun(n),
-                                        range(len(self.history))))
-            avgface.force_int()
-            return avgface
-        else:
-            return self._face
+        if self._smooth_face is None:
+            vector = self.face_smoother.estimate()
+            if vector is None:
+                return self._face
+            smooth_face = Face.from_vector(vector.copy())
+            smooth_face.force_int()
+            self._smooth_face = smooth_face
+        return self._smooth_face
 
     def load_saved_cal_params(self):
         from utils.screen_mapping.calibrator import cal_param_storage_path
@@ -89,18 +138,44 @@ class Tracker:
 
     @property
     def centroid(self):
-        if len(self.centroid_history) == 0:
+        centroid = self.gaze_smoother.estimate()
+        if centroid is None:
             return (0, 0)
-        x = sum(map(lambda pair: pair[0], self.centroid_history))
-        y = sum(map(lambda pair: pair[1], self.centroid_history))
-        return (x / len(self.centroid_history), y / len(self.centroid_history))
+        return (centroid[0], centroid[1])
 
-    def get_onscreen_gaze_mapping(self):
+    def map_eye_vectors(self, right_eye_vectors, left_eye_vectors):
+        """
+        Map many eye vectors at once with the calibrated models (e.g. the frames of a recorded session)
+        :param right_eye_vectors: (N,2) array of normalized right eye vectors
+        :param left_eye_vectors: (N,2) array of normalized left eye vectors
+        :return: tuple of (N,2) arrays (right eye screen positions, left eye screen positions)
+        """
+        return self.cal_model_right.map_points(right_eye_vectors), self.cal_model_left.map_points(left_eye_vectors)
+
+    def get_normalized_eye_vectors(self):
+        """
+        :return: tuple (right, left) of the normalized eye vectors to map to the screen: the estimate of
+            eye_vector_smoother, or those of the (smoothed) face
+        """
+        if self.eye_vector_smoother is not None:
+            eye_vectors = self.eye_vector_smoother.estimate()
+            if eye_vectors is not None:
+                return eye_vectors[0:2], eye_vectors[2:4]
         face = self.face
-        right_eye_screen_pos = self.cal_model_right.map_point(face.normalized_right_eye_vector)
-        left_eye_screen_pos = self.cal_model_left.map_point(face.normalized_left_eye_vector)
-        self.centroid_history.append(right_eye_screen_pos)
-        self.centroid_history.append(left_eye_screen_pos)
+        return face.normalized_right_eye_vector, face.normalized_left_eye_vector
+
+    def get_onscreen_gaze_mapping(self):
+        with timed("gaze mapping"):
+            right_eye_vector, left_eye_vector = self.get_normalized_eye_vectors()
+            right_eye_screen_pos, left_eye_screen_pos = self.map_eye_vectors(
+                np.array([right_eye_vector], dtype=np.float64),
+                np.array([left_eye_vector], dtype=np.float64))
+            right_eye_screen_pos = Point(*right_eye_screen_pos[0])
+            left_eye_screen_pos = Point(*left_eye_screen_pos[0])
+        self.gaze_smoother.update(((right_eye_screen_pos[0] + left_eye_screen_pos[0]) / 2,
+                                   (right_eye_screen_pos[1] + left_eye_screen_pos[1]) / 2),
+                                  self.timestamp if self.timestamp is not None else time.perf_counter())
+        metrics.mark("gaze_estimates")
         return right_eye_screen_pos, left_eye_screen_pos, self.centroid
 
 
@@ -118,18 +193,56 @@ class Face:
         Implements sum between faces, multiplication and division between a face and a number
     """
 
+    __slots__ = ("dlib68_points", "right_eye", "left_eye", "head_pose", "orientation", "translation")
+
     def __init__(self):
-        self.dlib68_points = np.zeros((68,2))
+        self.dlib68_points = zero_points
         self.right_eye = Eye.zero(True)
         self.left_eye = Eye.zero(True)
         self.head_pose = (0,0)
-        self.orientation = np.zeros((3,1))
-        self.translation = np.zeros((3,1))
+        self.orientation = zero_vector3
+        self.translation = zero_vector3
 
     @staticmethod
     def zero():
         return Face()
 
+    # layout of as_vector: 68 points, right eye, left eye (see Eye.as_vector), orientation, translation, head pose
+    vector_size = 68 * 2 + 2 * 10 + 3 + 3 + 2
+
+    def as_vector(self, out=None):
+        """
+        :param out: float64 array of vector_size elements to write into (optional)
+        :return: the face as a flat array, which can be averaged and converted back with from_vector
+        """
+        if out is None:
+            out = np.empty(Face.vector_size)
+        out[0:136] = np.ravel(self.dlib68_points)
+        self.right_eye.as_vector(out[136:146])
+        self.left_eye.as_vector(out[146:156])
+        out[156:159] = np.ravel(self.orientation)
+        out[159:162] = np.ravel(self.translation)
+        out[162:164] = self.head_pose
+        return out
+
+    @staticmethod
+    def from_record(record):
+        """
+        :param record: element of an array of face_dtype
+        """
+        return Face.from_vector(np.array(record, dtype=face_dtype).reshape(1).view(np.float64))
+
+    @staticmethod
+    def from_vector(vector):
+        face = Face()
+        face.dlib68_points = vector[0:136].reshape((68, 2))
+        face.right_eye = Eye.from_vector(vector[136:146], True)
+        face.left_eye = Eye.from_vector(vector[146:156], False)
+        face.orientation = vector[156:159].reshape((3, 1))
+        face.translation = vector[159:162].reshape((3, 1))
+        face.head_pose = (vector[162], vector[163])
+        return face
+
     def force_int(self):
         """
         Coerce the eye coordinates to integer
@@ -211,6 +324,8 @@ class Eye:
         Perchè fare occhio per occhio sarebbe da barbari.
     """
 
+    __slots__ = ("area", "is_right", "pupil_relative", "inner_corner_relative", "outer_corner_relative")
+
     def __init__(self, area, is_right):
         self.area = Rect(*area)
         self.is_right = is_right
@@ -222,6 +337,24 @@ class Eye:
     def zero(is_right):
         return Eye((0,0,0,0), is_right)
 
+    def as_vector(self, out):
+        """
+        :param out: float array of 10 elements: area, then the relative pupil, inner corner and outer corner
+        """
+        out[0:4] = self.area
+        out[4:6] = self.pupil_relative
+        out[6:8] = self.inner_corner_relative
+        out[8:10] = self.outer_corner_relative
+        return out
+
+    @staticmethod
+    def from_vector(vector, is_right):
+        eye = Eye(vector[0:4].tolist(), is_right)
+        eye.pupil_relative = Point(*vector[4:6].tolist())
+        eye.inner_corner_relative = Point(*vector[6:8].tolist())
+        eye.outer_corner_relative = Point(*vector[8:10].tolist())
+        return eye
+
     def force_int(self):
         self.area = Rect(x=int(self.area.x), y=int(self.area.y), width=int(self.area.width), height=int(self.area.height))
         self.pupil_relative = Point(x=int(self.pupil_relative.x), y=int(self.pupil_relative.y))
@@ -326,3 +459,52 @@ class Eye:
         return new_eye
 
     __rmul__ = __mul__
+
+
+assert(face_dtype.itemsize == Face.vector_size * 8)
+
+
+def faces_to_records(faces, out=None):
+    """
+    :param faces: list of Face
+    :param out: array of face_dtype, at least as long as faces, to write into (optional)
+    :return: array of face_dtype, one record per face
+    """
+    if out is None:
+        out = np.empty(len(faces), dtype=face_dtype)
+    matrix = out.view(np.float64).reshape((len(out), Face.vector_size))
+    for n, face in enumerate(faces):
+        face.as_vector(out=matrix[n])
+    return out
+
+
+def records_eye_vectors(eye_records):
+    """
+    Same as Eye.eye_vector, for a whole array of eyes (NaN or inf where the eye corners coincide)
+    :param eye_records: array of eye_dtype (e.g. face_records["right_eye"])
+    :return: (N,2) array
+    """
+    inner_corner = eye_records["inner_corner_relative"]
+    diameter = np.hypot(*(inner_corner - eye_records["outer_corner_relative"]).T)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (inner_corner - eye_records["pupil_relative"]) / diameter[:, np.newaxis]
+
+
+def records_normalized_eye_vectors(face_records, is_right):
+    """
+    Same as Face.normalized_right_eye_vector (or normalized_left_eye_vector), for a whole array of faces
+    :param face_records: array of face_dtype
+    :return: (N,2) array
+    """
+    eye_vectors = records_eye_vectors(face_records["right_eye" if is_right else "left_eye"])
+    # x is corrected by the rotation around the y axis, y by the rotation around the x axis
+    return eye_vectors / np.cos(face_records["orientation"][:, [1, 0]])
+
+
+def records_absolute_points(eye_records, name):
+    """
+    Same as Eye.pupil, Eye.inner_corner and Eye.outer_corner, for a whole array of eyes
+    :param name: "pupil", "inner_corner" or "outer_corner"
+    :return: (N,2) array
+    """
+    return eye_records["area"][:, 0:2] + eye_records[name + "_relative"]
@@ -1,12 +1,26 @@
 import argparse
+import logging
+import os
 import sys
+import time
+from functools import partial
 from math import sqrt, exp
+from queue import Queue, Empty
 
 import cv2
 import matplotlib
 
-from utils.gui.visualization import draw_routine
-from utils.process_frame import process_frame
+from utils.gui.visualization import draw_routine, draw_routine_faces
+from utils.process_frame import process_frame, process_frame_multi, landmarking_step, eye_features_extraction_step
+from utils.process_frame import FrameBuffers, rgb_to_single_channel
+from utils.pipeline import Pipeline
+from utils.face_association import FaceAssociator
+from utils.face_landmarks.dlib_based import enable_tracking as enable_landmark_tracking, set_detection_scale
+from utils.face_landmarks import landmark_cache
+from utils import profiling
+from utils.profiling import timed
+from utils import metrics
+from utils.logging import LogMaster
 
 matplotlib.use('TkAgg')
 import matplotlib.pyplot as plt
@@ -14,15 +28,21 @@ from skimage import exposure
 
 from classes import Tracker
 from utils.camera.capture import WebcamVideoStream
+from utils.camera.file_source import FileVideoStream, is_file_source
+from utils.results import FrameResults
+from utils.smoothing import smoothers, make_smoother, make_eye_vector_smoother, parse_params
 from utils.eyecenter.hough import PyHoughEyecenter
-from utils.eyecenter.timm.timm_and_barth import TimmAndBarth
+from utils.eyecenter.timm.timm_and_barth import TimmAndBarth, NumpyTimmAndBarth
 from utils.eyecenter.int_proj import GeneralIntegralProjection
-from utils.histogram.lsh_equalization import lsh_equalization
+from utils.histogram.lsh_equalization import lsh_equalization, set_engine as set_lsh_engine
+from utils.histogram.lsh_equalization import engines as lsh_engines
 
 from utils.bioID import BioIDFaceDatabase
+from utils.bioid_evaluation import evaluate, evaluate_parallel
 
 from utils.gui.tracking_board import TrackingBoard
 from utils.screen_mapping import mapper_implementations
+from utils.screen_mapping.mappers.poly_mapper import PolyMapper
 from utils.screen_mapping.screen_tools import get_screen_size
 from utils.screen_mapping.drive_scrolling import drive_scrolling
 
@@ -32,6 +52,7 @@ from app_control import app_controllers
 algos = {
     "hough": PyHoughEyecenter,
     "timm": TimmAndBarth,
+    "timm_np": NumpyTimmAndBarth,
     "gip": GeneralIntegralProjection,
 }
 equaliz = {
@@ -40,6 +61,16 @@ equaliz = {
     "lsh": lsh_equalization,
 }
 
+# messages about every frame (eye vectors, gaze points): buffered, and formatted only at the DEBUG level
+frame_logger = LogMaster.bufferedLogger("frames", logging.INFO)
+
+
+def log_eye_vectors(face_tracker, label=""):
+    if frame_logger.isEnabledFor(logging.DEBUG):
+        face = face_tracker.face
+        frame_logger.debug("%sright eyevector: %s, left eyevector: %s" % (label, face.normalized_right_eye_vector,
+                                                                         face.normalized_left_eye_vector))
+
 
 def get_cascade_files(cli):
     return {
@@ -57,7 +88,8 @@ def one_shot(cli, algo):
 
     cascade_files = get_cascade_files(cli)
 
-    picture, face, detect_string, not_eyes = process_frame(image_cv2, algo, cascade_files)
+    picture, face, detect_string, not_eyes = process_frame(image_cv2, algo, cascade_files,
+                                                               roi_equalization=cli.roi_equalization)
 
     print("Eye detection successful (%s)" % detect_string)
     print("Eyes (R,L):\n  %s,\n  %s" % (str(face.right_eye), str(face.left_eye)))
@@ -69,62 +101,81 @@ def one_shot(cli, algo):
     cv2.waitKey(-1)
 
 
-def test_run(cli, algo):
-    cascade_files = get_cascade_files(cli)
-
-    # define various accuracy metrics
-    accuracy_tiers = [
-        [0.25, "distance eye center-corner", 0],
-        [0.10, "iris diameter", 0],
-        [0.05, "pupil diameter", 0],
-    ]
-
-    def distance(expected, detected):
-        return sqrt((detected.pupil.x - expected.x)**2 +
-                    (detected.pupil.y - expected.y)**2)
-
-    def error_estimate(bioid_face, detect_righteye, detect_lefteye):
-        return max(distance(bioid_face.left_eye, detect_lefteye),
-                   distance(bioid_face.right_eye, detect_righteye)) / bioid_face.eye_center_distance
-
-    total_error = 0.0
-    missed_detections = 0
-
+def test_run(cli, algo, landmark_tracker=None):
+    if cli.jobs > 1 and landmark_tracker is not None:
+        # the workers do not track (and the pictures of a shard are unrelated anyway): the results would
+        # differ from the same run with --jobs 1
+        print("Error: --track-landmarks cannot be used with --jobs in the \"test\" mode")
+        sys.exit(-1)
     # initialize the BioID face database
     facedb = BioIDFaceDatabase(cli.bioid_folder)
     if len(facedb.faces) == 0:
         print("Error: bioid face database not found at \"%s\"" % cli.bioid_folder)
         sys.exit(-1)
-
-    # run the tests
-    print("Testing against %d faces" % len(facedb.faces))
-    for n, bioid_face in enumerate(facedb.faces):
-        picture, face, detect_string, not_eyes = process_frame(bioid_face.load_cv2(), algo, cascade_files, already_grayscale=True)
-        if face is None:
-            missed_detections += 1
+    # stable order, so that the per-image results of different runs can be compared
+    faces = sorted(facedb.faces, key=lambda bioid_face: bioid_face.filepath)
+
+    # one run for each face detection scale, to compare accuracy and latency
+    for scale in cli.detect_scale:
+        set_detection_scale(scale)
+        print("Face detection scale: %.2f" % scale)
+        print("Testing against %d faces" % len(faces))
+        time_started = time.perf_counter()
+        if cli.jobs > 1:
+            score = evaluate_parallel(setup_algorithm, cli, faces, scale, cli.jobs)
         else:
-            e = error_estimate(bioid_face, face.right_eye, face.left_eye)
-            total_error += e
-            for i in range(len(accuracy_tiers)):
-                if e <= accuracy_tiers[i][0]:
-                    accuracy_tiers[i][2] += 1
-        print("testing: done %.2f%%" % ((float(n)*100) / float(len(facedb.faces)),), end="\r")
-
-    total_detected = len(facedb.faces) - missed_detections
-    total_error /= total_detected
-
-    # print the results
-    print("Test results:                   ")
-    print("Correct detections: %d out of %d (%.2f)" % (total_detected,
-                                                       len(facedb.faces),
-                                                       float(total_detected) / len(facedb.faces)))
-    print("Average error: %f" % total_error)
-    print("Accuracy (tiered):")
-    for tier in accuracy_tiers:
-        print("    e <= %.2f (%s): %.2f" % (tier[0],tier[1], float(tier[2]) / total_detected))
-
-
-def live(cli, algo):
+            score = evaluate(algo, faces, roi_equalization=cli.roi_equalization, progress=True)
+        score.print_report(wall_time=time.perf_counter() - time_started)
+        if landmark_tracker is not None:
+            print("Landmark tracking: %s" % str(landmark_tracker))
+        # the workers of a parallel run have their own counters
+        if landmark_cache.active_cache is not None and cli.jobs <= 1:
+            print("Landmark cache: %s" % str(landmark_cache.active_cache))
+        if cli.output is not None:
+            output = cli.output
+            if len(cli.detect_scale) > 1:
+                root, extension = os.path.splitext(cli.output)
+                output = "%s_scale%.2f%s" % (root, scale, extension)
+            score.results.save(output)
+            print("Per-image results saved to \"%s\"" % output)
+
+
+def offline(cli, algo, landmark_tracker=None):
+    """
+    Process a video file or a directory of pictures as fast as possible (no display),
+    and save the per-frame results (see utils/results.py)
+    """
+    source = FileVideoStream(cli.file, decode_ahead=cli.decode_ahead)
+    cascade_files = get_cascade_files(cli)
+    results = FrameResults()
+    if cli.tracking:
+        # map the eye vectors of the whole session at once, when saving
+        tracker = Tracker(mapper_class(cli))
+        tracker.load_saved_cal_params()
+        results.set_gaze_mapper(tracker)
+    print("Processing %d frames from \"%s\"" % (len(source), cli.file))
+
+    source.start()
+    time_started = time.perf_counter()
+    while True:
+        frame_id, position, image_cv2 = source.read_sequenced()
+        if image_cv2 is None:
+            break
+        picture, face, detect_string, not_eyes = process_frame(image_cv2, algo, cascade_files,
+                                                               roi_equalization=cli.roi_equalization)
+        results.add(frame_id, face, timestamp=position)
+    elapsed = time.perf_counter() - time_started
+    source.stop()
+
+    output = cli.output if cli.output is not None else "results.npz"
+    results.save(output)
+    print("Processed %d frames in %.1f s (%.1f fps), %d with a face; results saved to \"%s\"" % (
+        len(results), elapsed, len(results) / max(elapsed, 1e-9), sum(results.detected), output))
+    if landmark_tracker is not None:
+        print("Landmark tracking: %s" % str(landmark_tracker))
+
+
+def live(cli, algo, landmark_tracker=None):
     # initialize asynchronus camera polling system
     camera = WebcamVideoStream(src=cli.camera_port,
                                debug=cli.debug,
@@ -151,42 +202,74 @@ def live(cli, algo):
     # load haar cascade files (note: haar cascades are disabled right now)
     cascade_files = get_cascade_files(cli)
     # initialize the tracker
-    tracker = Tracker(mapper_implementations[cli.mapping_function],
-                      smooth_frames=cli.smoothing,
-                      centroid_history_frames=cli.centroid_history,
-                      #smooth_weight_fun=lambda x: exp(-x*0.5)
-                      )
+    def make_tracker():
+        eye_vector_smoother, gaze_smoother = make_tracker_smoothers(cli)
+        new_tracker = Tracker(mapper_class(cli),
+                              smooth_frames=cli.smoothing,
+                              centroid_history_frames=cli.centroid_history,
+                              #smooth_weight_fun=lambda x: exp(-x*0.5)
+                              eye_vector_smoother=eye_vector_smoother,
+                              gaze_smoother=gaze_smoother)
+        if cli.tracking:
+            new_tracker.load_saved_cal_params()
+        return new_tracker
+    tracker = make_tracker()
+    # one tracker per face, in the multi-face mode
+    associator = FaceAssociator(make_tracker)
     # initialize the tracking blackboard
-    if cli.tracking:
-        if not cli.quiet:
-            trackboard = TrackingBoard(screensize=screensize)
-        tracker.load_saved_cal_params()
+    if cli.tracking and not cli.quiet:
+        trackboard = TrackingBoard(screensize=screensize)
+
+    def follow_gaze(face_tracker, label=""):
+        drive_scrolling(face_tracker, app, screensize)
+        log_eye_vectors(face_tracker, label)
 
+        if cli.tracking and not cli.quiet:
+            coord_right, coord_left, coord_centroid = face_tracker.get_onscreen_gaze_mapping()
+            if frame_logger.isEnabledFor(logging.DEBUG):
+                frame_logger.debug("right, left: %s %s" % (coord_right, coord_left))
+            head_pose = face_tracker.face.head_pose
+            trackboard.update(coord_right, coord_left, coord_centroid, head_pose)
+
+    last_frame_id = None
     while True:
-        image_cv2 = camera.read()
+        frame_id, captured, image_cv2 = camera.read_sequenced()
+        if last_frame_id is not None and frame_id > last_frame_id + 1:
+            metrics.count("frames_dropped_total", frame_id - last_frame_id - 1, stage="capture")
+        last_frame_id = frame_id
 
         if cli.debug and not cli.quiet:
             algo.clean_debug_axes()
 
-        picture, face, detect_string, not_eyes = process_frame(image_cv2, algo, cascade_files)
-
-        if face is not None and face.right_eye is not None and face.left_eye is not None:
-            tracker.update(face)
-            drive_scrolling(tracker, app, screensize)
-            print("right eyevector:", tracker.face.normalized_right_eye_vector)
-            print("left eyevector:", tracker.face.normalized_left_eye_vector)
+        if cli.multi_face:
+            picture, faces, detect_string, not_eyes = process_frame_multi(image_cv2, algo, cascade_files,
+                                                                          roi_equalization=cli.roi_equalization)
+            identities = associator.update(faces, timestamp=captured)
+            # the face which has been in view for the longest time drives the application
+            if len(identities) > 0:
+                follow_gaze(identities[0].tracker, label="face #%d " % identities[0].number)
+            for identity in identities[1:]:
+                log_eye_vectors(identity.tracker, label="face #%d " % identity.number)
+            if not cli.quiet:
+                draw_routine_faces(picture, [identity.tracker.face for identity in identities], not_eyes, "detection",
+                                   draw_unicorn=cli.unicorn,
+                                   labels=["#%d" % identity.number for identity in identities],
+                                   overlay_lines=profile_overlay(cli))
+        else:
+            picture, face, detect_string, not_eyes = process_frame(image_cv2, algo, cascade_files,
+                                                                   roi_equalization=cli.roi_equalization)
 
-            if cli.tracking and not cli.quiet:
-                coord_right, coord_left, coord_centroid = tracker.get_onscreen_gaze_mapping()
-                print("right, left: ", coord_right, coord_left)
-                head_pose = tracker.face.head_pose
-                trackboard.update(coord_right, coord_left, coord_centroid, head_pose)
+            if face is not None and face.right_eye is not None and face.left_eye is not None:
+                tracker.update(face, timestamp=captured)
+                follow_gaze(tracker)
 
-        smooth_face = tracker.face
-        if smooth_face is not None and smooth_face.right_eye is not None and smooth_face.left_eye is not None:
-            if not cli.quiet:
-                draw_routine(picture, smooth_face, not_eyes, "detection", draw_unicorn=cli.unicorn)
+            smooth_face = tracker.face
+            if smooth_face is not None and smooth_face.right_eye is not None and smooth_face.left_eye is not None:
+                if not cli.quiet:
+                    draw_routine(picture, smooth_face, not_eyes, "detection", draw_unicorn=cli.unicorn,
+                                 overlay_lines=profile_overlay(cli))
 
+        metrics.observe("frame_latency_seconds", time.perf_counter() - captured)
         key = cv2.waitKey(1)
         if key == 27: break
 
@@ -196,28 +279,205 @@ def live(cli, algo):
     if not cli.quiet:
         cv2.destroyAllWindows()  # I like the name of this function
     camera.stop()
+    if landmark_tracker is not None:
+        print("Landmark tracking: %s" % str(landmark_tracker))
 
 
-def main(cli):
+def live_pipelined(cli, algo, landmark_tracker=None):
+    """
+    Same as live (single face), with capture, landmarking, eye center extraction and mapping running
+    as a pipeline of worker threads (see utils/pipeline.py); rendering runs on the main thread
+    """
+    override_screensize = None
+    if cli.override_screensize != "None":
+        override_screensize = tuple(map(int, cli.override_screensize.split("x")))
+    screensize = get_screen_size(override_screensize=override_screensize)
+    app = app_controllers[cli.app]()
+
+    eye_vector_smoother, gaze_smoother = make_tracker_smoothers(cli)
+    tracker = Tracker(mapper_class(cli),
+                      smooth_frames=cli.smoothing,
+                      centroid_history_frames=cli.centroid_history,
+                      eye_vector_smoother=eye_vector_smoother,
+                      gaze_smoother=gaze_smoother)
+    if cli.tracking:
+        if not cli.quiet:
+            trackboard = TrackingBoard(screensize=screensize)
+        tracker.load_saved_cal_params()
+
+    # frames in flight must not share their work buffers: every frame takes a FrameBuffers from the free
+    # list as soon as it is captured, and gives it back once rendered, or when a queue drops it
+    free_buffers = Queue()
+
+    def release(job):
+        buffers = job[-1]
+        if isinstance(buffers, FrameBuffers):
+            free_buffers.put(buffers)
+
+    pipeline = Pipeline(queue_size=cli.pipeline_queue_size, on_drop=release)
+    last_frame_id = [None]
+
+    def capture():
+        # None on timeout, so that the stage can notice when the pipeline is stopped
+        frame_id, captured, image_cv2 = camera.read_sequenced(wait_new=True, timeout=0.1)
+        if image_cv2 is None:
+            return None
+        if last_frame_id[0] is not None and frame_id > last_frame_id[0] + 1:
+            metrics.count("frames_dropped_total", frame_id - last_frame_id[0] - 1, stage="capture")
+        last_frame_id[0] = frame_id
+        try:
+            buffers = free_buffers.get_nowait()
+        except Empty:
+            # more frames in flight than expected: never wait for a buffer, allocate one more
+            buffers = FrameBuffers()
+        # the camera ring slot is overwritten a few frames later: only the grayscale copy is queued
+        with timed("grayscale"):
+            single_channel = rgb_to_single_channel(image_cv2, buffers)
+        return single_channel, captured, buffers
+
+    def landmarks(job):
+        single_channel, captured, buffers = job
+        picture, face, detect_string, not_eyes = landmarking_step(single_channel, algo, already_grayscale=True,
+                                                                  roi_equalization=cli.roi_equalization,
+                                                                  buffers=buffers)
+        return picture, face, not_eyes, captured, buffers
+
+    def eye_centers(job):
+        picture, face, not_eyes, captured, buffers = job
+        if face is not None:
+            eye_features_extraction_step(picture, face.right_eye, face.left_eye, algo)
+        return job
+
+    def mapping(job):
+        picture, face, not_eyes, captured, buffers = job
+        gaze = None
+        if face is not None and face.right_eye is not None and face.left_eye is not None:
+            tracker.update(face, timestamp=captured)
+            drive_scrolling(tracker, app, screensize)
+            if cli.tracking:
+                gaze = tracker.get_onscreen_gaze_mapping()
+        return picture, tracker.face, not_eyes, gaze, captured, buffers
+
+    def render(job):
+        picture, smooth_face, not_eyes, gaze, captured, buffers = job
+        if not cli.quiet:
+            if gaze is not None and cli.tracking:
+                coord_right, coord_left, coord_centroid = gaze
+                trackboard.update(coord_right, coord_left, coord_centroid, smooth_face.head_pose)
+            if smooth_face is not None and smooth_face.right_eye is not None and smooth_face.left_eye is not None:
+                draw_routine(picture, smooth_face, not_eyes, "detection", draw_unicorn=cli.unicorn,
+                             overlay_lines=profile_overlay(cli))
+        metrics.observe("frame_latency_seconds", time.perf_counter() - captured)
+        release(job)
+        key = cv2.waitKey(1)
+        if key == 27:
+            pipeline.stop()
+
+    pipeline.add_source("capture", capture)
+    pipeline.add_stage("landmarks", landmarks)
+    pipeline.add_stage("eye centers", eye_centers)
+    pipeline.add_stage("mapping", mapping)
+    for _ in range(pipeline.max_items_in_flight):
+        free_buffers.put(FrameBuffers())
+    # the capture stage copies every frame out of the camera ring right away, so the default ring is enough
+    camera = WebcamVideoStream(src=cli.camera_port,
+                               debug=cli.debug,
+                               contrast=None if cli.contrast == "None" else float(cli.contrast),
+                               saturation=None if cli.saturation == "None" else float(cli.saturation)
+                               )
+    camera.start()
+    try:
+        # re-raises the exception of a failed stage
+        pipeline.run_sink("render", render)
+    finally:
+        if not cli.quiet:
+            cv2.destroyAllWindows()
+        camera.stop()
+    if landmark_tracker is not None:
+        print("Landmark tracking: %s" % str(landmark_tracker))
+
+
+def setup_algorithm(cli):
+    """
+    :return: the eye features extractor selected on the command line, ready to use
+    """
     algo = algos[cli.algo]()
     algo.equalization = equaliz[cli.equalization]
+    set_lsh_engine(cli.lsh_engine, threads=cli.lsh_threads, chunk=cli.lsh_bin_chunk)
 
     if cli.algo == "timm":
         algo.context.load_program(program_path="cl_kernels/timm_barth_smallpic_kernel.cl")
         #algo.context.load_program()
 
-    if cli.file == "-":
-        live(cli, algo)
+    set_detection_scale(cli.detect_scale[0])
+    landmark_cache.enable(cli.landmark_cache, max_mib=cli.landmark_cache_size)
+    return algo
+
+
+def mapper_class(cli):
+    """
+    :return: the eye-vector to screen mapper class selected on the command line, with its training options
+    """
+    model_class = mapper_implementations[cli.mapping_function]
+    if issubclass(model_class, PolyMapper):
+        return partial(model_class, ridge=cli.mapping_ridge, fit=cli.mapping_fit)
+    return model_class
+
+
+def make_tracker_smoothers(cli):
+    """
+    :return: tuple (eye vector smoother, gaze smoother) selected on the command line, (None, None) for the
+        moving averages set by --smoothing and --centroid-history
+    """
+    if cli.smoother == "average":
+        return None, None
+    return (make_eye_vector_smoother(cli.smoother, **parse_params(cli.eye_smoother_param)),
+            make_smoother(cli.smoother, **parse_params(cli.gaze_smoother_param)))
+
+
+def profile_overlay(cli):
+    """
+    :return: the stage timings to draw on the detection window, None if not requested
+    """
+    if cli.profile_overlay and profiling.active_profiler is not None:
+        return profiling.active_profiler.overlay_lines()
+    return None
+
+
+def main(cli):
+    algo = setup_algorithm(cli)
+    landmark_tracker = enable_landmark_tracking(cli.track_landmarks)
+    profiler = profiling.enable() if cli.profile or cli.profile_overlay else None
+    frame_logger.setLevel(cli.log_level)
+    exporter = None
+    if cli.metrics_port is not None or cli.metrics_file is not None:
+        exporter = metrics.enable(port=cli.metrics_port, path=cli.metrics_file, interval=cli.metrics_interval)
+
+    if cli.file == "-" and cli.pipelined:
+        live_pipelined(cli, algo, landmark_tracker=landmark_tracker)
+    elif cli.file == "-":
+        live(cli, algo, landmark_tracker=landmark_tracker)
     elif cli.file == "test":
-        test_run(cli, algo)
+        test_run(cli, algo, landmark_tracker=landmark_tracker)
+    elif is_file_source(cli.file):
+        offline(cli, algo, landmark_tracker=landmark_tracker)
     else:
         one_shot(cli, algo)
 
+    if profiler is not None:
+        profiler.stop()
+        print("Stage timings:")
+        for line in profiler.summary_lines():
+            print("    " + line)
+    if exporter is not None:
+        exporter.stop()
 
-def parsecli():
+
+def build_parser():
     parser = argparse.ArgumentParser(description="Eye tracking experiment")
     # main generic parameters
-    parser.add_argument('file', help='filename of the picture; - for webcam; \"test\" to run a performance test', type=str)
+    parser.add_argument('file', help='filename of the picture; - for webcam; \"test\" to run a performance test; '
+                                     'a video file or a directory of pictures to process them offline', type=str)
     parser.add_argument('-d', '--debug', help='enable debug mode', action='store_true')
     parser.add_argument('-A', '--app', help='drive the scrolling of an application. Default is None.', type=str, default="None", choices=app_controllers.keys())
     parser.add_argument('-q', '--quiet', help='suppress all windows, except the application one (see -A)', action='store_true')
@@ -239,23 +499,110 @@ def parsecli():
                         type=str, default="hough", choices=algos.keys())
     parser.add_argument('-e', '--equalization', help='type of histogram equalization to use',
                         type=str, default="ah", choices=equaliz.keys())
+    parser.add_argument('--roi-equalization', help='detect the face on the raw frame, and equalize only the eye regions',
+                        action='store_true')
+    parser.add_argument('--lsh-engine', help='implementation of the lsh histogram equalization (see -e)',
+                        type=str, default="fused", choices=lsh_engines.keys())
+    parser.add_argument('--lsh-threads', metavar='int', help='worker threads for the cpu lsh engine',
+                        type=int, default=1)
+    parser.add_argument('--lsh-bin-chunk', metavar='int',
+                        help='compute the lsh equalization N histogram bins at a time, to bound the peak memory',
+                        type=int, default=None)
+    parser.add_argument('--detect-scale', metavar='float', nargs='+',
+                        help='run the face detector on the frame resized by this factor, in (0, 1] (upsampling only '
+                             'at 1.0); the \"test\" mode accepts several values and compares them',
+                        type=detection_scale, default=[1.0])
+    parser.add_argument('--track-landmarks', metavar='int',
+                        help='re-use the face found in the previous frame, running the face detector only every N frames (0 to disable)',
+                        type=int, default=0)
+    parser.add_argument('--profile', help='time every stage of the frame processing, printing the percentiles '
+                                          'of the last 300 frames every 5 seconds and on exit (in the main process only)',
+                        action='store_true')
+    parser.add_argument('--profile-overlay', help='same as --profile, and draw the stage timings on the detection window',
+                        action='store_true')
+    parser.add_argument('--log-level', help='DEBUG also logs the eye vectors and gaze points of every frame',
+                        type=str, default="INFO", choices=["DEBUG", "INFO", "WARNING"])
+    parser.add_argument('--metrics-port', metavar='PORT',
+                        help='serve the tracker metrics on http://127.0.0.1:PORT/metrics (Prometheus text format)',
+                        type=int, default=None)
+    parser.add_argument('--metrics-file', metavar='FILE', help='append the tracker metrics to a JSON-lines file',
+                        type=str, default=None)
+    parser.add_argument('--metrics-interval', metavar='SECONDS', help='write the metrics file every N seconds',
+                        type=float, default=5.0)
+    parser.add_argument('--landmark-cache', metavar='FILE',
+                        help='cache the face detection, landmarks and head pose of every picture in FILE, '
+                             'to skip them when the same pictures are processed again (e.g. tuning runs)',
+                        type=str, default=None)
+    parser.add_argument('--landmark-cache-size', metavar='MiB', help='size bound of the landmark cache',
+                        type=int, default=512)
     # gaze tracking parameters
     parser.add_argument('-u', '--unicorn', help='draw a debug vector indicating the face orientation', action='store_true')
-    parser.add_argument('-t', '--tracking', help='display the eye tracking whiteboard', action='store_true')
+    parser.add_argument('-t', '--tracking', help='display the eye tracking whiteboard (offline run: also save the '
+                                                 'on-screen gaze of every frame)', action='store_true')
     parser.add_argument('-m', '--mapping-function', help='eye-vector to screen mapping function to use',
                         type=str, default="poly_quad", choices=mapper_implementations.keys())
+    parser.add_argument('--mapping-fit', help='training data of the poly_quad and poly_lin mappings: the mean eye vector '
+                                              'of every calibration point, the same weighted by its number of samples, '
+                                              'or every sample',
+                        type=str, default="means", choices=PolyMapper.fit_modes)
+    parser.add_argument('--mapping-ridge', metavar='float',
+                        help='ridge regularization of the poly_quad and poly_lin mappings (0 to disable)',
+                        type=float, default=0.0)
     parser.add_argument('-o', '--override-screensize', metavar='1366x768', help='specify the size of your tracking board',
                         type=str, default="None")
+    parser.add_argument('--multi-face', help='track all the faces in view, each with its own identity and tracker '
+                                             '(the one in view for the longest time drives the application)',
+                        action='store_true')
+    parser.add_argument('--pipelined', help='run capture, landmarking, eye center extraction, mapping and rendering '
+                                            'as a pipeline of threads, dropping frames when a stage falls behind '
+                                            '(single face only)',
+                        action='store_true')
+    parser.add_argument('--pipeline-queue-size', metavar='int', help='capacity of the queues between the pipeline stages',
+                        type=int, default=1)
     parser.add_argument('--smoothing', metavar='int',
                         help='smooth the tracking data averaging across the last N frames',
                         type=int, default=1)
     parser.add_argument('--centroid-history', metavar='int',
                         help='compute the gaze centroid across the last N frames',
                         type=int, default=5)
+    parser.add_argument('--smoother', help='filter of the eye vectors and of the gaze centroid: the moving averages '
+                                           'of --smoothing and --centroid-history, or a predictive filter with less lag',
+                        type=str, default="average", choices=smoothers.keys())
+    parser.add_argument('--eye-smoother-param', metavar='NAME=VALUE',
+                        help='parameter of the kalman or one_euro smoother of the eye vectors (repeatable), '
+                             'e.g. beta=10',
+                        action='append', default=[])
+    parser.add_argument('--gaze-smoother-param', metavar='NAME=VALUE',
+                        help='parameter of the kalman or one_euro smoother of the gaze centroid, in screen pixels '
+                             '(repeatable), e.g. beta=0.1',
+                        action='append', default=[])
+    # offline processing
+    parser.add_argument('--output', metavar='OUTPUT',
+                        help='.npz or .csv file with the per-frame results of an offline run (default results.npz), '
+                             'or with the per-image results of the \"test\" mode',
+                        type=str, default=None)
+    parser.add_argument('--decode-ahead', metavar='int', help='frames decoded in advance in an offline run',
+                        type=int, default=16)
     # other
+    parser.add_argument('-j', '--jobs', metavar='int', help='worker processes for the \"test\" mode',
+                        type=int, default=1)
     parser.add_argument('--bioid-folder', metavar='BIOID_FOLDER', help='BioID face database folder, to use in the \"test\" mode',
                         type=str, default="../../BioID-FaceDatabase-V1.2")
-    return parser.parse_args()
+    return parser
+
+
+def detection_scale(value):
+    """
+    argparse type of --detect-scale, see set_detection_scale
+    """
+    scale = float(value)
+    if scale <= 0 or scale > 1.0:
+        raise argparse.ArgumentTypeError("face detection scale must be in (0, 1], got %s" % value)
+    return scale
+
+
+def parsecli():
+    return build_parser().parse_args()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,156 @@
+"""
+Parameter sweep of the eye center algorithms on the BioID database: runs the accuracy test of main.py
+("test" mode) for every combination of a grid of algorithms, equalizations and tuning parameters, and
+prints a table of accuracy versus time per frame, marking the Pareto-optimal combinations (no other
+combination is both more accurate and faster).
+
+usage: python sweep.py [-a ALGO ...] [-e EQUALIZATION ...] [--locality-factor F ...] [--max-w N ...]
+                       [--alpha A ...] [--tier T] [--limit N] [--table FILE] [main.py options]
+Options not listed here (e.g. --bioid-folder, --jobs, --roi-equalization, --detect-scale) are passed to
+main.py. Use --landmark-cache: the face detection and landmarks do not depend on the swept parameters, so
+only the eye center stage (and the equalization) is computed for every combination. The cache is filled by
+an untimed run for every equalization before the sweep, so that all the combinations are timed alike (the
+ms/frame then includes a cache lookup instead of the face detection).
+
+example: python sweep.py -a timm_np gip -e h lsh --locality-factor 0.05 0.1 0.15 --alpha 0.2 0.4 0.6
+             --landmark-cache landmarks.sqlite --limit 300
+"""
+import argparse
+import copy
+import csv
+import itertools
+import time
+
+from main import algos, equaliz, build_parser, setup_algorithm
+from utils.bioID import BioIDFaceDatabase
+from utils.bioid_evaluation import accuracy_tiers, evaluate, evaluate_parallel
+from utils.face_landmarks import landmark_cache
+
+
+# tuning parameter -> algorithms having it (as an attribute of the same name)
+tuned_parameters = {
+    "locality_factor": ("timm", "timm_np"),
+    "max_w": ("timm", "timm_np"),
+    "alpha": ("gip",),
+}
+
+
+def grid(algorithms, equalizations, parameter_values):
+    """
+    :param parameter_values: dict tuning parameter -> list of values (empty list: keep the default)
+    :return: generator of tuples (algorithm, equalization, dict of the parameters to set)
+    """
+    for algorithm in algorithms:
+        names = [name for name, values in parameter_values.items()
+                 if values and algorithm in tuned_parameters[name]]
+        for equalization in equalizations:
+            for values in itertools.product(*[parameter_values[name] for name in names]):
+                yield algorithm, equalization, dict(zip(names, values))
+
+
+def setup_combination(cli):
+    """
+    Same as main.setup_algorithm, then sets the swept parameters (runs in the worker processes too)
+    """
+    algo = setup_algorithm(cli)
+    for name, value in cli.sweep_parameters.items():
+        setattr(algo, name, value)
+    return algo
+
+
+def pareto_front(rows):
+    """
+    :param rows: list of tuples (accuracy, ms per frame)
+    :return: set of the indices of the rows not dominated by any other one
+    """
+    front = set()
+    for i, (accuracy, cost) in enumerate(rows):
+        dominated = any(other_accuracy >= accuracy and other_cost <= cost and
+                        (other_accuracy > accuracy or other_cost < cost)
+                        for other_accuracy, other_cost in rows)
+        if not dominated:
+            front.add(i)
+    return front
+
+
+def describe(parameters):
+    return " ".join("%s=%g" % (name, value) for name, value in sorted(parameters.items())) or "-"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Eye center parameter sweep on the BioID database")
+    parser.add_argument('-a', '--algo', nargs='+', choices=algos.keys(), default=["timm_np", "gip"])
+    parser.add_argument('-e', '--equalization', nargs='+', choices=equaliz.keys(), default=["h", "lsh"])
+    parser.add_argument('--locality-factor', nargs='+', type=float, default=[])
+    parser.add_argument('--max-w', nargs='+', type=int, default=[])
+    parser.add_argument('--alpha', nargs='+', type=float, default=[])
+    parser.add_argument('--tier', metavar='T', help='error threshold of the accuracy used for the Pareto front',
+                        type=float, default=0.10, choices=[threshold for threshold, _ in accuracy_tiers])
+    parser.add_argument('--limit', metavar='N', help='test on N evenly spaced pictures only', type=int, default=None)
+    parser.add_argument('--table', metavar='FILE', help='also save the table as .csv', type=str, default=None)
+    args, main_args = parser.parse_known_args()
+    base_cli = build_parser().parse_args(["test"] + main_args)
+    tier = [threshold for threshold, _ in accuracy_tiers].index(args.tier)
+
+    facedb = BioIDFaceDatabase(base_cli.bioid_folder)
+    faces = sorted(facedb.faces, key=lambda bioid_face: bioid_face.filepath)
+    if len(faces) == 0:
+        raise Exception("bioid face database not found at \"%s\"" % base_cli.bioid_folder)
+    if args.limit is not None:
+        faces = faces[::max(len(faces) // args.limit, 1)][:args.limit]
+
+    combinations = list(grid(args.algo, args.equalization, {"locality_factor": args.locality_factor,
+                                                            "max_w": args.max_w,
+                                                            "alpha": args.alpha}))
+    def run(algorithm, equalization, parameters):
+        cli = copy.copy(base_cli)
+        cli.algo = algorithm
+        cli.equalization = equalization
+        cli.sweep_parameters = parameters
+        if cli.jobs > 1:
+            return evaluate_parallel(setup_combination, cli, faces, cli.detect_scale[0], cli.jobs)
+        return evaluate(setup_combination(cli), faces, roi_equalization=cli.roi_equalization)
+
+    if base_cli.landmark_cache is not None:
+        # the first combination of every equalization would pay for the face detection, the next ones for
+        # a cache lookup only: fill the cache first, so that the ranking does not depend on the grid order
+        for equalization in args.equalization:
+            print("Filling the landmark cache (equalization %s)" % equalization)
+            run(args.algo[0], equalization, {})
+
+    print("Sweeping %d combinations on %d faces" % (len(combinations), len(faces)))
+    rows = []
+    for n, (algorithm, equalization, parameters) in enumerate(combinations):
+        print("[%d/%d] %s %s %s" % (n + 1, len(combinations), algorithm, equalization, describe(parameters)))
+        time_started = time.perf_counter()
+        score = run(algorithm, equalization, parameters)
+        rows.append((algorithm, equalization, parameters, score, time.perf_counter() - time_started))
+
+    front = pareto_front([(score.accuracy(tier), score.ms_per_frame()) for _, _, _, score, _ in rows])
+    header = (["pareto", "algo", "equalization", "parameters", "detected"] +
+              ["e<=%.2f" % threshold for threshold, _ in accuracy_tiers] +
+              ["ms/frame", "landmarks ms", "eye centers ms", "wall s"])
+    table = []
+    for i in sorted(range(len(rows)), key=lambda i: rows[i][3].ms_per_frame()):
+        algorithm, equalization, parameters, score, wall_time = rows[i]
+        table.append(["*" if i in front else "", algorithm, equalization, describe(parameters),
+                      "%d/%d" % (score.total_detected, score.total_faces)] +
+                     ["%.3f" % score.accuracy(t) for t in range(len(accuracy_tiers))] +
+                     ["%.1f" % score.ms_per_frame(), "%.1f" % score.ms_per_frame("landmarks"),
+                      "%.1f" % score.ms_per_frame("eye centers"), "%.1f" % wall_time])
+
+    print("Pareto front: accuracy at e <= %.2f versus ms/frame (marked with *)" % args.tier)
+    widths = [max(len(str(line[column])) for line in [header] + table) for column in range(len(header))]
+    for line in [header] + table:
+        print("  ".join(str(field).ljust(width) for field, width in zip(line, widths)).rstrip())
+    if landmark_cache.active_cache is not None and base_cli.jobs <= 1:
+        print("Landmark cache: %s" % str(landmark_cache.active_cache))
+    if args.table is not None:
+        with open(args.table, "w", newline="") as fp:
+            writer = csv.writer(fp)
+            writer.writerow(header)
+            writer.writerows(table)
+
+
+if __name__ == "__main__":
+    main()
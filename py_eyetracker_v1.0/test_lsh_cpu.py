@@ -0,0 +1,64 @@
+from math import exp, sqrt
+
+import numpy as np
+import pytest
+
+from utils.histogram.lsh_cpu import lsh_equalization_cpu, illumination_invariant_features_cpu
+
+
+def random_image(shape=(37, 52), seed=0):
+    image = np.random.RandomState(seed).rand(*shape).astype(np.float32)
+    image[0, :5] = 1.0  # solid white goes in the last bin
+    return image
+
+
+def reference_pass(hist, norm, alpha, axis):
+    """
+    Straight port of cl_kernels/lsh_1D_x.cl (axis 1) and lsh_1D_y.cl (axis 0) on (width, height, num_bins)
+    volumes: the histogram subtracts the input of the pass, the normalization subtracts 1.0
+    """
+    hist = np.moveaxis(hist, axis, 0)
+    norm = np.moveaxis(norm, axis, 0)
+    hist_l, norm_l = hist.copy(), norm.copy()
+    hist_r, norm_r = hist.copy(), norm.copy()
+    for i in range(1, len(hist)):
+        hist_l[i] += alpha * hist_l[i - 1]
+        norm_l[i] += alpha * norm_l[i - 1]
+    for i in reversed(range(0, len(hist) - 1)):
+        hist_r[i] += alpha * hist_r[i + 1]
+        norm_r[i] += alpha * norm_r[i + 1]
+    return np.moveaxis(hist_l + hist_r - hist, 0, axis), np.moveaxis(norm_l + norm_r - 1.0, 0, axis)
+
+
+def reference_lsh_equalization(image, sigma=0.15, num_bins=32, k=0.1):
+    """
+    Same sequence of kernels as lsh.locality_sensitive_histogram_cl followed by the IIF
+    """
+    width, height = np.shape(image)
+    alpha_x = exp(-sqrt(2.0) / (sigma * width))
+    alpha_y = exp(-sqrt(2.0) / (sigma * height))
+    bins = np.minimum(np.floor(image * num_bins).astype(np.intp), num_bins - 1)
+    q = (bins[:, :, np.newaxis] == np.arange(num_bins)).astype(np.float64)
+    hist, norm = reference_pass(q, np.ones_like(q), alpha_y, axis=0)
+    hist, norm = reference_pass(hist, norm, alpha_x, axis=1)
+    return illumination_invariant_features_cpu(image, hist / norm, k=k)
+
+
+@pytest.mark.parametrize("threads, bin_chunk", [(None, None), (1, 5), (3, None), (4, 3)])
+def test_cpu_matches_reference(threads, bin_chunk):
+    image = random_image()
+    expected = reference_lsh_equalization(image)
+    computed = lsh_equalization_cpu(image, threads=threads, bin_chunk=bin_chunk)
+    assert computed.shape == expected.shape
+    assert np.allclose(computed, expected, rtol=1e-4, atol=1e-5)
+
+
+def test_cpu_matches_cl():
+    cl = pytest.importorskip("pyopencl")
+    if not any(platform.get_devices() for platform in cl.get_platforms()):
+        pytest.skip("no opencl device available")
+    from utils.histogram.lsh_equalization import lsh_equalization_chained, lsh_equalization_fused
+    image = random_image()
+    computed = lsh_equalization_cpu(image)
+    for engine in (lsh_equalization_chained, lsh_equalization_fused):
+        assert np.allclose(engine(image), computed, rtol=1e-3, atol=1e-4)
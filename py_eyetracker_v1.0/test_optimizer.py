@@ -1,6 +1,12 @@
+import time
+from itertools import combinations
+
 import numpy as np
 
-from utils.screen_mapping.mappers.optimizer import compute_params
+from classes import Observation
+from utils.screen_mapping.mappers.optimizer import compute_params, solve_params
+from utils.screen_mapping.mappers.poly_mapper import PolyQuadMapper, PolyLinMapper
+from utils.screen_mapping.mappers.fuzzy_mapper import FuzzyMapper, convex_hull, diameter
 
 screen_x = 1366
 screen_y = 768
@@ -18,9 +24,150 @@ centers = [(radius + padding, screen_y - radius - padding),
            (screen_x/2, radius + padding),
            (screen_x - radius - padding, radius + padding)]
 
-random_vectors = [np.random.rand(2) for _ in range(len(centers))]
+
+def random_vectors(seed=0):
+    return [np.random.RandomState(seed + n).rand(2) for n in range(len(centers))]
+
+
+def synthetic_observations(mapper, params_x, params_y, samples=200, noise=0.01, seed=0):
+    """
+    Calibration points whose eye vectors are mapped exactly to the centers by (params_x, params_y), with
+    gaussian noise on the samples
+    """
+    random = np.random.RandomState(seed)
+    observations = []
+    for n, center in enumerate(centers):
+        # eye vectors on a 3x3 grid, in the same layout as the centers
+        eye_vector = np.array([(n % 3) * 0.2 - 0.2, (n // 3) * 0.1 - 0.1])
+        vectors = eye_vector + random.normal(0, noise, (samples, 2))
+        screen_point = (mapper.oneD_map_function(eye_vector, params_x), mapper.oneD_map_function(eye_vector, params_y))
+        observations.append(Observation(screen_point=screen_point, left_eyevectors=list(vectors),
+                                        right_eyevectors=list(vectors)))
+    return observations
+
+
+def test_closed_form_matches_least_squares():
+    for mapper in (PolyQuadMapper(), PolyLinMapper()):
+        eye_vectors = random_vectors()
+        expected = compute_params(centers, eye_vectors, mapper.oneD_map_function, mapper.num_params)
+        computed = solve_params(centers, mapper.design_matrix(np.array(eye_vectors)))
+        for expected_params, computed_params in zip(expected, computed):
+            residual_expected = [mapper.oneD_map_function(v, expected_params) for v in eye_vectors]
+            residual_computed = [mapper.oneD_map_function(v, computed_params) for v in eye_vectors]
+            assert np.allclose(residual_computed, residual_expected, atol=1e-3)
+
+
+def test_design_matrix_matches_map_function():
+    params = np.random.RandomState(1).normal(0, 100, 6)
+    eye_vectors = np.array(random_vectors())
+    for mapper in (PolyQuadMapper(), PolyLinMapper()):
+        expected = [mapper.oneD_map_function(v, params[:mapper.num_params]) for v in eye_vectors]
+        assert np.allclose(mapper.design_matrix(eye_vectors).dot(params[:mapper.num_params]), expected)
+
+
+def test_recovers_exact_params():
+    mapper = PolyQuadMapper()
+    params_x = np.array([683.0, 2000.0, 50.0, 300.0, -400.0, 80.0])
+    params_y = np.array([384.0, -30.0, 1800.0, 150.0, 60.0, -500.0])
+    eye_vectors = np.random.RandomState(2).uniform(-0.3, 0.3, (50, 2))
+    screen_points = np.column_stack([mapper.design_matrix(eye_vectors).dot(params_x),
+                                     mapper.design_matrix(eye_vectors).dot(params_y)])
+    computed_x, computed_y = solve_params(screen_points, mapper.design_matrix(eye_vectors))
+    assert np.allclose(computed_x, params_x) and np.allclose(computed_y, params_y)
+
+
+def test_weights_match_repeated_points():
+    mapper = PolyLinMapper()
+    eye_vectors = np.array(random_vectors())
+    weights = np.arange(1, len(centers) + 1)
+    weighted = solve_params(centers, mapper.design_matrix(eye_vectors), weights=weights)
+    repeated = solve_params(np.repeat(centers, weights, axis=0),
+                            mapper.design_matrix(np.repeat(eye_vectors, weights, axis=0)))
+    assert np.allclose(weighted, repeated)
+
+
+def test_ridge_shrinks_params():
+    mapper = PolyQuadMapper()
+    design = mapper.design_matrix(np.array(random_vectors()))
+    plain = solve_params(centers, design)
+    ridge = solve_params(centers, design, ridge=1.0)
+    for plain_params, ridge_params in zip(plain, ridge):
+        assert np.linalg.norm(ridge_params[1:]) < np.linalg.norm(plain_params[1:])
+
+
+def test_train_from_data():
+    params_x = np.array([683.0, 2000.0, 50.0, 300.0, -400.0, 80.0])
+    params_y = np.array([384.0, -30.0, 1800.0, 150.0, 60.0, -500.0])
+    for fit in PolyQuadMapper.fit_modes:
+        mapper = PolyQuadMapper(fit=fit)
+        observations = synthetic_observations(mapper, params_x, params_y)
+        mapper.train_from_data(observations, is_left=True)
+        for obs in observations:
+            mapped = mapper.map_point(np.mean(obs.left_eyevectors, axis=0))
+            assert np.hypot(mapped.x - obs.screen_point[0], mapped.y - obs.screen_point[1]) < 30
+
+
+def test_map_points_matches_map_point():
+    params_x = np.array([683.0, 2000.0, 50.0, 300.0, -400.0, 80.0])
+    params_y = np.array([384.0, -30.0, 1800.0, 150.0, 60.0, -500.0])
+    observations = synthetic_observations(PolyQuadMapper(), params_x, params_y, samples=20)
+    eye_vectors = np.random.RandomState(3).uniform(-0.3, 0.3, (100, 2))
+    for mapper in (PolyQuadMapper(), PolyLinMapper(), FuzzyMapper()):
+        mapper.train_from_data(observations)
+        expected = np.array([tuple(mapper.map_point(eye_vector)) for eye_vector in eye_vectors])
+        assert np.allclose(mapper.map_points(eye_vectors), expected)
+        assert mapper.map_points(np.zeros((0, 2))).shape == (0, 2)
+
+
+def test_fuzzy_neighbourhood_is_largest_distance():
+    eye_vectors = np.random.RandomState(4).normal(0, 0.1, (200, 2))
+    pairwise = np.hypot(eye_vectors[:, 0:1] - eye_vectors[:, 0], eye_vectors[:, 1:2] - eye_vectors[:, 1])
+    assert np.isclose(diameter(convex_hull(eye_vectors)), pairwise.max())
+    # collinear points
+    assert np.isclose(diameter(convex_hull([(0, 0), (1, 1), (3, 3), (2, 2)])), np.hypot(3, 3))
+
+
+def test_fuzzy_incremental_matches_retrain():
+    random = np.random.RandomState(5)
+    observations = [Observation(screen_point=tuple(random.uniform(0, 1000, 2)),
+                                right_eyevectors=list(random.normal(center, 0.01, (5, 2))),
+                                left_eyevectors=list(random.normal(center, 0.01, (5, 2))))
+                    for center in random.uniform(-0.3, 0.3, (150, 2))]
+    eye_vectors = random.uniform(-0.3, 0.3, (100, 2))
+    retrained = FuzzyMapper()
+    retrained.train_from_data(observations)
+    incremental = FuzzyMapper()
+    for obs in observations:
+        incremental.add_observations([obs])
+    assert np.isclose(incremental.neighbourhood, retrained.neighbourhood)
+    assert np.allclose(incremental.map_points(eye_vectors), retrained.map_points(eye_vectors))
+
+
+def test_fuzzy_uses_top_n_on_ties():
+    # four calibration points at the same distance, with different screen points: exactly top_n of them
+    # (any of them, their weights are equal) are averaged
+    mapper = FuzzyMapper()
+    targets = np.array([(150.0, 300.0), (300.0, 0.0), (0.0, 600.0), (900.0, 900.0)])
+    mapper.add_points([(1, 0), (0, 1), (-1, 0), (0, -1)], targets)
+    mapped = mapper.map_points(np.zeros((1, 2)))[0]
+    weight = np.exp(-1.0 / mapper.neighbourhood)
+    expected = [weight * np.sum(targets[list(subset)], axis=0) / (FuzzyMapper.top_n * weight + 0.0001)
+                for subset in combinations(range(len(targets)), FuzzyMapper.top_n)]
+    assert any(np.allclose(mapped, candidate) for candidate in expected)
 
 
-params_x, params_y = compute_params(centers, random_vectors)
-print(params_x)
-print(params_y)
+if __name__ == "__main__":
+    # training time on the raw samples of a calibration (9 points)
+    for samples in (10, 100, 1000):
+        mapper = PolyQuadMapper(fit="samples")
+        observations = synthetic_observations(mapper, np.ones(6), np.ones(6), samples=samples)
+        time_started = time.perf_counter()
+        for _ in range(20):
+            mapper.train_from_data(observations)
+        closed_form = (time.perf_counter() - time_started) * 1000.0 / 20
+        screen_points, eye_vectors, _ = mapper.training_data(observations)
+        time_started = time.perf_counter()
+        compute_params(screen_points, eye_vectors, mapper.oneD_map_function, mapper.num_params)
+        iterative = (time.perf_counter() - time_started) * 1000.0
+        print("%d samples: closed form %.3f ms, least_squares %.1f ms" % (
+            len(eye_vectors), closed_form, iterative))
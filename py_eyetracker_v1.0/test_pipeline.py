@@ -0,0 +1,131 @@
+import time
+from threading import Thread
+
+from utils.pipeline import DropOldestQueue, Pipeline
+
+
+def test_queue_drops_oldest():
+    dropped = []
+    queue = DropOldestQueue(maxsize=2, on_drop=dropped.append)
+    for item in range(5):
+        queue.put(item)
+    assert dropped == [0, 1, 2]
+    assert queue.dropped == 3
+    assert [queue.get(timeout=0), queue.get(timeout=0)] == [3, 4]
+
+
+def test_queue_get_times_out():
+    queue = DropOldestQueue(maxsize=1)
+    time_started = time.perf_counter()
+    assert queue.get(timeout=0.05) is None
+    assert time.perf_counter() - time_started >= 0.04
+
+
+def test_queue_get_waits_for_put():
+    queue = DropOldestQueue(maxsize=1)
+    Thread(target=lambda: (time.sleep(0.05), queue.put("item"))).start()
+    assert queue.get(timeout=5) == "item"
+
+
+def test_closed_queue_is_drained_then_empty():
+    queue = DropOldestQueue(maxsize=2)
+    queue.put(1)
+    queue.close()
+    assert queue.get(timeout=5) == 1
+    time_started = time.perf_counter()
+    assert queue.get(timeout=5) is None
+    assert time.perf_counter() - time_started < 1
+
+
+def run_pipeline(frames, sink_delay=0.0, queue_size=1):
+    """
+    Numbers 0 .. frames - 1 through two stages, into a sink which stops the pipeline at the last one
+    :return: tuple (pipeline, items received by the sink, items dropped by the queues)
+    """
+    produced = iter(range(frames))
+    received = []
+    dropped = []
+
+    def source():
+        return next(produced, None)
+
+    def sink(item):
+        received.append(item)
+        time.sleep(sink_delay)
+        if item == frames - 1:
+            pipeline.stop()
+
+    pipeline = Pipeline(queue_size=queue_size, report_interval=None, on_drop=dropped.append)
+    pipeline.add_source("source", source)
+    pipeline.add_stage("first", lambda item: item)
+    pipeline.add_stage("second", lambda item: item)
+    pipeline.run_sink("sink", sink)
+    return pipeline, received, dropped
+
+
+def test_pipeline_delivers_in_order():
+    pipeline, received, dropped = run_pipeline(200, queue_size=1000)
+    assert received == list(range(200))
+    assert dropped == []
+
+
+def test_pipeline_drops_for_a_slow_sink():
+    pipeline, received, dropped = run_pipeline(100, sink_delay=0.002)
+    # every item is either received or dropped, never both, and the order is kept
+    assert received == sorted(received)
+    assert sorted(received + dropped) == list(range(100))
+    assert len(dropped) == sum(queue.dropped for queue in pipeline.queues) > 0
+
+
+def test_pipeline_stop_ends_every_stage():
+    pipeline, received, dropped = run_pipeline(50)
+    assert all(stage.stopped for stage in pipeline.stages)
+    for stage in pipeline.stages[:-1]:
+        stage.thread.join(timeout=5)
+        assert not stage.thread.is_alive()
+    assert all(queue.closed for queue in pipeline.queues)
+
+
+def test_failing_stage_stops_the_pipeline():
+    produced = iter(range(100))
+
+    def fail_from_ten(item):
+        # not just at 10: the queue in front of the stage may drop it
+        if item >= 10:
+            raise ValueError("stage failure")
+        return item
+
+    pipeline = Pipeline(report_interval=None)
+    pipeline.add_source("source", lambda: next(produced, None))
+    pipeline.add_stage("failing", fail_from_ten)
+    result = []
+    finished = Thread(target=lambda: result.append(raises(lambda: pipeline.run_sink("sink", lambda item: None))),
+                      daemon=True)
+    finished.start()
+    finished.join(timeout=5)
+    assert not finished.is_alive()
+    assert isinstance(result[0], ValueError)
+    assert all(stage.stopped for stage in pipeline.stages)
+
+
+def test_failing_sink_stops_the_pipeline():
+    produced = iter(range(100))
+
+    def sink(item):
+        raise KeyError(item)
+
+    pipeline = Pipeline(report_interval=None)
+    pipeline.add_source("source", lambda: next(produced, None))
+    assert isinstance(raises(lambda: pipeline.run_sink("sink", sink)), KeyError)
+    assert all(stage.stopped for stage in pipeline.stages)
+
+
+def raises(function):
+    """
+    :return: the exception raised by function, None if it returns
+    """
+    try:
+        function()
+    except Exception as e:
+        return e
+    return None
@@ -0,0 +1,116 @@
+import time
+
+import numpy as np
+import pytest
+from skimage import exposure
+
+from utils.eyecenter.timm.timm_and_barth import NumpyTimmAndBarth
+from utils.eyecenter.timm.np_runner import NPTimmBarth
+
+
+def synthetic_eye(shape=(60, 90), center=(28, 51), radius=11, seed=0):
+    """
+    Bright patch with a dark disk (the pupil) and a bit of noise
+    """
+    rows, cols = np.mgrid[0:shape[0], 0:shape[1]]
+    image = np.full(shape, 0.8)
+    image[(rows - center[0]) ** 2 + (cols - center[1]) ** 2 < radius ** 2] = 0.15
+    image += np.random.RandomState(seed).normal(0, 0.03, shape)
+    return exposure.equalize_hist(np.clip(image, 0, 1))
+
+
+def bruteforce_timm_barth(x_gradient, y_gradient, inverse):
+    """
+    Straight port of cl_kernels/timm_barth_smallpic_kernel.cl
+    """
+    width, height = np.shape(inverse)
+    rows, cols = np.mgrid[0:width, 0:height]
+    result = np.empty((width, height))
+    for center_y in range(width):
+        for center_x in range(height):
+            displac_x = cols - center_x
+            displac_y = rows - center_y
+            displac_norm = np.sqrt(displac_x ** 2 + displac_y ** 2) + 0.00001
+            dotprod = (displac_x * x_gradient + displac_y * y_gradient) / displac_norm
+            result[center_y, center_x] = np.sum(dotprod[dotprod > 0] ** 2) * inverse[center_y, center_x]
+    return result / (width * height)
+
+
+def get_cl_runner(precomputation):
+    cl = pytest.importorskip("pyopencl")
+    if not any(platform.get_devices() for platform in cl.get_platforms()):
+        pytest.skip("no opencl device available")
+    from utils.eyecenter.timm.cl_runner import CLTimmBarth
+    runner = CLTimmBarth(precomputation=precomputation)
+    runner.load_program(program_path="cl_kernels/timm_barth_smallpic_kernel.cl")
+    return runner
+
+
+def assert_same_objective(expected, computed):
+    assert computed.shape == expected.shape
+    assert np.max(np.abs(computed - expected)) < 0.01 * np.max(expected)
+    assert np.unravel_index(computed.argmax(), computed.shape) == \
+           np.unravel_index(expected.argmax(), expected.shape)
+
+
+def test_numpy_matches_bruteforce():
+    algo = NumpyTimmAndBarth()
+    eye_image = synthetic_eye(shape=(24, 36), center=(11, 20), radius=5)
+    expected = bruteforce_timm_barth(*algo.precomputation(eye_image))
+    computed = algo.context.compute(eye_image, locality=0)
+    assert_same_objective(expected, computed)
+
+
+def test_numpy_matches_cl():
+    algo = NumpyTimmAndBarth()
+    eye_image = synthetic_eye()
+    cl_runner = get_cl_runner(algo.precomputation)
+    expected = cl_runner.compute(eye_image, locality=0)
+    computed = algo.context.compute(eye_image, locality=0)
+    assert_same_objective(expected, computed)
+
+
+def test_numpy_finds_pupil():
+    algo = NumpyTimmAndBarth()
+    tb_image = algo.context.compute(synthetic_eye(), locality=0)
+    center = np.unravel_index(tb_image.argmax(), tb_image.shape)
+    assert abs(center[0] - 28) <= 2 and abs(center[1] - 51) <= 2
+
+
+def test_numpy_batch_matches_single():
+    algo = NumpyTimmAndBarth()
+    eye_images = [synthetic_eye(), synthetic_eye(shape=(40, 70), center=(20, 30), radius=8, seed=1)]
+    computed = algo.context.compute_batch(eye_images, [0, 0])
+    for eye_image, tb_image in zip(eye_images, computed):
+        assert_same_objective(algo.context.compute(eye_image, locality=0), tb_image)
+
+
+def benchmark(runner, eye_image, repeat=20):
+    runner.compute(eye_image, locality=0)  # warm up (kernel build / fft plans)
+    time_started = time.perf_counter()
+    for _ in range(repeat):
+        runner.compute(eye_image, locality=0)
+    return (time.perf_counter() - time_started) * 1000.0 / repeat
+
+
+if __name__ == "__main__":
+    # per-eye latency at the patch size cap used by TimmAndBarth.detect_eye_features (max_w = 120)
+    algo = NumpyTimmAndBarth()
+    eye_image = synthetic_eye(shape=(120, 120), center=(60, 60), radius=20)
+    print("numpy: %.2f ms/eye" % benchmark(NPTimmBarth(precomputation=algo.precomputation), eye_image))
+    for faces in (1, 2, 4):
+        eye_images = [eye_image] * (2 * faces)
+        runner = NPTimmBarth(precomputation=algo.precomputation)
+        runner.compute_batch(eye_images, [0] * len(eye_images))
+        time_started = time.perf_counter()
+        for _ in range(5):
+            runner.compute_batch(eye_images, [0] * len(eye_images))
+        print("numpy, batch of %d faces: %.2f ms/face" % (
+            faces, (time.perf_counter() - time_started) * 1000.0 / (5 * faces)))
+    try:
+        from utils.eyecenter.timm.cl_runner import CLTimmBarth
+        cl_runner = CLTimmBarth(precomputation=algo.precomputation)
+        cl_runner.load_program(program_path="cl_kernels/timm_barth_smallpic_kernel.cl")
+        print("opencl: %.2f ms/eye" % benchmark(cl_runner, eye_image, repeat=5))
+    except Exception as e:
+        print("opencl: not available (%s)" % str(e))
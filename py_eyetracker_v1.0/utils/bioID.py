@@ -1,27 +1,64 @@
 from math import sqrt
 import cv2
 import os
+import sys
 import csv
 
+import numpy as np
+
 from classes import Point
 
 
+# files written by pack_database, inside the database folder
+pack_images_file = "bioid_pack.npy"
+pack_index_file = "bioid_pack_index.npy"
+
+pack_index_dtype = np.dtype([
+    ("name", "U64"),
+    ("height", np.int32),
+    ("width", np.int32),
+    ("right_eye", np.int32, 2),
+    ("left_eye", np.int32, 2),
+])
+
+# memory-mapped packs opened by this process, by path (see Face.load_cv2)
+open_packs = {}
+
+
+def open_pack(path):
+    if path not in open_packs:
+        open_packs[path] = np.load(path, mmap_mode="r")
+    return open_packs[path]
+
+
 class Face:
 
-    def __init__(self, filepath, right_eye, left_eye):
+    def __init__(self, filepath, right_eye, left_eye, pack_path=None, pack_index=None):
+        """
+        :param pack_path: images file of a pack (see pack_database) holding the picture of this face
+        :param pack_index: position of the picture in the pack
+        """
         assert(isinstance(right_eye, Point))
         assert (isinstance(left_eye, Point))
         self.filepath = filepath
         self.right_eye = right_eye
         self.left_eye = left_eye
+        self.pack_path = pack_path
+        self.pack_index = pack_index
+        self.shape = None
 
     @property
     def eye_center_distance(self):
         return sqrt((self.right_eye.x - self.left_eye.x) ** 2 + (self.right_eye.y - self.left_eye.y) ** 2)
 
     def load_cv2(self):
-        image_cv2 = cv2.imread(self.filepath)
-        return cv2.cvtColor(image_cv2, cv2.COLOR_RGB2GRAY)
+        """
+        :return: the grayscale picture; when packed, a read-only view of the memory-mapped pack
+        """
+        if self.pack_path is None:
+            return cv2.imread(self.filepath, cv2.IMREAD_GRAYSCALE)
+        (height, width) = self.shape
+        return open_pack(self.pack_path)[self.pack_index, :height, :width]
 
 
 class BioIDFaceDatabase:
@@ -30,16 +67,32 @@ class BioIDFaceDatabase:
     img_format = ".pgm"
     eye_data_format = ".eye"
 
-    def __init__(self, folder):
+    def __init__(self, folder, use_pack=True):
+        """
+        :param use_pack: read the pictures from the pack of the folder, if there is one (see pack_database)
+        """
         self.faces = []
-        self.load_from_dir(folder)
+        if use_pack and os.path.exists(os.path.join(folder, pack_index_file)):
+            self.load_from_pack(folder)
+        else:
+            self.load_from_dir(folder)
 
     def load_from_dir(self, folder):
-        for filename in os.listdir(folder):
+        for filename in sorted(os.listdir(folder)):
             if filename.endswith(self.img_format):
                 basename = filename[:-len(self.img_format)]
                 self.load_data_item(os.path.join(folder,basename))
 
+    def load_from_pack(self, folder):
+        index = np.load(os.path.join(folder, pack_index_file))
+        images_path = os.path.join(folder, pack_images_file)
+        for n, item in enumerate(index):
+            newface = Face(os.path.join(folder, str(item["name"])),
+                           Point(*map(int, item["right_eye"])), Point(*map(int, item["left_eye"])),
+                           pack_path=images_path, pack_index=n)
+            newface.shape = (int(item["height"]), int(item["width"]))
+            self.faces.append(newface)
+
     def load_data_item(self, basename):
         right_eye, left_eye = self.load_eye_data(basename + self.eye_data_format)
         newface = Face(basename + self.img_format, right_eye, left_eye)
@@ -51,3 +104,40 @@ class BioIDFaceDatabase:
             rows = list(eyereader)
             (lx, ly, rx, ry) = rows[1]
             return Point(int(rx), int(ry)), Point(int(lx), int(ly))
+
+
+def pack_database(folder):
+    """
+    Decode every picture of the database once, and store them (with the eye positions) in two .npy files
+    inside the folder: an images array (number of pictures x height x width, smaller pictures are zero padded)
+    and an index. BioIDFaceDatabase memory-maps the images array, so the pictures are loaded lazily and the
+    pages are shared by every process reading the same pack.
+    :return: number of pictures packed
+    """
+    database = BioIDFaceDatabase(folder, use_pack=False)
+    if os.path.exists(os.path.join(folder, pack_index_file)):
+        os.remove(os.path.join(folder, pack_index_file))
+    index = np.zeros(len(database.faces), dtype=pack_index_dtype)
+    images = [face.load_cv2() for face in database.faces]
+    for item, face, image in zip(index, database.faces, images):
+        item["name"] = os.path.basename(face.filepath)
+        item["height"], item["width"] = image.shape
+        item["right_eye"] = face.right_eye
+        item["left_eye"] = face.left_eye
+
+    shape = (len(images), max(index["height"], default=0), max(index["width"], default=0))
+    packed = np.lib.format.open_memmap(os.path.join(folder, pack_images_file), mode="w+", dtype=np.uint8, shape=shape)
+    for n, image in enumerate(images):
+        packed[n] = 0
+        packed[n, :image.shape[0], :image.shape[1]] = image
+    packed.flush()
+    del packed
+    # the index goes last: its presence marks a complete pack
+    np.save(os.path.join(folder, pack_index_file), index)
+    return len(images)
+
+
+if __name__ == "__main__":
+    # one-time ingest: python -m utils.bioID BIOID_FOLDER
+    folder = sys.argv[1] if len(sys.argv) > 1 else "../../BioID-FaceDatabase-V1.2"
+    print("Packed %d pictures into \"%s\"" % (pack_database(folder), os.path.join(folder, pack_images_file)))
@@ -0,0 +1,177 @@
+"""
+Accuracy evaluation against the BioID face database, either in the calling process or sharded
+across a pool of worker processes (each with its own detector, shape predictor and algorithm).
+"""
+import time
+from math import sqrt
+from multiprocessing import get_context
+
+from utils.face_landmarks.dlib_based import load_models, set_detection_scale
+from utils.process_frame import landmarking_step, eye_features_extraction_step
+from utils.results import FrameResults
+
+
+# relative error thresholds, see error_estimate
+accuracy_tiers = [
+    (0.25, "distance eye center-corner"),
+    (0.10, "iris diameter"),
+    (0.05, "pupil diameter"),
+]
+
+
+def distance(expected, detected):
+    return sqrt((detected.pupil.x - expected.x)**2 +
+                (detected.pupil.y - expected.y)**2)
+
+
+def error_estimate(bioid_face, detect_righteye, detect_lefteye):
+    return max(distance(bioid_face.left_eye, detect_lefteye),
+               distance(bioid_face.right_eye, detect_righteye)) / bioid_face.eye_center_distance
+
+
+class BioIDScore:
+    """
+    Accumulated accuracy of a run (or of a part of it: scores can be merged), plus the
+    per-image results
+    """
+
+    def __init__(self):
+        self.total_faces = 0
+        self.missed_detections = 0
+        self.total_error = 0.0
+        self.total_time = 0.0
+        # stage name -> total time spent in it
+        self.stage_times = {}
+        self.tier_counts = [0] * len(accuracy_tiers)
+        self.results = FrameResults(extra_columns=("error",))
+
+    @property
+    def total_detected(self):
+        return self.total_faces - self.missed_detections
+
+    def add(self, n, bioid_face, face, stage_times):
+        """
+        :param n: index of the image in the database
+        :param face: face object found in the image (see classes.py), None if the detection failed
+        :param stage_times: dict stage name -> processing time, in seconds
+        """
+        self.total_faces += 1
+        for stage, elapsed in stage_times.items():
+            self.stage_times[stage] = self.stage_times.get(stage, 0.0) + elapsed
+            self.total_time += elapsed
+        e = float("nan")
+        if face is None:
+            self.missed_detections += 1
+        else:
+            e = error_estimate(bioid_face, face.right_eye, face.left_eye)
+            self.total_error += e
+            for i in range(len(accuracy_tiers)):
+                if e <= accuracy_tiers[i][0]:
+                    self.tier_counts[i] += 1
+        self.results.add(n, face, name=bioid_face.filepath, extra={"error": e})
+
+    def merge(self, other):
+        self.total_faces += other.total_faces
+        self.missed_detections += other.missed_detections
+        self.total_error += other.total_error
+        self.total_time += other.total_time
+        for stage, elapsed in other.stage_times.items():
+            self.stage_times[stage] = self.stage_times.get(stage, 0.0) + elapsed
+        self.tier_counts = [a + b for a, b in zip(self.tier_counts, other.tier_counts)]
+        self.results.extend(other.results)
+        return self
+
+    def ms_per_frame(self, stage=None):
+        """
+        :param stage: name of a stage, None for the whole processing
+        """
+        elapsed = self.total_time if stage is None else self.stage_times.get(stage, 0.0)
+        return elapsed * 1000 / max(self.total_faces, 1)
+
+    def accuracy(self, tier):
+        """
+        :param tier: index in accuracy_tiers
+        :return: fraction of the detected faces within the error threshold of the tier
+        """
+        return float(self.tier_counts[tier]) / max(self.total_detected, 1)
+
+    def print_report(self, wall_time=None):
+        total_detected = max(self.total_detected, 1)
+        print("Test results:                   ")
+        print("Correct detections: %d out of %d (%.2f)" % (self.total_detected,
+                                                           self.total_faces,
+                                                           float(self.total_detected) / max(self.total_faces, 1)))
+        print("Average error: %f" % (self.total_error / total_detected))
+        print("Average time per frame: %.1f ms (%s)" % (
+            self.ms_per_frame(), ", ".join("%s %.1f ms" % (stage, self.ms_per_frame(stage))
+                                           for stage in self.stage_times)))
+        if wall_time is not None:
+            print("Throughput: %.1f frames/s" % (self.total_faces / max(wall_time, 1e-9)))
+        print("Accuracy (tiered):")
+        for tier, (threshold, description) in enumerate(accuracy_tiers):
+            print("    e <= %.2f (%s): %.2f" % (threshold, description, self.accuracy(tier)))
+
+
+def evaluate(algo, faces, roi_equalization=False, first_index=0, progress=False):
+    """
+    :param faces: list of BioID faces (see utils/bioID.py)
+    :param first_index: index of faces[0] in the database
+    :return: BioIDScore
+    """
+    score = BioIDScore()
+    for n, bioid_face in enumerate(faces):
+        image_cv2 = bioid_face.load_cv2()
+        # same as process_frame, timing its two halves
+        time_started = time.perf_counter()
+        picture, face, detect_string, not_eyes = landmarking_step(image_cv2, algo, already_grayscale=True,
+                                                                  roi_equalization=roi_equalization)
+        time_landmarks = time.perf_counter()
+        if face is not None:
+            eye_features_extraction_step(picture, face.right_eye, face.left_eye, algo)
+        time_done = time.perf_counter()
+        score.add(first_index + n, bioid_face, face, {"landmarks": time_landmarks - time_started,
+                                                      "eye centers": time_done - time_landmarks})
+        if progress and n % max(len(faces) // 100, 1) == 0:
+            print("testing: done %.2f%%" % ((float(n)*100) / float(len(faces)),), end="\r")
+    return score
+
+
+# state of a worker process, see init_worker
+worker_algo = None
+worker_roi_equalization = False
+
+
+def init_worker(setup_function, cli):
+    """
+    Runs once in every worker process
+    :param setup_function: function(cli) returning the algorithm instance to use
+    """
+    global worker_algo, worker_roi_equalization
+    worker_algo = setup_function(cli)
+    worker_roi_equalization = cli.roi_equalization
+    load_models()
+
+
+def evaluate_shard(task):
+    scale, first_index, faces = task
+    set_detection_scale(scale)
+    return evaluate(worker_algo, faces, roi_equalization=worker_roi_equalization, first_index=first_index)
+
+
+def evaluate_parallel(setup_function, cli, faces, scale, jobs, shards_per_job=4):
+    """
+    Shard faces across a pool of jobs worker processes, and merge their scores
+    :param setup_function: function(cli) returning the algorithm instance to use (must be picklable, and set
+        up all the module state it needs, as the workers start from a fresh interpreter)
+    :return: BioIDScore
+    """
+    shard_size = max(len(faces) // (jobs * shards_per_job), 1)
+    tasks = [(scale, first, faces[first:first + shard_size]) for first in range(0, len(faces), shard_size)]
+    score = BioIDScore()
+    # spawned, not forked: the caller may have created the opencl context and queue (utils.cl_context), which
+    # cannot be used from a forked child; every worker creates its own in setup_function
+    with get_context("spawn").Pool(jobs, initializer=init_worker, initargs=(setup_function, cli)) as pool:
+        for done, shard_score in enumerate(pool.imap_unordered(evaluate_shard, tasks)):
+            score.merge(shard_score)
+            print("testing: done %.2f%%" % ((float(done + 1)*100) / float(len(tasks)),), end="\r")
+    return score
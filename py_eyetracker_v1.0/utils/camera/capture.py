@@ -1,9 +1,19 @@
-from threading import Thread
+from threading import Thread, Condition
+import time
+
+import numpy as np
 import cv2
 
 
 class WebcamVideoStream:
-    def __init__(self, src=0, contrast=None, saturation=None, debug=False):
+    """
+    Polls the camera on a background thread.
+    Every frame gets a sequence number (frame_id) and a capture timestamp (time.perf_counter), and is
+    written into a preallocated ring of ring_size buffers: a frame returned by read() stays valid until
+    ring_size - 1 newer frames have been captured.
+    """
+
+    def __init__(self, src=0, contrast=None, saturation=None, debug=False, ring_size=3):
         # initialize the video camera stream and read the first frame
         # from the stream
         self.stream = cv2.VideoCapture(src)
@@ -27,33 +37,74 @@ class WebcamVideoStream:
             print("camera saturation is", self.stream.get(cv2.CAP_PROP_SATURATION))
         (self.grabbed, self.frame) = self.stream.read()
 
+        # ring of frame buffers, the first one holds the frame just read
+        self.ring = [self.frame] + [np.empty_like(self.frame) if self.frame is not None else None
+                                    for _ in range(ring_size - 1)]
+        self.frame_id = 0 if self.grabbed else -1
+        self.timestamp = time.perf_counter()
+        self.last_read_id = -1
+        self.condition = Condition()
+        self.thread = None
+
         # initialize the variable used to indicate if the thread should
         # be stopped
         self.stopped = False
 
     def start(self):
         # start the thread to read frames from the video stream
-        Thread(target=self.update, args=()).start()
+        self.thread = Thread(target=self.update, args=(), daemon=True)
+        self.thread.start()
         return self
 
     def update(self):
         # keep looping infinitely until the thread is stopped
-        while True:
-            # if the thread indicator variable is set, stop the thread
-            if self.stopped:
-                return
+        while not self.stopped:
+            # read the next frame straight into the next buffer of the ring
+            slot = (self.frame_id + 1) % len(self.ring)
+            grabbed, frame = self.stream.read(image=self.ring[slot])
+            if not grabbed:
+                time.sleep(0.01)
+                continue
+            # opencv allocates a new array if the buffer does not fit (e.g. first frame, resolution change)
+            self.ring[slot] = frame
+
+            with self.condition:
+                self.grabbed = grabbed
+                self.frame = frame
+                self.frame_id += 1
+                self.timestamp = time.perf_counter()
+                self.condition.notify_all()
 
-            # otherwise, read the next frame from the stream
-            (self.grabbed, self.frame) = self.stream.read()
+    def read_sequenced(self, wait_new=True, timeout=None):
+        """
+        :param wait_new: block until a frame newer than the last one returned arrives
+        :param timeout: give up waiting after N seconds (None: wait forever)
+        :return: tuple (frame id, capture timestamp, frame); (None, None, None) on timeout
+        """
+        with self.condition:
+            if wait_new:
+                if not self.condition.wait_for(lambda: self.frame_id > self.last_read_id or self.stopped, timeout):
+                    return None, None, None
+            self.last_read_id = self.frame_id
+            return self.frame_id, self.timestamp, self.frame
 
-    def read(self):
-        # return the frame most recently read
-        return self.frame
+    def read(self, wait_new=True, timeout=None):
+        """
+        :param wait_new: block until a frame newer than the last one returned arrives
+            (False: return the most recent frame, even if it was already returned)
+        :param timeout: give up waiting after N seconds (None: wait forever)
+        :return: the frame, None on timeout
+        """
+        return self.read_sequenced(wait_new=wait_new, timeout=timeout)[2]
 
     def stop(self):
         # indicate that the thread should be stopped
         self.stopped = True
+        with self.condition:
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join()
         if self.saved_contrast is not None:
             self.stream.set(cv2.CAP_PROP_CONTRAST, self.saved_contrast)
         if self.saved_saturation is not None:
-            self.stream.set(cv2.CAP_PROP_SATURATION, self.saved_saturation)
\ No newline at end of file
+            self.stream.set(cv2.CAP_PROP_SATURATION, self.saved_saturation)
@@ -0,0 +1,118 @@
+import os
+from queue import Queue, Empty, Full
+from threading import Thread
+
+import cv2
+
+
+video_extensions = (".avi", ".mp4", ".mkv", ".mov", ".webm", ".mpg", ".mpeg", ".wmv")
+image_extensions = (".png", ".jpg", ".jpeg", ".bmp", ".pgm", ".ppm", ".tif", ".tiff")
+
+
+def is_file_source(path):
+    """
+    :return: True if path is a video file or a directory of pictures (see FileVideoStream)
+    """
+    return os.path.isdir(path) or path.lower().endswith(video_extensions)
+
+
+class FileVideoStream:
+    """
+    Same interface as WebcamVideoStream, reading the frames of a video file or of a directory of
+    pictures (in name order) instead of a camera.
+    The frames are decoded ahead on a background thread, into a bounded queue: no frame is ever
+    dropped, the decoder just waits when it is decode_ahead frames ahead of the reader.
+
+    finished: True once the reader has got all the frames (read() then returns None)
+    """
+
+    def __init__(self, src, decode_ahead=16):
+        self.src = src
+        self.files = None
+        self.stream = None
+        if os.path.isdir(src):
+            self.files = sorted(os.path.join(src, name) for name in os.listdir(src)
+                                if name.lower().endswith(image_extensions))
+        else:
+            self.stream = cv2.VideoCapture(src)
+            if not self.stream.isOpened():
+                raise Exception("cannot open video file \"%s\"" % src)
+        self.queue = Queue(maxsize=decode_ahead)
+        self.thread = None
+        self.stopped = False
+        self.finished = False
+
+    def __len__(self):
+        if self.files is not None:
+            return len(self.files)
+        return int(self.stream.get(cv2.CAP_PROP_FRAME_COUNT))
+
+    def start(self):
+        # start the thread to decode the frames
+        self.thread = Thread(target=self.update, args=(), daemon=True)
+        self.thread.start()
+        return self
+
+    def frames(self):
+        """
+        :return: generator of tuples (frame id, position in the source, frame); the position is in
+            seconds for videos, and the index of the picture for directories
+        """
+        if self.files is not None:
+            for frame_id, path in enumerate(self.files):
+                frame = cv2.imread(path)
+                if frame is not None:
+                    yield frame_id, float(frame_id), frame
+        else:
+            frame_id = 0
+            while True:
+                grabbed, frame = self.stream.read()
+                if not grabbed:
+                    return
+                yield frame_id, self.stream.get(cv2.CAP_PROP_POS_MSEC) / 1000.0, frame
+                frame_id += 1
+
+    def put(self, item):
+        # blocks while the queue is full, but keeps checking whether the stream was stopped
+        while not self.stopped:
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def update(self):
+        for item in self.frames():
+            if not self.put(item):
+                return
+        # end of the source
+        self.put(None)
+
+    def read_sequenced(self, wait_new=True, timeout=None):
+        """
+        :param wait_new: ignored, every frame is returned exactly once
+        :param timeout: give up waiting after N seconds (None: wait until the next frame is decoded)
+        :return: tuple (frame id, position in the source, frame); (None, None, None) at the end of
+            the source or on timeout
+        """
+        if self.finished:
+            return None, None, None
+        try:
+            item = self.queue.get(timeout=timeout)
+        except Empty:
+            return None, None, None
+        if item is None:
+            self.finished = True
+            return None, None, None
+        return item
+
+    def read(self, wait_new=True, timeout=None):
+        return self.read_sequenced(wait_new=wait_new, timeout=timeout)[2]
+
+    def stop(self):
+        self.stopped = True
+        if self.thread is not None:
+            self.thread.join()
+        if self.stream is not None:
+            self.stream.release()
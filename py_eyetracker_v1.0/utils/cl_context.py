@@ -0,0 +1,112 @@
+"""
+Process-wide opencl state, shared by all the opencl runners:
+- a single context and command queue
+- compiled programs, cached in memory and (as device binaries) on disk
+- per-runner pools of device buffers, reused across frames
+"""
+import hashlib
+import os
+
+import pyopencl as cl
+
+
+program_cache_dir = os.path.join(os.path.expanduser("~"), ".cache", "py_eyetracker", "cl_programs")
+
+context = None
+queue = None
+programs = {}
+
+
+def get_context():
+    global context, queue
+    if context is None:
+        context = cl.create_some_context()
+        queue = cl.CommandQueue(context)
+    return context
+
+
+def get_queue():
+    get_context()
+    return queue
+
+
+def get_device():
+    return get_context().devices[0]
+
+
+def program_key(source):
+    device = get_device()
+    fingerprint = "\n".join([device.platform.name, device.name, device.driver_version, cl.VERSION_TEXT, source])
+    return hashlib.sha1(fingerprint.encode("utf-8")).hexdigest()
+
+
+def build_from_binary(binary_path):
+    with open(binary_path, "rb") as fp:
+        binary = fp.read()
+    program = cl.Program(get_context(), [get_device()], [binary])
+    return program.build()
+
+
+def build_from_source(source, binary_path):
+    program = cl.Program(get_context(), source).build()
+    try:
+        os.makedirs(program_cache_dir, exist_ok=True)
+        with open(binary_path, "wb") as fp:
+            fp.write(program.get_info(cl.program_info.BINARIES)[0])
+    except OSError:
+        pass  # the cache is just an optimization
+    return program
+
+
+def load_program(program_path, defines=None):
+    """
+    Build (or fetch from the cache) an opencl program
+    :param program_path: path of the .cl source file
+    :param defines: dict of preprocessor symbols, prepended to the source as #define lines
+    :return: built pyopencl Program
+    """
+    with open(program_path, "r") as fp:
+        source = fp.read()
+    if defines:
+        source = "".join("#define %s %s\n" % (k, str(v)) for k, v in sorted(defines.items())) + source
+
+    key = program_key(source)
+    if key not in programs:
+        binary_path = os.path.join(program_cache_dir, key + ".bin")
+        program = None
+        if os.path.exists(binary_path):
+            try:
+                program = build_from_binary(binary_path)
+            except (cl.Error, OSError):
+                program = None  # stale or corrupted binary: rebuild it
+        if program is None:
+            program = build_from_source(source, binary_path)
+        programs[key] = program
+    return programs[key]
+
+
+class BufferPool:
+    """
+    Device buffers of a runner, keyed on (name, size, flags).
+    As long as the frame shape does not change, the same buffers get reused frame after frame.
+    """
+
+    def __init__(self):
+        self.buffers = {}
+
+    def get(self, name, nbytes, flags=cl.mem_flags.READ_WRITE):
+        key = (name, nbytes, flags)
+        if key not in self.buffers:
+            # drop the stale buffer with the same role, if any
+            self.buffers = {k: v for k, v in self.buffers.items() if k[0] != name}
+            self.buffers[key] = cl.Buffer(get_context(), flags, size=nbytes)
+        return self.buffers[key]
+
+    def upload(self, name, host_array, flags=cl.mem_flags.READ_ONLY):
+        buf = self.get(name, host_array.nbytes, flags)
+        cl.enqueue_copy(get_queue(), buf, host_array)
+        return buf
+
+    def download(self, buf, host_array):
+        cl.enqueue_copy(get_queue(), host_array, buf)
+        return host_array
@@ -20,4 +20,12 @@ class EyeFeaturesExtractor:
                 ax.clear()
 
     def detect_eye_features(self, eye_image, eye_object):
-        pass
\ No newline at end of file
+        pass
+
+    def detect_eye_features_batch(self, eye_images, eye_objects):
+        """
+        Same as detect_eye_features, for many eyes at once (e.g. the eyes of all the faces in a frame).
+        Extractors which can share work across the eyes override this.
+        """
+        for eye_image, eye_object in zip(eye_images, eye_objects):
+            self.detect_eye_features(eye_image, eye_object)
@@ -1,6 +1,8 @@
 import pyopencl as cl
 import numpy as np
 
+from utils import cl_context
+
 
 class CLTimmBarth:
     """
@@ -9,12 +11,14 @@ class CLTimmBarth:
 
     def __init__(self, precomputation=lambda i: i):
         self.precomputation = precomputation
-        self.context = cl.create_some_context()
-        self.queue = cl.CommandQueue(self.context)
+        self.context = cl_context.get_context()
+        self.queue = cl_context.get_queue()
+        self.buffers = cl_context.BufferPool()
 
     def load_program(self, program_path="cl_kernels/timm_barth_kernel.cl"):
-        with open(program_path, "r") as fp:
-            self.program = cl.Program(self.context, fp.read()).build()
+        self.program = cl_context.load_program(program_path)
+        self.kernel = cl.Kernel(self.program, "timm_and_barth")
+        self.kernel.set_scalar_arg_dtypes([np.intc, np.intc, np.intc] + [None] * 4)
 
     def host_side_compute(self, floatimage):
         return self.precomputation(floatimage)
@@ -27,28 +31,25 @@ class CLTimmBarth:
         y_gradient = np.reshape(y_gradient, (numpixels,)).astype(np.float32)
         inverse = np.reshape(inverse, (numpixels,)).astype(np.float32)
 
-        mf = cl.mem_flags
-        self.buf_x_grad = cl.Buffer(self.context, mf.READ_ONLY | mf.COPY_HOST_PTR, hostbuf=x_gradient)
-        self.buf_y_grad = cl.Buffer(self.context, mf.READ_ONLY | mf.COPY_HOST_PTR, hostbuf=y_gradient)
-        self.buf_inverse = cl.Buffer(self.context, mf.READ_ONLY | mf.COPY_HOST_PTR, hostbuf=inverse)
-        self.output_buf = cl.Buffer(self.context, mf.READ_WRITE, inverse.nbytes)
+        buf_x_grad = self.buffers.upload("x_grad", x_gradient)
+        buf_y_grad = self.buffers.upload("y_grad", y_gradient)
+        buf_inverse = self.buffers.upload("inverse", inverse)
+        output_buf = self.buffers.get("output", inverse.nbytes)
 
-        kernel = self.program.timm_and_barth
-        kernel.set_scalar_arg_dtypes([np.intc, np.intc, np.intc] + [None] * 4)
+        kernel = self.kernel
         kernel.set_arg(0, np.intc(width))
         kernel.set_arg(1, np.intc(height))
         kernel.set_arg(2, np.intc(locality))
-        kernel.set_arg(3, self.buf_x_grad)
-        kernel.set_arg(4, self.buf_y_grad)
-        kernel.set_arg(5, self.buf_inverse)
-        kernel.set_arg(6, self.output_buf)
+        kernel.set_arg(3, buf_x_grad)
+        kernel.set_arg(4, buf_y_grad)
+        kernel.set_arg(5, buf_inverse)
+        kernel.set_arg(6, output_buf)
 
-        cl.enqueue_nd_range_kernel(self.queue, kernel, inverse.shape, None).wait()
+        cl.enqueue_nd_range_kernel(self.queue, kernel, inverse.shape, None)
 
-        result = np.empty_like(inverse)
-        cl.enqueue_read_buffer(self.queue, self.output_buf, result).wait()
+        result = self.buffers.download(output_buf, np.empty_like(inverse))
         return np.reshape(result, (width, height)).astype(np.float)
 
-
-
-
+    def compute_batch(self, floatimages, localities):
+        # each image still needs its own kernel launch, but the device buffers are reused
+        return [self.compute(floatimage, locality) for floatimage, locality in zip(floatimages, localities)]
@@ -0,0 +1,120 @@
+import numpy as np
+from scipy.fft import fft, fft2, ifft2, next_fast_len
+
+
+def odd_harmonic_weight(n):
+    """
+    Fourier coefficient of cos(psi)*|cos(psi)| for the odd harmonic n
+    """
+    return 8.0 * np.sin(n * np.pi / 2.0) / (np.pi * n * (4.0 - n * n))
+
+
+class NPTimmBarth:
+    """
+    CPU replacement for CLTimmBarth, computing the same objective as
+    cl_kernels/timm_barth_smallpic_kernel.cl with batched numpy FFTs.
+
+    For every candidate center c the kernel sums max(0, d.g)^2 across all the pixels p,
+    where d is the unit displacement c->p and g the gradient in p. Writing psi for the
+    angle between d and g, that is |g|^2 * f(psi) with
+        f(psi) = cos(psi)^2 * [cos(psi) > 0] = 1/4 + cos(2 psi)/4 + 1/2 * sum_odd(a_n cos(n psi))
+    so each harmonic turns into a single 2D convolution between a gradient map and a
+    displacement-angle kernel. The odd series converges as 1/n^3, and is truncated at max_harmonic.
+    """
+
+    def __init__(self, precomputation=lambda i: i, max_harmonic=9):
+        self.precomputation = precomputation
+        self.harmonics = np.array([0, 2] + list(range(1, max_harmonic + 1, 2)))
+        weights = [0.25, 0.25] + [odd_harmonic_weight(n) / 2.0 for n in range(1, max_harmonic + 1, 2)]
+        self.weights = np.array(weights)[:, np.newaxis, np.newaxis]
+        self.kernel_cache = {}
+
+    def load_program(self, program_path=None):
+        # nothing to build, kept for interface compatibility with CLTimmBarth
+        pass
+
+    def host_side_compute(self, floatimage):
+        return self.precomputation(floatimage)
+
+    def get_kernels_fft(self, width, height):
+        """
+        Spectra of the displacement-angle kernels, one per harmonic, for a width*height image
+        (cached, since the eye patches are always resized to the same few shapes)
+        """
+        key = (width, height)
+        if key not in self.kernel_cache:
+            # large enough to hold every offset in (-width, width) x (-height, height) without wrapping
+            fft_shape = (next_fast_len(2 * width - 1), next_fast_len(2 * height - 1))
+            # offsets u laid out in circular order, so that the convolution needs no shifting
+            uy = np.fft.fftfreq(fft_shape[0], 1.0 / fft_shape[0])[:, np.newaxis]
+            ux = np.fft.fftfreq(fft_shape[1], 1.0 / fft_shape[1])[np.newaxis, :]
+            # convolution kernel = displacement kernel evaluated at -u
+            phi = np.arctan2(-uy, -ux)
+            kernels = np.exp(1j * self.harmonics[:, np.newaxis, np.newaxis] * phi)
+            kernels[:, 0, 0] = 0  # a pixel never votes for itself
+            # fold the harmonic weights in, so the harmonics can be summed up in the frequency domain
+            self.kernel_cache[key] = (fft_shape, self.weights * fft2(kernels))
+        return self.kernel_cache[key]
+
+    def harmonic_votes(self, x_gradient, y_gradient, out):
+        """
+        |g|^2 * exp(-i n theta) for every harmonic n, where theta is the gradient angle.
+        Computed as |g|^2 * z^n with z = (gx - i gy) / |g|, which is cheaper than arctan2 + exp.
+        :param out: complex array (harmonics, width, height) to write into
+        """
+        magnitude = x_gradient ** 2 + y_gradient ** 2
+        norm = np.sqrt(magnitude)
+        norm[norm == 0] = 1  # null gradients cast no votes anyway
+        z = (x_gradient - 1j * y_gradient) / norm
+        power = magnitude.astype(np.complex128)
+        powers = {0: power}
+        for n in range(1, max(self.harmonics) + 1):
+            power = power * z
+            powers[n] = power
+        for h, n in enumerate(self.harmonics):
+            out[h] = powers[n]
+        return out
+
+    def transform(self, votes, fft_shape, workers=None):
+        """
+        2D FFT of zero-padded votes, skipping the transforms of the rows which are all zeros
+        """
+        width = votes.shape[-2]
+        rows = fft(votes, n=fft_shape[1], axis=-1, workers=workers)
+        padded = np.zeros(votes.shape[:-2] + fft_shape, dtype=np.complex128)
+        padded[..., :width, :] = rows
+        return fft(padded, axis=-2, overwrite_x=True, workers=workers)
+
+    def objective(self, floatimage, workers=None):
+        width, height = np.shape(floatimage)
+        numpixels = width * height
+        x_gradient, y_gradient, inverse = self.host_side_compute(floatimage)
+
+        fft_shape, kernels_fft = self.get_kernels_fft(width, height)
+        votes = self.harmonic_votes(x_gradient, y_gradient,
+                                    np.empty((len(self.harmonics), width, height), dtype=np.complex128))
+
+        spectrum = np.einsum("hij,hij->ij", self.transform(votes, fft_shape, workers=workers), kernels_fft)
+        accumul = ifft2(spectrum, overwrite_x=True, workers=workers)[:width, :height].real
+
+        return accumul * inverse / numpixels
+
+    def compute(self, floatimage, locality):
+        """
+        :param floatimage: eye patch (numpy 2d array of float)
+        :param locality: unused, the smallpic kernel ignores it as well
+        :return: numpy 2d array with the timm & barth objective for every pixel
+        """
+        return self.objective(floatimage)
+
+    def compute_batch(self, floatimages, localities):
+        """
+        Same as compute, for many eye patches at once (e.g. all the eyes in a frame), with the
+        FFTs split across all the available cores.
+        Stacking the zero-padded patches into a single FFT was tried, and was slower: the
+        transform is memory bound, and the larger working set outweighs the saved calls.
+        :param floatimages: list of eye patches (numpy 2d arrays of float)
+        :param localities: unused, see compute
+        :return: list of numpy 2d arrays, one per patch
+        """
+        return [self.objective(floatimage, workers=-1) for floatimage in floatimages]
@@ -11,19 +11,23 @@ from skimage.filters import threshold_otsu
 from classes import Point
 from utils.eyecenter.interface import EyeFeaturesExtractor
 from utils.eyecenter.timm.cl_runner import CLTimmBarth
+from utils.eyecenter.timm.np_runner import NPTimmBarth
 from utils.eyecorners import find_eye_corners
 from utils.histogram.lsh_equalization import lsh_equalization
 
 
 class TimmAndBarth(EyeFeaturesExtractor):
 
+    runner_class = CLTimmBarth
 
     def __init__(self):
         super().__init__()
-        # prepare the opencl context
-        self.context = CLTimmBarth(precomputation=self.precomputation)
+        # prepare the opencl context (or its cpu counterpart)
+        self.context = self.runner_class(precomputation=self.precomputation)
         self.debug_edgemap = None
         self.locality_factor = 0.1 # 0.15
+        # larger eye patches are scaled down to this size
+        self.max_w = 120
 
     def create_debug_figure(self):
         fig, ((r1, l1), (r2, l2), (r3, l3)) = plt.subplots(3, 2)
@@ -57,11 +61,13 @@ class TimmAndBarth(EyeFeaturesExtractor):
         inverse = gaussian(1.0 - eye_image)
         return x_gradient, y_gradient, inverse
 
-    def detect_eye_features(self, eye_image, eye_object):
-
+    def prepare_eye_image(self, eye_image):
+        """
+        :return: tuple (eye image ready for the filter, scale factor to map its coordinates back)
+        """
         # scale the image if needed
         width, height = np.shape(eye_image)
-        max_w = 120
+        max_w = self.max_w
         scale_factor = 1.0
         if width > max_w:
             max_h = int((height / width) * max_w)
@@ -72,10 +78,27 @@ class TimmAndBarth(EyeFeaturesExtractor):
         if self.equalization != lsh_equalization:
             eye_image = exposure.equalize_hist(eye_image)
         #eye_image = gaussian(eye_image)
+        return eye_image, scale_factor
+
+    def detect_eye_features(self, eye_image, eye_object):
+        eye_image, scale_factor = self.prepare_eye_image(eye_image)
         width, height = np.shape(eye_image)
         # run the actual timm & barth filter
         tb_image = self.context.compute(eye_image, locality=int(width * self.locality_factor))
+        self.locate_pupil(eye_image, tb_image, scale_factor, eye_object)
 
+    def detect_eye_features_batch(self, eye_images, eye_objects):
+        if self.debug_mode:
+            # the debug plots need the edgemap of every single eye
+            return super().detect_eye_features_batch(eye_images, eye_objects)
+        prepared = [self.prepare_eye_image(eye_image) for eye_image in eye_images]
+        eye_images = [eye_image for eye_image, _ in prepared]
+        localities = [int(np.shape(eye_image)[0] * self.locality_factor) for eye_image in eye_images]
+        tb_images = self.context.compute_batch(eye_images, localities)
+        for eye_image, (_, scale_factor), tb_image, eye_object in zip(eye_images, prepared, tb_images, eye_objects):
+            self.locate_pupil(eye_image, tb_image, scale_factor, eye_object)
+
+    def locate_pupil(self, eye_image, tb_image, scale_factor, eye_object):
         (ax_1, ax_2, ax_3) = [None] * 3
         if self.debug_mode:
             (ax_1, ax_2, ax_3) = self.debug_axes[0:3]
@@ -100,3 +123,10 @@ class TimmAndBarth(EyeFeaturesExtractor):
             ax_2.plot(true_center[1], true_center[0], "r+")
             ax_1.plot(true_center[1], true_center[0], "r+")
 
+
+class NumpyTimmAndBarth(TimmAndBarth):
+    """
+    Same as TimmAndBarth, but runs on the cpu (numpy FFTs) instead of requiring an opencl device
+    """
+
+    runner_class = NPTimmBarth
@@ -0,0 +1,121 @@
+import numpy as np
+
+
+def face_box(face):
+    """
+    :return: bounding box (x_min, y_min, x_max, y_max) of the landmarks of a face object
+    """
+    x_min, y_min = np.min(face.dlib68_points, axis=0)
+    x_max, y_max = np.max(face.dlib68_points, axis=0)
+    return x_min, y_min, x_max, y_max
+
+
+def box_overlap(a, b):
+    """
+    :return: intersection over union of two boxes (x_min, y_min, x_max, y_max)
+    """
+    width = min(a[2], b[2]) - max(a[0], b[0])
+    height = min(a[3], b[3]) - max(a[1], b[1])
+    if width <= 0 or height <= 0:
+        return 0.0
+    intersection = width * height
+    area_a = (a[2] - a[0]) * (a[3] - a[1])
+    area_b = (b[2] - b[0]) * (b[3] - b[1])
+    return float(intersection) / (area_a + area_b - intersection)
+
+
+def box_center(box):
+    return np.array([(box[0] + box[2]) / 2.0, (box[1] + box[3]) / 2.0])
+
+
+class FaceIdentity:
+    """
+    A face followed across the frames
+
+    number: identifier, stable as long as the face stays in view
+    tracker: Tracker holding the history of this face only
+    box: landmark bounding box in the last frame the face was seen
+    missing_frames: consecutive frames in which the face was not found
+    """
+
+    def __init__(self, number, tracker, box):
+        self.number = number
+        self.tracker = tracker
+        self.box = box
+        self.missing_frames = 0
+
+
+class FaceAssociator:
+    """
+    Gives a stable identity to the faces found frame after frame, with a greedy matching on the
+    overlap of their landmark bounding boxes (falling back to the distance of the box centers,
+    for faces moving fast), and keeps one Tracker per identity.
+    """
+
+    def __init__(self, tracker_factory, min_overlap=0.3, max_center_distance=0.5, max_missing_frames=10):
+        """
+        :param tracker_factory: function returning a new Tracker, called for every new identity
+        :param min_overlap: minimum intersection over union to match a face with an identity
+        :param max_center_distance: maximum distance between the box centers to match a face with an
+            identity, as a fraction of the identity box width
+        :param max_missing_frames: forget an identity after it has not been seen for N frames
+        """
+        self.tracker_factory = tracker_factory
+        self.min_overlap = min_overlap
+        self.max_center_distance = max_center_distance
+        self.max_missing_frames = max_missing_frames
+        self.identities = []
+        self.next_number = 0
+
+    def match(self, boxes):
+        """
+        :return: dict face index -> identity
+        """
+        candidates = []
+        for f, box in enumerate(boxes):
+            for identity in self.identities:
+                overlap = box_overlap(box, identity.box)
+                distance = np.linalg.norm(box_center(box) - box_center(identity.box))
+                identity_width = max(identity.box[2] - identity.box[0], 1)
+                if overlap >= self.min_overlap or distance <= self.max_center_distance * identity_width:
+                    # best overlap first, then closest center
+                    candidates.append((-overlap, distance, f, identity))
+        candidates.sort(key=lambda candidate: candidate[:3])
+
+        matches = {}
+        matched_identities = set()
+        for _, _, f, identity in candidates:
+            if f not in matches and identity.number not in matched_identities:
+                matches[f] = identity
+                matched_identities.add(identity.number)
+        return matches
+
+    def update(self, faces, timestamp=None):
+        """
+        Associate the faces of the current frame to the known identities, and update their trackers
+        :param faces: list of face objects (see process_frame_multi)
+        :param timestamp: time the frame was captured at, in seconds (see Tracker.update)
+        :return: list of the identities seen in this frame, sorted by identifier
+        """
+        boxes = [face_box(face) for face in faces]
+        matches = self.match(boxes)
+
+        seen = []
+        for f, face in enumerate(faces):
+            identity = matches.get(f)
+            if identity is None:
+                identity = FaceIdentity(self.next_number, self.tracker_factory(), boxes[f])
+                self.next_number += 1
+                self.identities.append(identity)
+            identity.box = boxes[f]
+            identity.missing_frames = 0
+            identity.tracker.update(face, timestamp=timestamp)
+            seen.append(identity)
+
+        for identity in self.identities:
+            if identity not in seen:
+                identity.missing_frames += 1
+        self.identities = [identity for identity in self.identities
+                           if identity.missing_frames <= self.max_missing_frames]
+
+        return sorted(seen, key=lambda identity: identity.number)
@@ -7,10 +7,16 @@ import cv2
 
 from classes import Rect, Eye
 from utils.face_landmarks import point_map
+from utils.face_landmarks import landmark_cache
+from utils.profiling import timed
 
 
 detector = None
 predictor = None
+# see enable_tracking
+landmark_tracker = None
+# see set_detection_scale
+detect_scale = 1.0
 
 
 #Start and end indexes for left (l) and right (r) eyes in 68-points
@@ -21,20 +27,46 @@ lstart = 42
 lend = 48
 
 
+def set_detection_scale(scale=1.0):
+    """
+    :param scale: resize factor of the image given to the face detector, in (0, 1]. Below 1.0 the
+        detector does not upsample the image (webcam faces are large), and the rectangles it finds are
+        mapped back to the full resolution image, where the shape predictor runs.
+    """
+    global detect_scale
+    if scale <= 0 or scale > 1.0:
+        # at 1.0 the detector already upsamples the image once: larger factors are not implemented
+        raise Exception("invalid face detection scale %f (must be in (0, 1])" % scale)
+    detect_scale = scale
+
+
+def scale_rect(rect, factor):
+    return dlib.rectangle(int(rect.left() * factor), int(rect.top() * factor),
+                          int(rect.right() * factor), int(rect.bottom() * factor))
+
+
+def run_detector(image):
+    if detect_scale >= 1.0:
+        return detector(image, 1)
+    small = cv2.resize(image, None, fx=detect_scale, fy=detect_scale, interpolation=cv2.INTER_AREA)
+    return [scale_rect(rect, 1.0 / detect_scale) for rect in detector(small, 0)]
+
+
 def detect_faces(image_cv2format, image_cv2format_equalized):
     global detector, predictor
-    detect_attempt = "equalized"
-    rects = detector(image_cv2format_equalized.copy(), 1)
-    if len(rects) == 0:
-        detect_attempt = "raw"
-        gray = cv2.equalizeHist(image_cv2format.copy())
-        rects = detector(gray, 1)
+    with timed("face detection"):
+        detect_attempt = "equalized"
+        rects = run_detector(image_cv2format_equalized)
         if len(rects) == 0:
-            return [], "gave up", image_cv2format
+            detect_attempt = "raw"
+            gray = cv2.equalizeHist(image_cv2format)
+            rects = run_detector(gray)
+            if len(rects) == 0:
+                return [], "gave up", image_cv2format
+            else:
+                return rects, detect_attempt, image_cv2format
         else:
-            return rects, detect_attempt, image_cv2format
-    else:
-        return rects, detect_attempt, image_cv2format_equalized
+            return rects, detect_attempt, image_cv2format_equalized
 
 
 def bounding_rect(points, xborder=10, yborder=5):
@@ -45,32 +77,226 @@ def bounding_rect(points, xborder=10, yborder=5):
     return Rect(x=x_min-xborder, y=y_min-yborder, width=x_max-x_min+2*xborder, height=y_max-y_min+2*yborder)
 
 
-def eye_area_detection_step(image_cv2format, image_cv2format_equalized, model="data/shape_predictor_68_face_landmarks.dat"):
+class LandmarkTracker:
+    """
+    Re-uses the face rectangle of the previous frame (derived from its 68 landmarks) to run only the
+    shape predictor, skipping the full-frame face detector.
+    The detector runs again every keyframe_interval frames, or as soon as the tracked landmarks fail
+    the geometry checks (dlib's shape predictor does not provide a confidence score).
+
+    face_rect: dlib.rectangle to use in the next frame, None if the face was lost
+    image_kind: which image the landmarks were computed on ("equalized" or "raw", see detect_faces)
+    """
+
+    def __init__(self, keyframe_interval=10, min_overlap=0.5):
+        """
+        :param keyframe_interval: run the face detector at least once every N frames
+        :param min_overlap: minimum intersection-over-union between the tracked rectangle and the
+            bounding box of the landmarks found in it
+        """
+        self.keyframe_interval = keyframe_interval
+        self.min_overlap = min_overlap
+        self.face_rect = None
+        self.image_kind = "equalized"
+        self.frames_since_detection = 0
+        # hit-rate counters
+        self.frames = 0
+        self.detector_runs = 0
+        self.tracked_frames = 0
+        self.tracking_failures = 0
+
+    def can_track(self):
+        return self.face_rect is not None and self.frames_since_detection < self.keyframe_interval
+
+    def detected(self, points, image_kind):
+        self.detector_runs += 1
+        self.frames_since_detection = 0
+        self.image_kind = image_kind
+        self.face_rect = face_rect_from_points(points)
+
+    def tracked(self, points):
+        self.tracked_frames += 1
+        self.face_rect = face_rect_from_points(points)
+
+    def track_failed(self):
+        self.tracking_failures += 1
+        self.face_rect = None
+
+    def lost(self):
+        self.detector_runs += 1
+        self.face_rect = None
+
+    def new_frame(self):
+        self.frames += 1
+        self.frames_since_detection += 1
+
+    def plausible(self, points, image_shape):
+        """
+        Geometry checks on landmarks computed inside the tracked rectangle
+        """
+        rect = face_rect_from_points(points)
+        if rect.width() < 20 or rect.height() < 20:
+            return False
+        if rect.left() < 0 or rect.top() < 0 or rect.right() >= image_shape[1] or rect.bottom() >= image_shape[0]:
+            return False
+        if rect_overlap(rect, self.face_rect) < self.min_overlap:
+            return False
+        right_eye_center = np.mean(points[rstart:rend], axis=0)
+        left_eye_center = np.mean(points[lstart:lend], axis=0)
+        interocular = np.linalg.norm(left_eye_center - right_eye_center)
+        if not 0.2 * rect.width() <= interocular <= 0.6 * rect.width():
+            return False
+        # eyes above the nose tip, nose tip above the chin
+        nose_y = points[point_map.nose_tip][1]
+        return max(right_eye_center[1], left_eye_center[1]) < nose_y < points[point_map.chin][1]
+
+    @property
+    def hit_rate(self):
+        """
+        :return: fraction of the frames in which the face detector was skipped
+        """
+        return float(self.tracked_frames) / self.frames if self.frames > 0 else 0.0
+
+    def __str__(self):
+        return "frames: %d, tracked: %d (hit rate %.2f), detector runs: %d, tracking failures: %d" % (
+            self.frames, self.tracked_frames, self.hit_rate, self.detector_runs, self.tracking_failures)
+
+
+def enable_tracking(keyframe_interval=10):
+    """
+    Enable the landmark tracking mode (see LandmarkTracker)
+    :param keyframe_interval: run the face detector at least once every N frames; 0 to disable tracking
+    :return: the LandmarkTracker, holding the hit-rate counters (None if disabled)
+    """
+    global landmark_tracker
+    landmark_tracker = LandmarkTracker(keyframe_interval) if keyframe_interval > 0 else None
+    return landmark_tracker
+
+
+def face_rect_from_points(points):
+    x_min, y_min = np.min(points, axis=0)
+    x_max, y_max = np.max(points, axis=0)
+    return dlib.rectangle(int(x_min), int(y_min), int(x_max), int(y_max))
+
+
+def rect_overlap(a, b):
+    """
+    :return: intersection over union of two dlib.rectangle
+    """
+    intersection = a.intersect(b)
+    intersection_area = intersection.area() if not intersection.is_empty() else 0
+    return float(intersection_area) / (a.area() + b.area() - intersection_area)
+
+
+def predict_landmarks(image, face):
+    # detect facial landmarks for the face region
+    with timed("landmarks"):
+        shape = predictor(image, face)
+    # convert the facial landmark coordinates to NumPy array
+    return face_utils.shape_to_np(shape)
+
+
+def track_landmarks(image_cv2format, image_cv2format_equalized):
+    """
+    Run only the shape predictor in the face rectangle of the previous frame
+    :return: the 68 points, None if they fail the geometry checks
+    """
+    image = image_cv2format_equalized if landmark_tracker.image_kind == "equalized" else image_cv2format
+    points = predict_landmarks(image, landmark_tracker.face_rect)
+    if landmark_tracker.plausible(points, np.shape(image)):
+        landmark_tracker.tracked(points)
+        return points
+    landmark_tracker.track_failed()
+    return None
+
+
+def load_models(model="data/shape_predictor_68_face_landmarks.dat"):
     global detector, predictor
     if detector is None:
         detector = dlib.get_frontal_face_detector()
     if predictor is None:
         predictor = dlib.shape_predictor(model)
 
-    faces, detection_method, image_chosen = detect_faces(image_cv2format, image_cv2format_equalized)
-    if len(faces) == 0:
-        return False, detection_method, [], []
-
-    face = faces[0]  #TODO: select the most appropriate face
-    # detect facial landmarks for the face region
-    shape = predictor(image_chosen.copy(), face)
-    # convert the facial landmark coordinates to NumPy array
-    points = face_utils.shape_to_np(shape)
 
+def eye_rects_from_points(points):
+    """
+    :return: tuple (success, failure description, [left eye Rect, right eye Rect])
+    """
     left_eye_rect = bounding_rect(points[lstart:lend])
     right_eye_rect = bounding_rect(points[rstart:rend])
 
     if left_eye_rect.width * left_eye_rect.height <= 0:
-        return False, "left eye fail", [], points
+        return False, "left eye fail", []
     if right_eye_rect.width * right_eye_rect.height <= 0:
-        return False, "right eye fail", [], points
+        return False, "right eye fail", []
+    return True, None, [left_eye_rect, right_eye_rect]
+
+
+def eye_area_detection_step(image_cv2format, image_cv2format_equalized, model="data/shape_predictor_68_face_landmarks.dat"):
+    """
+    :return: tuple (success, detection method, [left eye Rect, right eye Rect], 68 points)
+    """
+    load_models(model)
+
+    # the tracking mode depends on the previous frames, its results cannot be cached
+    if landmark_cache.active_cache is not None and landmark_tracker is None:
+        key = landmark_cache.detection_key("single", model, detect_scale, image_cv2format, image_cv2format_equalized)
+        return landmark_cache.active_cache.cached(
+            key, lambda: eye_area_detection(image_cv2format, image_cv2format_equalized))
+    return eye_area_detection(image_cv2format, image_cv2format_equalized)
+
+
+def eye_area_detection(image_cv2format, image_cv2format_equalized):
+    points = None
+    if landmark_tracker is not None:
+        landmark_tracker.new_frame()
+        if landmark_tracker.can_track():
+            points = track_landmarks(image_cv2format, image_cv2format_equalized)
+            detection_method = "tracked"
+
+    if points is None:
+        faces, detection_method, image_chosen = detect_faces(image_cv2format, image_cv2format_equalized)
+        if len(faces) == 0:
+            if landmark_tracker is not None:
+                landmark_tracker.lost()
+            return False, detection_method, [], []
+
+        face = faces[0]  # single-face mode: see eye_area_detection_step_multi
+        points = predict_landmarks(image_chosen, face)
+        if landmark_tracker is not None:
+            landmark_tracker.detected(points, detection_method)
+
+    success, failure, eyes = eye_rects_from_points(points)
+    if not success:
+        return False, failure, [], points
 
-    return True, detection_method, [left_eye_rect, right_eye_rect], points
+    return True, detection_method, eyes, points
+
+
+def eye_area_detection_step_multi(image_cv2format, image_cv2format_equalized, model="data/shape_predictor_68_face_landmarks.dat"):
+    """
+    Same as eye_area_detection_step, for all the faces found by the detector
+    (the landmark tracking mode does not apply here: the detector runs on every frame)
+    :return: tuple (success, detection method, list of tuples ([left eye Rect, right eye Rect], 68 points))
+    """
+    load_models(model)
+
+    if landmark_cache.active_cache is not None:
+        key = landmark_cache.detection_key("multi", model, detect_scale, image_cv2format, image_cv2format_equalized)
+        return landmark_cache.active_cache.cached(
+            key, lambda: eye_area_detection_multi(image_cv2format, image_cv2format_equalized))
+    return eye_area_detection_multi(image_cv2format, image_cv2format_equalized)
+
+
+def eye_area_detection_multi(image_cv2format, image_cv2format_equalized):
+    faces, detection_method, image_chosen = detect_faces(image_cv2format, image_cv2format_equalized)
+    detections = []
+    for face in faces:
+        points = predict_landmarks(image_chosen, face)
+        success, failure, eyes = eye_rects_from_points(points)
+        if success:
+            detections.append((eyes, points))
+    return len(detections) > 0, detection_method, detections
 
 
 def pick_eye_corners(eye_obj, points):
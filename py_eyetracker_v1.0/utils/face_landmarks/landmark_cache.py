@@ -0,0 +1,168 @@
+"""
+On-disk cache of the face detection, landmarking and head pose results, keyed by the content of the
+image (and by everything else they depend on: model file, detection scale, camera parameters).
+Tuning the eye center algorithms on the same pictures then pays only for the eye center stage.
+"""
+import hashlib
+import os
+import pickle
+import sqlite3
+import time
+
+import numpy as np
+
+from utils.camera.parameters import camera_matrix_from_picture_shape, get_dist_coeffs
+from utils.face_landmarks.sixpoints import model_points, model_dlib_indices
+
+
+# see enable
+active_cache = None
+# model file -> model_identity
+model_identities = {}
+
+
+class LandmarkCache:
+    """
+    Cache stored in an sqlite database, so that several processes (see the --jobs test mode) can share it.
+    When the stored results exceed max_bytes, the least recently used entries are evicted.
+    """
+
+    def __init__(self, path, max_bytes=512 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.connection = None
+        self.pid = None
+        self.stored_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def connect(self):
+        # sqlite connections must not cross a fork: every process opens its own
+        if self.connection is None or self.pid != os.getpid():
+            self.connection = sqlite3.connect(self.path, timeout=60)
+            self.pid = os.getpid()
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=OFF")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS results "
+                                    "(key TEXT PRIMARY KEY, value BLOB, size INTEGER, last_used REAL)")
+            self.connection.commit()
+            self.stored_bytes = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        return self.connection
+
+    @staticmethod
+    def key(*parts):
+        """
+        :param parts: numpy arrays (hashed by content, shape and type) or other objects (hashed by repr)
+        """
+        digest = hashlib.blake2b(digest_size=20)
+        for part in parts:
+            if isinstance(part, np.ndarray):
+                digest.update(repr((part.shape, part.dtype.str)).encode())
+                digest.update(memoryview(np.ascontiguousarray(part)).cast("B"))
+            else:
+                digest.update(repr(part).encode())
+        return digest.hexdigest()
+
+    def get(self, key):
+        """
+        :return: the cached value, None on a miss
+        """
+        connection = self.connect()
+        row = connection.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        connection.execute("UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key))
+        connection.commit()
+        return pickle.loads(row[0])
+
+    def put(self, key, value):
+        connection = self.connect()
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        connection.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)", (key, blob, len(blob), time.time()))
+        self.stored_bytes += len(blob)
+        if self.stored_bytes > self.max_bytes:
+            self.evict()
+        connection.commit()
+
+    def evict(self):
+        """
+        Drop the least recently used entries, down to 90% of max_bytes
+        """
+        connection = self.connect()
+        # other processes write too: start from the real total
+        self.stored_bytes = connection.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        to_free = self.stored_bytes - int(0.9 * self.max_bytes)
+        if to_free <= 0:
+            return
+        freed = 0
+        evicted = []
+        for key, size in connection.execute("SELECT key, size FROM results ORDER BY last_used"):
+            if freed >= to_free:
+                break
+            evicted.append((key,))
+            freed += size
+        connection.executemany("DELETE FROM results WHERE key = ?", evicted)
+        self.stored_bytes -= freed
+
+    def cached(self, key, compute):
+        """
+        :param compute: function with no arguments, computing the value on a miss
+        """
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return float(self.hits) / lookups if lookups > 0 else 0.0
+
+    def __str__(self):
+        return "lookups: %d, hits: %d (hit rate %.2f), stored: %.1f MiB" % (
+            self.hits + self.misses, self.hits, self.hit_rate, self.stored_bytes / float(1024 * 1024))
+
+
+def model_identity(model):
+    """
+    :return: string identifying a model file (results computed with another file must not be reused)
+    """
+    model = os.path.abspath(model)
+    try:
+        stat = os.stat(model)
+        return "%s:%d:%d" % (model, stat.st_size, int(stat.st_mtime))
+    except OSError:
+        return model
+
+
+def enable(path, max_mib=512):
+    """
+    Enable the cache of the detection, landmarking and head pose results
+    :param path: sqlite database file; None to disable the cache
+    :param max_mib: size bound of the stored results, in MiB
+    :return: the LandmarkCache, holding the hit-rate counters (None if disabled)
+    """
+    global active_cache
+    active_cache = LandmarkCache(path, max_mib * 1024 * 1024) if path is not None else None
+    return active_cache
+
+
+def detection_key(kind, model, detect_scale, image_cv2format, image_cv2format_equalized):
+    """
+    :param kind: which detection step the results come from (they differ in format)
+    """
+    if model not in model_identities:
+        model_identities[model] = model_identity(model)
+    return LandmarkCache.key(kind, model_identities[model], detect_scale, image_cv2format, image_cv2format_equalized)
+
+
+def head_pose_key(dlib68_points, picture_shape):
+    """
+    Key of the six_points results: besides the landmarks, they depend on the camera parameters and on the
+    3D face model
+    """
+    return LandmarkCache.key("six_points", dlib68_points, picture_shape, camera_matrix_from_picture_shape(picture_shape),
+                             get_dist_coeffs(), model_points, model_dlib_indices)
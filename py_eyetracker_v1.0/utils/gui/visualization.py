@@ -1,6 +1,5 @@
 import numpy as np
 import cv2
-from skimage import img_as_ubyte
 
 from utils.camera.parameters import *
 from utils.face_landmarks import point_map
@@ -13,6 +12,9 @@ green = (0, 255, 0)
 
 dot_radius = 2
 
+# RGB image shown by draw_routine, re-allocated only when the picture size changes
+display_buffer = None
+
 
 def draw_rect(image, rect, color, thickness):
     cv2.rectangle(image,
@@ -39,40 +41,71 @@ def draw_gaze_vector(image, face: Face, length=500.0):
     cv2.line(image, p1, p2, blue, 2)
 
 
-def draw_routine(picture, face: Face, not_eyes, title, draw_unicorn=True):
+def draw_face(image, face: Face, draw_unicorn=True, label=None):
+    right_eye = face.right_eye
+    left_eye = face.left_eye
+
+    if draw_unicorn:
+        draw_gaze_vector(image, face)
+
+    # draw eye regions (found using the haar cascade)
+    draw_rect(image, right_eye.area, red, 1)
+    draw_rect(image, left_eye.area, red, 1)
+
+    # draw pupil spots (red)
+    draw_dot(image, right_eye.pupil, red)
+    draw_dot(image, left_eye.pupil, red)
+    # draw inner corners (green)
+    draw_dot(image, right_eye.inner_corner, green)
+    draw_dot(image, left_eye.inner_corner, green)
+    # draw outer corners (blue)
+    draw_dot(image, right_eye.outer_corner, blue)
+    draw_dot(image, left_eye.outer_corner, blue)
+
+    if label is not None:
+        cv2.putText(image, label, (int(right_eye.area.x), int(right_eye.area.y) - 8),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, green, 1)
+
+
+def draw_text_lines(image, lines, color=green, origin=(5, 15), line_height=15):
+    for n, line in enumerate(lines):
+        cv2.putText(image, line, (origin[0], origin[1] + n * line_height), cv2.FONT_HERSHEY_SIMPLEX, 0.4, color, 1)
+
+
+def draw_routine(picture, face: Face, not_eyes, title, draw_unicorn=True, overlay_lines=None):
     """
     Draw the main window
     :param picture: 
     :param face
     :param not_eyes: list of Rect
     :param title: window title
+    :param overlay_lines: list of strings to write in the top left corner (optional, e.g. the stage timings)
     :return: 
     """
+    draw_routine_faces(picture, [face] if face is not None else [], not_eyes, title, draw_unicorn=draw_unicorn,
+                       overlay_lines=overlay_lines)
 
-    pic_to_display = cv2.cvtColor(img_as_ubyte(picture), cv2.COLOR_GRAY2RGB)
 
-    if face is not None:
-        right_eye = face.right_eye
-        left_eye = face.left_eye
+def draw_routine_faces(picture, faces, not_eyes, title, draw_unicorn=True, labels=None, overlay_lines=None):
+    """
+    Same as draw_routine, for many faces
+    :param faces: list of Face
+    :param labels: list of strings to write next to each face (optional)
+    """
 
-        if draw_unicorn:
-            draw_gaze_vector(pic_to_display, face)
+    global display_buffer
+    if display_buffer is None or display_buffer.shape[:2] != picture.shape:
+        display_buffer = np.empty(picture.shape + (3,), dtype=np.uint8)
+    # same as img_as_ubyte, without the temporary arrays; imshow copies the image, so the buffer can be reused
+    pic_to_display = cv2.cvtColor(cv2.convertScaleAbs(picture, alpha=255), cv2.COLOR_GRAY2RGB, dst=display_buffer)
 
-        # draw eye regions (found using the haar cascade)
-        draw_rect(pic_to_display, right_eye.area, red, 1)
-        draw_rect(pic_to_display, left_eye.area, red, 1)
+    for rect in not_eyes:
+        draw_rect(pic_to_display, rect, blue, 1)
 
-        for rect in not_eyes:
-            draw_rect(pic_to_display, rect, blue, 1)
+    for n, face in enumerate(faces):
+        draw_face(pic_to_display, face, draw_unicorn=draw_unicorn, label=labels[n] if labels is not None else None)
 
-        # draw pupil spots (red)
-        draw_dot(pic_to_display, right_eye.pupil, red)
-        draw_dot(pic_to_display, left_eye.pupil, red)
-        # draw inner corners (green)
-        draw_dot(pic_to_display, right_eye.inner_corner, green)
-        draw_dot(pic_to_display, left_eye.inner_corner, green)
-        # draw outer corners (blue)
-        draw_dot(pic_to_display, right_eye.outer_corner, blue)
-        draw_dot(pic_to_display, left_eye.outer_corner, blue)
+    if overlay_lines is not None:
+        draw_text_lines(pic_to_display, overlay_lines)
 
     cv2.imshow(title, pic_to_display)
@@ -3,6 +3,8 @@ import numpy as np
 import math
 from skimage import img_as_ubyte
 
+from utils import cl_context
+
 
 class CL_hist_1D:
     """
@@ -11,26 +13,31 @@ class CL_hist_1D:
 
     def __init__(self, direction="x"):
         self.direction = direction
-        self.context = cl.create_some_context()
-        self.queue = cl.CommandQueue(self.context)
+        self.context = cl_context.get_context()
+        self.queue = cl_context.get_queue()
+        self.buffers = cl_context.BufferPool()
 
     def load_program(self, program_path="cl_kernels/lsh_1D_%s.cl"):
-        with open(program_path % self.direction, "r") as fp:
-            self.program = cl.Program(self.context, fp.read()).build()
+        self.program = cl_context.load_program(program_path % self.direction)
+        self.kernel = cl.Kernel(self.program, "lsh_1D_%s" % self.direction)
+        self.kernel.set_scalar_arg_dtypes([np.int32, np.int32, np.int32, np.float32] + [None] * 6)
 
     def get_max_local_mem(self):
-        devices = self.context.get_info(cl.context_info.DEVICES)
-        device = devices[0]
-        return device.local_mem_size
-
-    def compute(self, linearized_Q, linearized_F, alpha, shapetuple):
+        return cl_context.get_device().local_mem_size
+
+    def enqueue(self, buffer_Q, buffer_F, alpha, shapetuple, hist_out_buf=None, norm_out_buf=None):
+        """
+        Enqueue the kernel on volumes which are already on the device
+        :param hist_out_buf: device buffer for the histogram output (by default, one from the pool)
+        :param norm_out_buf: device buffer for the normalization output (by default, one from the pool)
+        :return: tuple (histogram, normalization) of device buffers
+        """
         height, width, num_bins = shapetuple
-
-        mf = cl.mem_flags
-        self.buffer_Q = cl.Buffer(self.context, mf.READ_ONLY | mf.COPY_HOST_PTR, hostbuf=linearized_Q)
-        self.buffer_F = cl.Buffer(self.context, mf.READ_ONLY | mf.COPY_HOST_PTR, hostbuf=linearized_F)
-        self.hist_out_buf = cl.Buffer(self.context, mf.READ_WRITE, size=linearized_Q.nbytes)
-        self.norm_out_buf = cl.Buffer(self.context, mf.READ_WRITE, size=linearized_Q.nbytes)
+        nbytes = height * width * num_bins * np.dtype(np.float32).itemsize
+        if hist_out_buf is None:
+            hist_out_buf = self.buffers.get("hist_out", nbytes)
+        if norm_out_buf is None:
+            norm_out_buf = self.buffers.get("norm_out", nbytes)
 
         work_items = height
         if self.direction == "y":
@@ -48,29 +55,32 @@ class CL_hist_1D:
 
         #print("n workers: ", n_workers)
 
-        self.local_mem_hist = cl.LocalMemory(half_required_local_mem * n_workers)
-        self.local_mem_norm = cl.LocalMemory(half_required_local_mem * n_workers)
+        local_mem_hist = cl.LocalMemory(half_required_local_mem * n_workers)
+        local_mem_norm = cl.LocalMemory(half_required_local_mem * n_workers)
 
-        kernel = getattr(self.program, "lsh_1D_%s" % self.direction)
-        kernel.set_scalar_arg_dtypes([np.int32, np.int32, np.int32, np.float32] + [None] * 6)
+        kernel = self.kernel
         kernel.set_arg(0, np.int32(width))
         kernel.set_arg(1, np.int32(height))
         kernel.set_arg(2, np.int32(num_bins))
         kernel.set_arg(3, np.float32(alpha))
-        kernel.set_arg(4, self.buffer_Q)
-        kernel.set_arg(5, self.buffer_F)
-        kernel.set_arg(6, self.local_mem_hist)
-        kernel.set_arg(7, self.local_mem_norm)
-        kernel.set_arg(8, self.hist_out_buf)
-        kernel.set_arg(9, self.norm_out_buf)
+        kernel.set_arg(4, buffer_Q)
+        kernel.set_arg(5, buffer_F)
+        kernel.set_arg(6, local_mem_hist)
+        kernel.set_arg(7, local_mem_norm)
+        kernel.set_arg(8, hist_out_buf)
+        kernel.set_arg(9, norm_out_buf)
+
+        cl.enqueue_nd_range_kernel(self.queue, kernel, (work_items,), (n_workers,))
+        return hist_out_buf, norm_out_buf
 
-        cl.enqueue_nd_range_kernel(self.queue, kernel, (work_items,), (n_workers,)).wait()
+    def compute(self, linearized_Q, linearized_F, alpha, shapetuple):
+        buffer_Q = self.buffers.upload("Q", linearized_Q)
+        buffer_F = self.buffers.upload("F", linearized_F)
 
-        hist_result = np.empty_like(linearized_Q, dtype=np.float32)
-        norm_result = np.empty_like(linearized_Q, dtype=np.float32)
+        hist_out_buf, norm_out_buf = self.enqueue(buffer_Q, buffer_F, alpha, shapetuple)
 
-        cl.enqueue_read_buffer(self.queue, self.hist_out_buf, hist_result).wait()
-        cl.enqueue_read_buffer(self.queue, self.norm_out_buf, norm_result).wait()
+        hist_result = self.buffers.download(hist_out_buf, np.empty_like(linearized_Q, dtype=np.float32))
+        norm_result = self.buffers.download(norm_out_buf, np.empty_like(linearized_Q, dtype=np.float32))
 
         return (
             hist_result,
@@ -3,6 +3,8 @@ import numpy as np
 import math
 from skimage import img_as_ubyte
 
+from utils import cl_context
+
 
 class CL_Q:
     """
@@ -10,35 +12,55 @@ class CL_Q:
     """
 
     def __init__(self):
-        self.context = cl.create_some_context()
-        self.queue = cl.CommandQueue(self.context)
+        self.context = cl_context.get_context()
+        self.queue = cl_context.get_queue()
+        self.buffers = cl_context.BufferPool()
 
     def load_program(self, program_path="cl_kernels/lsh_Q_kernel.cl"):
-        with open(program_path, "r") as fp:
-            self.program = cl.Program(self.context, fp.read()).build()
+        self.program = cl_context.load_program(program_path)
+        self.kernel = cl.Kernel(self.program, "lsh_Q")
+        self.kernel.set_scalar_arg_dtypes([np.uintc, np.uintc, np.ubyte] + [None] * 2)
+        self.kernel_chunk = cl.Kernel(self.program, "lsh_Q_chunk")
+        self.kernel_chunk.set_scalar_arg_dtypes([np.uintc, np.uintc, np.ubyte, np.ubyte, np.ubyte] + [None] * 2)
+
+    def enqueue(self, buf_image, width, height, num_bins, first_bin=0, chunk_bins=None):
+        """
+        Enqueue the kernel on an image which is already on the device
+        :param first_bin: first bin of the chunk to compute (see chunk_bins)
+        :param chunk_bins: if given, compute only the bins [first_bin, first_bin + chunk_bins)
+        :return: device buffer holding the (width*height*num_bins) Q volume, or the
+            (width*height*chunk_bins) one if chunk_bins is given
+        """
+        volume_bins = num_bins if chunk_bins is None else chunk_bins
+        nbytes = width * height * volume_bins * np.dtype(np.float32).itemsize
+        output_buf = self.buffers.get("output", nbytes)
+        # the kernel only writes the ones: clear what the previous frame left in the buffer
+        cl.enqueue_fill_buffer(self.queue, output_buf, np.float32(0), 0, nbytes)
+
+        if chunk_bins is None:
+            kernel = self.kernel
+            scalar_args = [np.uintc(width), np.uintc(height), np.ubyte(num_bins)]
+        else:
+            kernel = self.kernel_chunk
+            scalar_args = [np.uintc(width), np.uintc(height), np.ubyte(num_bins),
+                           np.ubyte(first_bin), np.ubyte(chunk_bins)]
+        for i, arg in enumerate(scalar_args + [buf_image, output_buf]):
+            kernel.set_arg(i, arg)
+
+        cl.enqueue_nd_range_kernel(self.queue, kernel, (width * height,), None)
+        return output_buf
 
     def compute(self, image, num_bins):
         width, height = np.shape(image)
         numpixels = width * height
 
         image = np.reshape(image, (numpixels,)).astype(np.float32)
-        result = np.zeros((numpixels * num_bins, ), dtype=np.float32)
-
-        mf = cl.mem_flags
-        self.buf_image = cl.Buffer(self.context, mf.READ_ONLY | mf.COPY_HOST_PTR, hostbuf=image)
-        self.output_buf = cl.Buffer(self.context, mf.READ_WRITE, result.nbytes)
-
-        kernel = self.program.lsh_Q
-        kernel.set_scalar_arg_dtypes([np.uintc, np.uintc, np.ubyte] + [None] * 2)
-        kernel.set_arg(0, np.uintc(width))
-        kernel.set_arg(1, np.uintc(height))
-        kernel.set_arg(2, np.ubyte(num_bins))
-        kernel.set_arg(3, self.buf_image)
-        kernel.set_arg(4, self.output_buf)
+        result = np.empty((numpixels * num_bins, ), dtype=np.float32)
 
-        cl.enqueue_nd_range_kernel(self.queue, kernel, image.shape, None).wait()
+        buf_image = self.buffers.upload("image", image)
+        output_buf = self.enqueue(buf_image, width, height, num_bins)
 
-        cl.enqueue_read_buffer(self.queue, self.output_buf, result).wait()
+        self.buffers.download(output_buf, result)
         return np.reshape(result, (width, height, num_bins))
 
 
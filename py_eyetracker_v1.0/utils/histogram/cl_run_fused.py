@@ -0,0 +1,89 @@
+import pyopencl as cl
+import numpy as np
+from math import exp, sqrt
+
+from utils import cl_context
+from utils.histogram.cl_run_Q import CL_Q
+from utils.histogram.cl_run_1D import CL_hist_1D
+from utils.histogram.cl_run_iif import CL_IIF
+
+
+class CL_LSH_IIF:
+    """
+    Locality sensitive histogram + illumination invariant features, fused into a single pipeline:
+    all the stages are enqueued on the shared queue and the intermediate (width*height*num_bins)
+    volumes never leave the device. Only the image goes up, and only the feature image comes back.
+    The volumes can also be computed a chunk of bins at a time, to bound the device memory.
+    """
+
+    def __init__(self, num_bins=32):
+        self.num_bins = num_bins
+        self.queue = cl_context.get_queue()
+        self.buffers = cl_context.BufferPool()
+        self.fast_Q = CL_Q()
+        self.fast_hist_1D_x = CL_hist_1D(direction="x")
+        self.fast_hist_1D_y = CL_hist_1D(direction="y")
+        self.fast_iif = CL_IIF(num_bins=num_bins)
+
+    def load_program(self):
+        self.fast_Q.load_program()
+        self.fast_hist_1D_x.load_program()
+        self.fast_hist_1D_y.load_program()
+        self.fast_iif.load_program()
+
+    def compute(self, floatimage, sigma=0.15, k=0.1, bin_chunk=None):
+        """
+        :param bin_chunk: if given, the volumes hold only this many bins, and the features are
+            accumulated chunk after chunk. It is rounded down to a divisor of num_bins, so that
+            all the chunks have the same size and share the same device buffers.
+        :return: feature image, numpy 2d array
+        """
+        width, height = np.shape(floatimage)
+        numpixels = width * height
+        alpha_x = exp(-sqrt(2) / (sigma * width))
+        alpha_y = exp(-sqrt(2) / (sigma * height))
+
+        image_linear = np.reshape(floatimage, (numpixels,)).astype(np.float32)
+        buf_image = self.buffers.upload("image", image_linear)
+
+        if bin_chunk is None or bin_chunk >= self.num_bins:
+            output_buf = self.enqueue_full(buf_image, width, height, alpha_x, alpha_y, k)
+        else:
+            output_buf = self.enqueue_chunked(buf_image, width, height, alpha_x, alpha_y, k, bin_chunk)
+
+        transform = self.buffers.download(output_buf, np.empty_like(image_linear))
+        return np.reshape(transform, (width, height)).astype(np.float)
+
+    def enqueue_histogram(self, buf_Q, width, height, volume_bins, alpha_x, alpha_y):
+        """
+        Both recursive passes on a Q volume with volume_bins bins
+        :return: tuple (histogram, normalization) of device buffers
+        """
+        shapetuple = (width, height, volume_bins)
+        volume_nbytes = width * height * volume_bins * np.dtype(np.float32).itemsize
+        buf_F = self.buffers.get("F", volume_nbytes)
+        cl.enqueue_fill_buffer(self.queue, buf_F, np.float32(1), 0, volume_nbytes)
+
+        hist_1, norm_1 = self.fast_hist_1D_y.enqueue(buf_Q, buf_F, alpha_y, shapetuple)
+        # Q and F are not needed anymore: the second pass writes over them
+        return self.fast_hist_1D_x.enqueue(hist_1, norm_1, alpha_x, shapetuple,
+                                           hist_out_buf=buf_Q, norm_out_buf=buf_F)
+
+    def enqueue_full(self, buf_image, width, height, alpha_x, alpha_y, k):
+        buf_Q = self.fast_Q.enqueue(buf_image, width, height, self.num_bins)
+        hist_2, norm_2 = self.enqueue_histogram(buf_Q, width, height, self.num_bins, alpha_x, alpha_y)
+        return self.fast_iif.enqueue(buf_image, hist_2, k, width, height, buf_norm=norm_2)
+
+    def enqueue_chunked(self, buf_image, width, height, alpha_x, alpha_y, k, bin_chunk):
+        chunk_bins = max(c for c in range(1, bin_chunk + 1) if self.num_bins % c == 0)
+        output_nbytes = width * height * np.dtype(np.float32).itemsize
+        output_buf = self.buffers.get("output", output_nbytes)
+        cl.enqueue_fill_buffer(self.queue, output_buf, np.float32(0), 0, output_nbytes)
+
+        for first_bin in range(0, self.num_bins, chunk_bins):
+            buf_Q = self.fast_Q.enqueue(buf_image, width, height, self.num_bins,
+                                        first_bin=first_bin, chunk_bins=chunk_bins)
+            hist_2, norm_2 = self.enqueue_histogram(buf_Q, width, height, chunk_bins, alpha_x, alpha_y)
+            self.fast_iif.enqueue_accumulate(buf_image, hist_2, norm_2, k, width, height,
+                                             first_bin, chunk_bins, output_buf)
+        return output_buf
@@ -3,6 +3,8 @@ import numpy as np
 import math
 from skimage import img_as_ubyte
 
+from utils import cl_context
+
 
 class CL_IIF_BINID:
     """
@@ -10,35 +12,35 @@ class CL_IIF_BINID:
     """
 
     def __init__(self):
-        self.context = cl.create_some_context()
-        self.queue = cl.CommandQueue(self.context)
+        self.context = cl_context.get_context()
+        self.queue = cl_context.get_queue()
+        self.buffers = cl_context.BufferPool()
 
     def load_program(self, program_path="cl_kernels/iif_binid_kernel.cl"):
-        with open(program_path, "r") as fp:
-            self.program = cl.Program(self.context, fp.read()).build()
+        self.program = cl_context.load_program(program_path)
+        self.kernel = cl.Kernel(self.program, "iif_binid")
+        self.kernel.set_scalar_arg_dtypes([np.uintc, np.uintc, np.ubyte] + [None] * 2)
 
     def compute(self, image, num_bins):
         width, height = np.shape(image)
         numpixels = width * height
 
         image = np.reshape(image, (numpixels,)).astype(np.float32)
-        result = np.zeros((numpixels * num_bins, ), dtype=np.float32)
+        result = np.empty((numpixels * num_bins, ), dtype=np.float32)
 
-        mf = cl.mem_flags
-        self.buf_image = cl.Buffer(self.context, mf.READ_ONLY | mf.COPY_HOST_PTR, hostbuf=image)
-        self.output_buf = cl.Buffer(self.context, mf.READ_WRITE, result.nbytes)
+        buf_image = self.buffers.upload("image", image)
+        output_buf = self.buffers.get("output", result.nbytes)
 
-        kernel = self.program.iif_binid
-        kernel.set_scalar_arg_dtypes([np.uintc, np.uintc, np.ubyte] + [None] * 2)
+        kernel = self.kernel
         kernel.set_arg(0, np.uintc(width))
         kernel.set_arg(1, np.uintc(height))
         kernel.set_arg(2, np.ubyte(num_bins))
-        kernel.set_arg(3, self.buf_image)
-        kernel.set_arg(4, self.output_buf)
+        kernel.set_arg(3, buf_image)
+        kernel.set_arg(4, output_buf)
 
-        cl.enqueue_nd_range_kernel(self.queue, kernel, image.shape, None).wait()
+        cl.enqueue_nd_range_kernel(self.queue, kernel, image.shape, None)
 
-        cl.enqueue_read_buffer(self.queue, self.output_buf, result).wait()
+        self.buffers.download(output_buf, result)
         return np.reshape(result, (width, height, num_bins)).astype(np.float32)
 
 
@@ -49,13 +51,57 @@ class CL_IIF:
 
     def __init__(self, num_bins=32):
         self.num_bins = num_bins
-        self.context = cl.create_some_context()
-        self.queue = cl.CommandQueue(self.context)
+        self.context = cl_context.get_context()
+        self.queue = cl_context.get_queue()
+        self.buffers = cl_context.BufferPool()
 
     def load_program(self, program_path="cl_kernels/iif_kernel.cl"):
-        with open(program_path, "r") as fp:
-            self.source = "#define NBINS %d\n" % self.num_bins + fp.read()
-            self.program = cl.Program(self.context, self.source).build()
+        self.program = cl_context.load_program(program_path, defines={"NBINS": self.num_bins})
+        self.kernel = cl.Kernel(self.program, "IIF")
+        self.kernel.set_scalar_arg_dtypes([np.uintc, np.uintc, np.float32] + [None] * 3)
+        self.kernel_normalized = cl.Kernel(self.program, "IIF_normalized")
+        self.kernel_normalized.set_scalar_arg_dtypes([np.uintc, np.uintc, np.float32] + [None] * 4)
+        self.kernel_accumulate = cl.Kernel(self.program, "IIF_accumulate")
+        self.kernel_accumulate.set_scalar_arg_dtypes([np.uintc, np.uintc, np.float32, np.int32, np.int32] + [None] * 4)
+
+    def enqueue(self, buf_image, buf_histogram, k, width, height, buf_norm=None):
+        """
+        Enqueue the kernel on data which is already on the device
+        :param buf_norm: if given, the histogram is not normalized yet, and gets divided by this
+            normalization factor on the device
+        :return: device buffer holding the (width*height) feature image
+        """
+        output_buf = self.buffers.get("output", width * height * np.dtype(np.float32).itemsize)
+
+        if buf_norm is None:
+            kernel = self.kernel
+            buffer_args = [buf_image, buf_histogram, output_buf]
+        else:
+            kernel = self.kernel_normalized
+            buffer_args = [buf_image, buf_histogram, buf_norm, output_buf]
+        kernel.set_arg(0, np.uintc(width))
+        kernel.set_arg(1, np.uintc(height))
+        kernel.set_arg(2, np.float32(k))
+        for i, buf in enumerate(buffer_args):
+            kernel.set_arg(3 + i, buf)
+
+        cl.enqueue_nd_range_kernel(self.queue, kernel, (width * height,), None)
+        return output_buf
+
+    def enqueue_accumulate(self, buf_image, buf_histogram, buf_norm, k, width, height, first_bin, chunk_bins, output_buf):
+        """
+        Enqueue the kernel which adds the features of the bins [first_bin, first_bin + chunk_bins) to output_buf
+        :param buf_histogram: un-normalized histogram of those bins only
+        :param buf_norm: its normalization factor
+        """
+        kernel = self.kernel_accumulate
+        args = [np.uintc(width), np.uintc(height), np.float32(k), np.int32(first_bin), np.int32(chunk_bins),
+                buf_image, buf_histogram, buf_norm, output_buf]
+        for i, arg in enumerate(args):
+            kernel.set_arg(i, arg)
+
+        cl.enqueue_nd_range_kernel(self.queue, kernel, (width * height,), None)
+        return output_buf
 
     def compute(self, floatimage, histogram, k):
         width, height, nbins = np.shape(histogram)
@@ -63,25 +109,13 @@ class CL_IIF:
 
         image_linear = np.reshape(floatimage, (numpixels,)).astype(np.float32)
         histogram_linear = np.reshape(histogram, (np.size(histogram),)).astype(np.float32)
-        transform = np.zeros_like(image_linear).astype(np.float32)
-
-        mf = cl.mem_flags
-        self.buf_image = cl.Buffer(self.context, mf.READ_ONLY | mf.COPY_HOST_PTR, hostbuf=image_linear)
-        self.buf_histogram = cl.Buffer(self.context, mf.READ_ONLY | mf.COPY_HOST_PTR, hostbuf=histogram_linear)
-        self.output_buf = cl.Buffer(self.context, mf.READ_WRITE, transform.nbytes)
-
-        kernel = self.program.IIF
-        kernel.set_scalar_arg_dtypes([np.uintc, np.uintc, np.float32] + [None] * 3)
-        kernel.set_arg(0, np.uintc(width))
-        kernel.set_arg(1, np.uintc(height))
-        kernel.set_arg(2, np.float32(k))
-        kernel.set_arg(3, self.buf_image)
-        kernel.set_arg(4, self.buf_histogram)
-        kernel.set_arg(5, self.output_buf)
+        transform = np.empty_like(image_linear)
 
-        cl.enqueue_nd_range_kernel(self.queue, kernel, image_linear.shape, None).wait()
+        buf_image = self.buffers.upload("image", image_linear)
+        buf_histogram = self.buffers.upload("histogram", histogram_linear)
+        output_buf = self.enqueue(buf_image, buf_histogram, k, width, height)
 
-        cl.enqueue_read_buffer(self.queue, self.output_buf, transform).wait()
+        self.buffers.download(output_buf, transform)
         return np.reshape(transform, (width, height)).astype(np.float)
 
 
@@ -5,10 +5,17 @@ from utils.histogram.cl_run_iif import CL_IIF, CL_IIF_BINID
 from utils.histogram.lsh import num_bins
 
 
+# created on first use, see lsh.load_cl_runners
+fast_binid = None
+fast_iif = None
+
+
 def illumination_invariant_features_hybrid(image, histogram, k=0.1, debug_ax=None):
+    global fast_binid
     width, height, nbins = np.shape(histogram)
-    fast_binid = CL_IIF_BINID()
-    fast_binid.load_program()
+    if fast_binid is None:
+        fast_binid = CL_IIF_BINID()
+        fast_binid.load_program()
     bp_mtx = fast_binid.compute(image, nbins)
 
     b_mtx = np.ndarray((1,1, nbins))
@@ -29,9 +36,9 @@ def illumination_invariant_features_hybrid(image, histogram, k=0.1, debug_ax=Non
     return feature_img
 
 
-fast_iif = CL_IIF(num_bins=num_bins)
-fast_iif.load_program()
-
-
 def illumination_invariant_features_cl(image, histogram, k=0.1, debug_ax=None):
-    return fast_iif.compute(image, histogram, k)
\ No newline at end of file
+    global fast_iif
+    if fast_iif is None:
+        fast_iif = CL_IIF(num_bins=num_bins)
+        fast_iif.load_program()
+    return fast_iif.compute(image, histogram, k)
@@ -9,14 +9,11 @@ num_bins = 32
 
 
 def locality_sensitive_histogram_hybrid(image, sigma=0.15, num_bins=32, debug_ax=None):
-    # it has some weird bug (try a solid white image)
-    # but it generally works.
     width, height = np.shape(image)
     alpha_x = exp(-sqrt(2.0) / (sigma * width))
     alpha_y = exp(-sqrt(2.0) / (sigma * height))
 
-    fast_Q = CL_Q()
-    fast_Q.load_program()
+    load_cl_runners()
     q_mtx = fast_Q.compute(image, num_bins)
 
     #debug_ax.imshow(q_mtx[:,:,11], cmap="gray")
@@ -65,15 +62,26 @@ def locality_sensitive_histogram_hybrid(image, sigma=0.15, num_bins=32, debug_ax
     return hist_mtx
 
 
-fast_Q = CL_Q()
-fast_hist_1D_x = CL_hist_1D(direction="x")
-fast_hist_1D_y = CL_hist_1D(direction="y")
-fast_Q.load_program()
-fast_hist_1D_x.load_program()
-fast_hist_1D_y.load_program()
+# opencl runners are created on first use, so that importing this module does not require an opencl device;
+# they are shared by every call, so that programs and device buffers get reused frame after frame
+fast_Q = None
+fast_hist_1D_x = None
+fast_hist_1D_y = None
+
+
+def load_cl_runners():
+    global fast_Q, fast_hist_1D_x, fast_hist_1D_y
+    if fast_Q is None:
+        fast_Q = CL_Q()
+        fast_hist_1D_x = CL_hist_1D(direction="x")
+        fast_hist_1D_y = CL_hist_1D(direction="y")
+        fast_Q.load_program()
+        fast_hist_1D_x.load_program()
+        fast_hist_1D_y.load_program()
 
 
 def locality_sensitive_histogram_cl(image, sigma=0.15, debug_ax=None):
+    load_cl_runners()
     width, height = np.shape(image)
 
     Q = fast_Q.compute(image, num_bins)
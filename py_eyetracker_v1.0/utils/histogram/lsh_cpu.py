@@ -0,0 +1,174 @@
+"""
+CPU implementation of the locality sensitive histogram and of the illumination invariant features,
+computing the same alpha_x / alpha_y recursion as the opencl kernels (cl_kernels/lsh_1D_*.cl).
+
+Each separable pass of the recursion is
+    left[i]  = q[i] + alpha * left[i-1]
+    right[i] = q[i] + alpha * right[i+1]
+    out[i]   = left[i] + right[i] - q[i]
+which is computed in place, slice after slice (each slice being a whole batch of rows or columns),
+as out = left + right_excl, with right_excl[i] = alpha * (q[i+1] + right_excl[i+1]).
+This way a pass needs just one scratch volume besides the histogram itself.
+The normalization factor is the same for every bin, so it is computed once as a 2D map (see
+normalization_factor).
+
+Volumes are laid out bins-first, (num_bins, width, height), so that a group of bins is contiguous
+and can be handed to a worker thread.
+"""
+from math import exp, sqrt
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+
+def bin_numbers(image, num_bins):
+    # a solid white pixel (intensity 1.0) belongs to the last bin, not to bin num_bins
+    bins = (np.asarray(image, dtype=np.float32) * num_bins).astype(np.intp)
+    return np.minimum(bins, num_bins - 1)
+
+
+def recursive_pass(volume, scratch, alpha, axis):
+    """
+    One separable pass of the recursive filter, in place
+    :param volume: array to filter, overwritten with the result
+    :param scratch: array with the same shape as volume, used as working memory
+    :param alpha: decay factor of the recursion
+    :param axis: axis along which the recursion runs
+    """
+    length = volume.shape[axis]
+
+    def at(array, i):
+        index = [slice(None)] * array.ndim
+        index[axis] = i
+        return array[tuple(index)]
+
+    # right part, excluding the pixel itself (computed first, while volume still holds q)
+    at(scratch, length - 1)[...] = 0
+    for i in reversed(range(0, length - 1)):
+        s = at(scratch, i)
+        np.add(at(volume, i + 1), at(scratch, i + 1), out=s)
+        s *= alpha
+    # left part, in place
+    for i in range(1, length):
+        v = at(volume, i)
+        v += alpha * at(volume, i - 1)
+    volume += scratch
+
+
+def normalization_factor(width, height, alpha_x, alpha_y):
+    """
+    Same as the normalization output of cl_kernels/lsh_1D_y.cl followed by lsh_1D_x.cl: unlike the
+    histogram, both passes subtract 1.0 rather than their input, so the order of the passes matters
+    """
+    norm = np.ones((width, height), dtype=np.float32)
+    scratch = np.empty_like(norm)
+    recursive_pass(norm, scratch, alpha_y, axis=0)
+    first_pass = norm - 1.0
+    recursive_pass(norm, scratch, alpha_x, axis=1)
+    norm += first_pass
+    return norm
+
+
+def split_bins(num_bins, chunk):
+    return [(b, min(b + chunk, num_bins)) for b in range(0, num_bins, chunk)]
+
+
+def run_on_bins(function, num_bins, threads, bin_chunk=None):
+    """
+    Call function(first_bin, last_bin, buffers) on groups of at most bin_chunk bins, possibly on a
+    thread pool (numpy releases the GIL on the large array operations).
+    Each worker gets its own buffers dict, reused across the groups it processes.
+    :return: list with the buffers dict of every worker
+    """
+    threads = max(threads or 1, 1)
+    if bin_chunk is None:
+        bin_chunk = -(-num_bins // threads)
+    groups = split_bins(num_bins, bin_chunk)
+    workers_buffers = [{} for _ in range(min(threads, len(groups)))]
+
+    def worker(worker_id):
+        for first, last in groups[worker_id::len(workers_buffers)]:
+            function(first, last, workers_buffers[worker_id])
+
+    if len(workers_buffers) == 1:
+        worker(0)
+    else:
+        with ThreadPoolExecutor(max_workers=len(workers_buffers)) as pool:
+            list(pool.map(worker, range(len(workers_buffers))))
+    return workers_buffers
+
+
+def histogram_bins(bins, first, last, alpha_x, alpha_y, hist_t, hist):
+    """
+    Un-normalized locality sensitive histogram of the bins [first, last)
+    :param bins: bin number of every pixel
+    :param hist_t: volume (last-first, height, width) used as working memory
+    :param hist: volume (last-first, width, height), overwritten with the result
+    """
+    # the x pass runs on a transposed volume, so that both passes go along axis 1 (contiguous slices);
+    # the two volumes take turns as input and scratch, and the result ends up in hist
+    np.equal(bins.T[np.newaxis, :, :], np.arange(first, last)[:, np.newaxis, np.newaxis], out=hist_t, casting="unsafe")
+    recursive_pass(hist_t, hist.reshape(hist_t.shape), alpha_x, axis=1)
+    np.copyto(hist, hist_t.transpose(0, 2, 1))
+    recursive_pass(hist, hist_t.reshape(hist.shape), alpha_y, axis=1)
+
+
+def get_volumes(buffers, num_bins, width, height):
+    """
+    Work volumes for a group of num_bins bins, allocated once per worker (see run_on_bins)
+    """
+    if "hist" not in buffers or buffers["hist"].shape[0] < num_bins:
+        buffers["hist_t"] = np.empty((num_bins, height, width), dtype=np.float32)
+        buffers["hist"] = np.empty((num_bins, width, height), dtype=np.float32)
+    return buffers["hist_t"][:num_bins], buffers["hist"][:num_bins]
+
+
+def iif_weights(image, num_bins, k):
+    bins = bin_numbers(image, num_bins)
+    intensity_adjusted = np.maximum(k * image * 100, k)
+    scale = -1.0 / (2 * intensity_adjusted ** 2)
+    return bins, scale
+
+
+def illumination_invariant_features_cpu(image, histogram, k=0.1):
+    """
+    Same as cl_kernels/iif_kernel.cl
+    :param histogram: normalized histogram, numpy array (width, height, num_bins)
+    :return: feature image, numpy 2d array
+    """
+    num_bins = np.shape(histogram)[2]
+    bins, scale = iif_weights(image, num_bins, k)
+
+    feature_img = np.zeros(np.shape(image))
+    for b in range(num_bins):
+        feature_img += np.exp(scale * (b - bins) ** 2) * histogram[:, :, b]
+    return feature_img
+
+
+def lsh_equalization_cpu(picture_float, sigma=0.15, num_bins=32, k=0.1, threads=None, bin_chunk=None):
+    """
+    Locality sensitive histogram followed by the illumination invariant features, computed for
+    bin_chunk bins at a time: the features are accumulated into a running per-pixel sum, so the
+    full (width, height, num_bins) volume is never materialized.
+    Peak memory is about 2 * bin_chunk * width * height * 4 bytes per thread.
+    :param threads: number of worker threads (None or 1: compute everything in the calling thread)
+    :param bin_chunk: number of bins processed at a time (None: all the bins assigned to a thread at once)
+    :return: feature image, numpy 2d array
+    """
+    width, height = np.shape(picture_float)
+    alpha_x = exp(-sqrt(2.0) / (sigma * width))
+    alpha_y = exp(-sqrt(2.0) / (sigma * height))
+    bins, scale = iif_weights(picture_float, num_bins, k)
+
+    def compute_bins(first, last, buffers):
+        hist_t, hist = get_volumes(buffers, last - first, width, height)
+        histogram_bins(bins, first, last, alpha_x, alpha_y, hist_t, hist)
+        if "features" not in buffers:
+            buffers["features"] = np.zeros((width, height))
+        for b in range(first, last):
+            buffers["features"] += np.exp(scale * (b - bins) ** 2) * hist[b - first]
+
+    workers_buffers = run_on_bins(compute_bins, num_bins, threads, bin_chunk=bin_chunk)
+
+    feature_img = sum(buffers["features"] for buffers in workers_buffers)
+    # the normalization factor is the same for every bin, so it can be applied to the sum
+    return feature_img / normalization_factor(width, height, alpha_x, alpha_y)
@@ -1,10 +1,60 @@
 
 
 from utils.histogram.lsh import locality_sensitive_histogram_cl as locality_sensitive_histogram
+from utils.histogram.lsh import num_bins
 from utils.histogram.iif import illumination_invariant_features_cl as illumination_invariant_features
+from utils.histogram.cl_run_fused import CL_LSH_IIF
+from utils.histogram.lsh_cpu import lsh_equalization_cpu
 
 
-def lsh_equalization(picture_float):
+# created on first use, see lsh.load_cl_runners
+fast_lsh_iif = None
+
+
+def lsh_equalization_chained(picture_float):
     histogram = locality_sensitive_histogram(picture_float)
     iif = illumination_invariant_features(picture_float, histogram)
     return iif
+
+
+def lsh_equalization_fused(picture_float):
+    global fast_lsh_iif
+    if fast_lsh_iif is None:
+        fast_lsh_iif = CL_LSH_IIF(num_bins=num_bins)
+        fast_lsh_iif.load_program()
+    return fast_lsh_iif.compute(picture_float, bin_chunk=bin_chunk)
+
+
+def lsh_equalization_numpy(picture_float):
+    return lsh_equalization_cpu(picture_float, threads=cpu_threads, bin_chunk=bin_chunk)
+
+
+engines = {
+    "fused": lsh_equalization_fused,  # every stage on the device, only the result is read back
+    "cl": lsh_equalization_chained,  # every stage reads its result back to the host
+    "cpu": lsh_equalization_numpy,  # no opencl needed
+}
+engine = "fused"
+cpu_threads = None
+bin_chunk = None
+
+
+def set_engine(name, threads=None, chunk=None):
+    """
+    :param name: one of the keys of engines
+    :param threads: worker threads used by the cpu engine (None: no thread pool)
+    :param chunk: number of histogram bins processed at a time by the fused and cpu engines,
+        to bound the peak memory (None: all the bins at once)
+    """
+    global engine, cpu_threads, bin_chunk
+    if name not in engines:
+        raise Exception("unknown lsh engine \"%s\"" % name)
+    if chunk is not None and chunk < 1:
+        raise Exception("the lsh bin chunk must be at least 1 (got %d)" % chunk)
+    engine = name
+    cpu_threads = threads
+    bin_chunk = chunk
+
+
+def lsh_equalization(picture_float):
+    return engines[engine](picture_float)
@@ -1,4 +1,5 @@
 import logging, sys
+from logging.handlers import MemoryHandler
 
 
 class LogMaster:
@@ -32,4 +33,19 @@ class LogMaster:
         formatter = logging.Formatter('%(asctime)s: [%(name)s][%(levelname)s]: %(message)s')
         ch.setFormatter(formatter)
         logger.addHandler(ch)
-        return logger
\ No newline at end of file
+        return logger
+
+    @staticmethod
+    def bufferedLogger(name, loglevel, capacity=200):
+        """
+        Logger for messages emitted on every frame: they are kept in memory, and written in blocks of
+        capacity messages (or at once, from the WARNING level up). Pending messages are written at exit.
+        """
+        logger = logging.getLogger(name)
+        logger.setLevel(loglevel)
+        logger.handlers = []
+        ch = logging.StreamHandler(sys.stdout)
+        formatter = logging.Formatter('%(asctime)s: [%(name)s][%(levelname)s]: %(message)s')
+        ch.setFormatter(formatter)
+        logger.addHandler(MemoryHandler(capacity, flushLevel=logging.WARNING, target=ch))
+        return logger
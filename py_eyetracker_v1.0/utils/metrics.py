@@ -0,0 +1,269 @@
+"""
+Tracker telemetry: counters (frames processed and dropped, detections by method), latency histograms
+and event rates (gaze estimates per second). The metrics are exported in the Prometheus text format by a
+local HTTP endpoint, and/or appended every few seconds to a JSON-lines file.
+Like utils/profiling.py, the functions called on the frame path (count, observe, mark) return at once
+until the metrics are enabled.
+"""
+import json
+import logging
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from threading import Lock, Thread
+
+from utils.logging import LogMaster
+
+
+# see enable
+active_metrics = None
+
+# upper bounds of the latency histograms, in seconds
+latency_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+class Histogram:
+
+    def __init__(self, buckets=latency_buckets):
+        self.buckets = buckets
+        # counts[i]: observations in (buckets[i-1], buckets[i]]; the last one counts those above every bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        n = 0
+        while n < len(self.buckets) and value > self.buckets[n]:
+            n += 1
+        self.counts[n] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self):
+        """
+        :return: list of tuples (upper bound, observations not above it), as in the Prometheus format
+        """
+        cumulative = []
+        total = 0
+        for bound, count in zip(list(self.buckets) + [float("inf")], self.counts):
+            total += count
+            cumulative.append((bound, total))
+        return cumulative
+
+
+class Meter:
+    """
+    Counts events, and their rate over the last window seconds
+    """
+
+    def __init__(self, window=5.0):
+        self.window = window
+        self.count = 0
+        self.times = deque()
+
+    def mark(self, now):
+        self.count += 1
+        self.times.append(now)
+        self.expire(now)
+
+    def expire(self, now):
+        while len(self.times) > 0 and self.times[0] < now - self.window:
+            self.times.popleft()
+
+    def rate(self, now):
+        self.expire(now)
+        return len(self.times) / self.window
+
+
+def labels_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if len(pairs) == 0:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (name, str(value).replace('"', "'")) for name, value in pairs)
+
+
+def format_bound(bound):
+    return "+Inf" if bound == float("inf") else repr(bound)
+
+
+class Metrics:
+    """
+    Registry of the metrics, created on first use: name -> {labels -> Counter, Histogram or Meter}.
+    Safe to update from several threads.
+    """
+
+    def __init__(self, prefix="eyetracker_"):
+        self.prefix = prefix
+        self.lock = Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.meters = {}
+
+    def count(self, name, amount=1, **labels):
+        key = labels_key(labels)
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = labels_key(labels)
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            if key not in series:
+                series[key] = Histogram()
+            series[key].observe(value)
+
+    def mark(self, name, **labels):
+        key = labels_key(labels)
+        now = time.monotonic()
+        with self.lock:
+            series = self.meters.setdefault(name, {})
+            if key not in series:
+                series[key] = Meter()
+            series[key].mark(now)
+
+    def prometheus_text(self):
+        lines = []
+        now = time.monotonic()
+        with self.lock:
+            for name, series in sorted(self.counters.items()):
+                lines.append("# TYPE %s%s counter" % (self.prefix, name))
+                for key, value in series.items():
+                    lines.append("%s%s%s %d" % (self.prefix, name, format_labels(key), value))
+            for name, series in sorted(self.meters.items()):
+                lines.append("# TYPE %s%s_total counter" % (self.prefix, name))
+                for key, meter in series.items():
+                    lines.append("%s%s_total%s %d" % (self.prefix, name, format_labels(key), meter.count))
+                lines.append("# TYPE %s%s_per_second gauge" % (self.prefix, name))
+                for key, meter in series.items():
+                    lines.append("%s%s_per_second%s %.3f" % (self.prefix, name, format_labels(key), meter.rate(now)))
+            for name, series in sorted(self.histograms.items()):
+                lines.append("# TYPE %s%s histogram" % (self.prefix, name))
+                for key, histogram in series.items():
+                    for bound, count in histogram.cumulative_counts():
+                        lines.append("%s%s_bucket%s %d" % (self.prefix, name,
+                                                           format_labels(key, [("le", format_bound(bound))]), count))
+                    lines.append("%s%s_sum%s %.6f" % (self.prefix, name, format_labels(key), histogram.sum))
+                    lines.append("%s%s_count%s %d" % (self.prefix, name, format_labels(key), histogram.count))
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """
+        :return: dict with the current value of every metric (JSON serializable)
+        """
+        now = time.monotonic()
+        with self.lock:
+            return {
+                "time": time.time(),
+                "counters": {name: [dict(key, value=value) for key, value in series.items()]
+                             for name, series in self.counters.items()},
+                "rates": {name: [dict(key, total=meter.count, per_second=meter.rate(now))
+                                 for key, meter in series.items()]
+                          for name, series in self.meters.items()},
+                "histograms": {name: [dict(key, count=histogram.count, sum=histogram.sum,
+                                           buckets=[[format_bound(bound), count]
+                                                    for bound, count in histogram.cumulative_counts()])
+                                      for key, histogram in series.items()]
+                               for name, series in self.histograms.items()},
+            }
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class MetricsExporter(LogMaster):
+    """
+    Serves the metrics on http://host:port/metrics (Prometheus text format; /metrics.json for a snapshot),
+    and/or appends a snapshot to a JSON-lines file every interval seconds
+    """
+
+    def __init__(self, metrics, port=None, path=None, interval=5.0, host="127.0.0.1", loglevel=logging.INFO):
+        self.setLogger(self.__class__.__name__, loglevel)
+        self.metrics = metrics
+        self.port = port
+        self.path = path
+        self.interval = interval
+        self.host = host
+        self.server = None
+        self.stopped = False
+
+    def start(self):
+        if self.port is not None:
+            metrics = self.metrics
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path == "/metrics":
+                        body, content_type = metrics.prometheus_text(), "text/plain; version=0.0.4"
+                    elif self.path == "/metrics.json":
+                        body, content_type = json.dumps(metrics.snapshot()), "application/json"
+                    else:
+                        self.send_error(404)
+                        return
+                    body = body.encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("Content-Type", content_type)
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, format, *args):
+                    pass
+
+            self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+            Thread(target=self.server.serve_forever, name="metrics http", daemon=True).start()
+            self.logger.info("Serving the metrics on http://%s:%d/metrics" % (self.host, self.server.server_port))
+        if self.path is not None:
+            Thread(target=self.flush_loop, name="metrics file", daemon=True).start()
+        return self
+
+    def flush_loop(self):
+        while not self.stopped:
+            time.sleep(self.interval)
+            self.flush()
+
+    def flush(self):
+        with open(self.path, "a") as fp:
+            fp.write(json.dumps(self.metrics.snapshot()) + "\n")
+
+    def stop(self):
+        self.stopped = True
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        if self.path is not None:
+            # the last partial interval
+            self.flush()
+
+
+def enable(port=None, path=None, interval=5.0):
+    """
+    Start collecting the metrics
+    :param port: serve them over HTTP on this local port (None: no HTTP endpoint)
+    :param path: append them to this JSON-lines file every interval seconds (None: no file)
+    :return: the MetricsExporter
+    """
+    global active_metrics
+    active_metrics = Metrics()
+    return MetricsExporter(active_metrics, port=port, path=path, interval=interval).start()
+
+
+def count(name, amount=1, **labels):
+    if active_metrics is not None:
+        active_metrics.count(name, amount, **labels)
+
+
+def observe(name, value, **labels):
+    if active_metrics is not None:
+        active_metrics.observe(name, value, **labels)
+
+
+def mark(name, **labels):
+    if active_metrics is not None:
+        active_metrics.mark(name, **labels)
@@ -0,0 +1,216 @@
+"""
+Staged frame pipeline: every stage runs on its own thread, and consecutive stages are connected by
+bounded queues which drop the oldest item when full, so that a slow stage makes the pipeline skip
+frames instead of accumulating latency.
+Most of the per-frame work (dlib, OpenCV, NumPy, OpenCL) releases the GIL, so the stages do overlap.
+"""
+import logging
+import time
+from collections import deque
+from threading import Condition, Thread
+
+from utils import metrics
+from utils.logging import LogMaster
+
+
+class DropOldestQueue:
+    """
+    Bounded FIFO queue: put() never blocks, when the queue is full the oldest item is discarded
+    """
+
+    def __init__(self, maxsize=1, name=None, on_drop=None):
+        """
+        :param name: name of the stage reading from the queue (labels the frames_dropped_total metric)
+        :param on_drop: function(item) called with every discarded item (e.g. to recycle its buffers)
+        """
+        self.maxsize = maxsize
+        self.name = name
+        self.on_drop = on_drop
+        self.items = deque()
+        self.condition = Condition()
+        self.dropped = 0
+        self.closed = False
+
+    def put(self, item):
+        dropped = None
+        with self.condition:
+            if len(self.items) >= self.maxsize:
+                dropped = self.items.popleft()
+                self.dropped += 1
+                metrics.count("frames_dropped_total", stage=self.name)
+            self.items.append(item)
+            self.condition.notify()
+        if dropped is not None and self.on_drop is not None:
+            self.on_drop(dropped)
+
+    def get(self, timeout=None):
+        """
+        :return: the oldest item, None on timeout or if the queue was closed and is empty
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: len(self.items) > 0 or self.closed, timeout)
+            if len(self.items) == 0:
+                return None
+            return self.items.popleft()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class Stage:
+    """
+    Applies function to every item of input_queue, and puts the results (if not None) into
+    output_queue. A stage without an input queue is a source: function is called with no arguments.
+
+    processed: number of items processed
+    busy_time: seconds spent inside function
+    """
+
+    def __init__(self, name, function, input_queue, output_queue, on_error=None):
+        """
+        :param on_error: function(stage, exception) called if function raises; the stage stops
+        """
+        self.name = name
+        self.function = function
+        self.input_queue = input_queue
+        self.output_queue = output_queue
+        self.on_error = on_error
+        self.stopped = False
+        self.processed = 0
+        self.busy_time = 0.0
+        self.thread = None
+
+    def start(self):
+        self.thread = Thread(target=self.run, name=self.name, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while not self.stopped:
+            if self.input_queue is not None:
+                item = self.input_queue.get(timeout=0.1)
+                if item is None:
+                    continue
+            time_started = time.perf_counter()
+            try:
+                result = self.function(item) if self.input_queue is not None else self.function()
+            except Exception as e:
+                self.stopped = True
+                if self.on_error is None:
+                    raise
+                self.on_error(self, e)
+                return
+            if self.input_queue is None and result is None:
+                continue
+            self.busy_time += time.perf_counter() - time_started
+            self.processed += 1
+            if result is not None and self.output_queue is not None:
+                self.output_queue.put(result)
+
+    def stop(self):
+        self.stopped = True
+
+
+class Pipeline(LogMaster):
+    """
+    Chain of stages. The last one (the sink, see run_sink) runs on the calling thread, since
+    GUI toolkits want to be driven from the main thread.
+    """
+
+    def __init__(self, queue_size=1, report_interval=5.0, on_drop=None, loglevel=logging.INFO):
+        """
+        :param queue_size: capacity of the queues between the stages
+        :param report_interval: log the per-stage throughput every N seconds (None to disable)
+        :param on_drop: function(item) called with every item dropped by a queue (see DropOldestQueue)
+        """
+        self.setLogger(self.__class__.__name__, loglevel)
+        self.queue_size = queue_size
+        self.report_interval = report_interval
+        self.on_drop = on_drop
+        self.stages = []
+        self.queues = []
+        self.stopped = False
+        # first exception raised by a stage, re-raised by run_sink
+        self.error = None
+
+    @property
+    def max_items_in_flight(self):
+        """
+        Upper bound to the number of items alive at the same time in the pipeline
+        (queued, or being processed by a stage); useful to size buffer pools
+        """
+        return len(self.queues) * self.queue_size + len(self.stages) + 1
+
+    def add_source(self, name, function):
+        """
+        :param function: called repeatedly, returns the next item (or None if there is none yet)
+        """
+        return self.add_stage(name, function, source=True)
+
+    def add_stage(self, name, function, source=False):
+        input_queue = None if source else self.queues[-1]
+        if input_queue is not None:
+            input_queue.name = name
+        output_queue = DropOldestQueue(self.queue_size, on_drop=self.on_drop)
+        self.queues.append(output_queue)
+        self.stages.append(Stage(name, function, input_queue, output_queue, on_error=self.stage_failed))
+        return self
+
+    def run_sink(self, name, function):
+        """
+        Start all the stages, and run the last one on the calling thread until stop() is called, or until
+        a stage raises an exception: the pipeline is then stopped, and the exception re-raised here
+        """
+        self.queues[-1].name = name
+        sink = Stage(name, function, self.queues[-1], None, on_error=self.stage_failed)
+        self.stages.append(sink)
+        for stage in self.stages[:-1]:
+            stage.start()
+        if self.report_interval is not None:
+            Thread(target=self.report_loop, name="pipeline report", daemon=True).start()
+        sink.run()
+        if self.error is not None:
+            raise self.error
+
+    def stage_failed(self, stage, error):
+        self.logger.exception("stage \"%s\" failed, stopping the pipeline" % stage.name)
+        if self.error is None:
+            self.error = error
+        self.stop()
+
+    def stop(self):
+        self.stopped = True
+        for stage in self.stages:
+            stage.stop()
+        for queue in self.queues:
+            queue.close()
+
+    def report_loop(self):
+        last = self.snapshot()
+        while not self.stopped:
+            time.sleep(self.report_interval)
+            current = self.snapshot()
+            self.logger.info(self.throughput_report(last, current))
+            last = current
+
+    def snapshot(self):
+        return (time.perf_counter(),
+                [(stage.processed, stage.busy_time) for stage in self.stages],
+                [queue.dropped for queue in self.queues])
+
+    def throughput_report(self, last, current):
+        """
+        :return: string with frames per second, fraction of time busy and dropped frames of every stage
+        """
+        elapsed = max(current[0] - last[0], 1e-9)
+        parts = []
+        for n, stage in enumerate(self.stages):
+            processed = current[1][n][0] - last[1][n][0]
+            busy = current[1][n][1] - last[1][n][1]
+            part = "%s: %.1f fps (busy %d%%)" % (stage.name, processed / elapsed, 100 * busy / elapsed)
+            # drops happen on the queue in front of a stage
+            if stage.input_queue is not None:
+                part += ", %d dropped" % (current[2][n - 1] - last[2][n - 1])
+            parts.append(part)
+        return " | ".join(parts)
@@ -1,11 +1,35 @@
 import numpy as np
 import cv2
-from skimage import img_as_float, img_as_ubyte
 
 from classes import Face
 from utils.eye_area import split_eyes
-from utils.face_landmarks.dlib_based import eye_area_detection_step, pick_eye_corners
+from utils.face_landmarks.dlib_based import eye_area_detection_step, eye_area_detection_step_multi, pick_eye_corners
 from utils.face_landmarks.sixpoints import six_points
+from utils.face_landmarks import landmark_cache
+from utils.profiling import timed
+from utils import metrics
+
+
+class FrameBuffers:
+    """
+    Work buffers reused across the frames, re-allocated only when the frame size changes.
+    The images returned by process_frame may live in these buffers: they are valid until the
+    next frame is processed with the same FrameBuffers.
+    """
+
+    def __init__(self):
+        self.arrays = {}
+
+    def get(self, name, shape, dtype):
+        array = self.arrays.get(name)
+        if array is None or array.shape != shape or array.dtype != dtype:
+            array = np.empty(shape, dtype=dtype)
+            self.arrays[name] = array
+        return array
+
+
+# used when process_frame is not given its own FrameBuffers
+default_buffers = FrameBuffers()
 
 
 def cropped_rect(image, rect):
@@ -13,7 +37,7 @@ def cropped_rect(image, rect):
     Crops an image represented by a 2d numpy array
     :param image: numpy 2d array
     :param rect: list or tuple of four elements: x,y,width,height
-    :return: numpy 2d array containing the cropped region
+    :return: numpy 2d array containing the cropped region (a view on image, not a copy)
     """
     (x1, y1, width, height) = rect
     if x1 < 0:
@@ -22,25 +46,89 @@ def cropped_rect(image, rect):
     if y1 < 0:
         height += y1
         y1 = 0
-    return np.copy(image[y1:y1+height,x1:x1+width])
+    return image[y1:y1+height,x1:x1+width]
 
 
-def rgb_to_single_channel(image_cv2format_rgb):
+def rgb_to_single_channel(image_cv2format_rgb, buffers=default_buffers):
     # new_img = cv2.cvtColor(image_cv2format_rgb, cv2.COLOR_RGB2YUV)
     # return new_img[:,:,1]
-    new_img = cv2.cvtColor(image_cv2format_rgb, cv2.COLOR_RGB2GRAY)
+    new_img = buffers.get("gray", image_cv2format_rgb.shape[:2], np.uint8)
+    cv2.cvtColor(image_cv2format_rgb, cv2.COLOR_RGB2GRAY, dst=new_img)
     return new_img
 
 
-def image_preprocessing_step(image_cv2format, algo):
-    picture_float = img_as_float(image_cv2format)
+def to_float(image_cv2format, buffers=default_buffers):
+    """
+    Same as skimage's img_as_float, but in a float32 work buffer
+    """
+    picture_float = buffers.get("float", image_cv2format.shape, np.float32)
+    np.multiply(image_cv2format, np.float32(1.0 / 255), out=picture_float)
+    return picture_float
+
+
+def to_ubyte(picture, buffers=default_buffers):
+    """
+    Same as skimage's img_as_ubyte (but saturating instead of failing on values out of [0, 1]),
+    in a work buffer
+    """
+    image_cv2format = buffers.get("ubyte", picture.shape, np.uint8)
+    cv2.convertScaleAbs(picture, dst=image_cv2format, alpha=255)
+    return image_cv2format
+
+
+def image_preprocessing_step(image_cv2format, algo, buffers=default_buffers):
+    picture_float = to_float(image_cv2format, buffers)
     picture_float_equalized = algo.equalization(picture_float)
     #picture_float_equalized = picture_float
-    image_cv2format_equalized = img_as_ubyte(picture_float_equalized)
+    image_cv2format_equalized = to_ubyte(picture_float_equalized, buffers)
     picture = picture_float_equalized
     return picture, image_cv2format, image_cv2format_equalized
 
 
+def roi_image_preprocessing_step(image_cv2format, buffers=default_buffers):
+    """
+    Like image_preprocessing_step, but leaves the equalization to roi_equalization_step:
+    the face detection runs on the raw frame (and on its cheap cv2 equalization, on a miss)
+    """
+    picture = to_float(image_cv2format, buffers)
+    return picture, image_cv2format, image_cv2format
+
+
+def padded_slices(rect, shape, padding):
+    """
+    :param rect: Rect (x,y,width,height)
+    :param shape: shape of the image
+    :param padding: margin to add on every side, as a fraction of the rect width and height
+    :return: tuple of slices (rows, columns) selecting the padded rect, clipped to the image
+    """
+    (x, y, width, height) = rect
+    pad_x = int(width * padding)
+    pad_y = int(height * padding)
+    return (slice(max(y - pad_y, 0), min(y + height + pad_y, shape[0])),
+            slice(max(x - pad_x, 0), min(x + width + pad_x, shape[1])))
+
+
+def roi_equalization_step(picture, eyes, algo, padding=0.5):
+    """
+    Apply the (expensive) equalization to the eye regions only, in place.
+    The regions are padded, so that the equalization has some context around the eye; the padded regions
+    may overlap, so all of them are equalized from the raw picture first, then only the eye rects are
+    written back.
+    :param picture: float image (modified in place)
+    :param eyes: list of Rect
+    """
+    with timed("roi equalization"):
+        equalized = []
+        for rect in eyes:
+            roi = padded_slices(rect, picture.shape, padding)
+            if picture[roi].size > 0:
+                equalized.append((rect, roi, algo.equalization(picture[roi])))
+        for rect, roi, roi_equalized in equalized:
+            rows, columns = padded_slices(rect, picture.shape, 0)
+            picture[rows, columns] = roi_equalized[rows.start - roi[0].start:rows.stop - roi[0].start,
+                                                   columns.start - roi[1].start:columns.stop - roi[1].start]
+
+
 def geometric_eye_area_selection_step(eyes):
     right_eye, left_eye = split_eyes(eyes)
 
@@ -51,41 +139,63 @@ def geometric_eye_area_selection_step(eyes):
 
 
 def eye_features_extraction_step(picture, right_eye, left_eye, algo):
-    right_eyepatch = cropped_rect(picture, right_eye.area)
-    algo.detect_eye_features(right_eyepatch, right_eye)
+    with timed("eye centers"):
+        right_eyepatch = cropped_rect(picture, right_eye.area)
+        algo.detect_eye_features(right_eyepatch, right_eye)
 
-    left_eyepatch = cropped_rect(picture, left_eye.area)
-    algo.detect_eye_features(left_eyepatch, left_eye)
+        left_eyepatch = cropped_rect(picture, left_eye.area)
+        algo.detect_eye_features(left_eyepatch, left_eye)
 
 
-def face_spatial_tracking_step(face, picture):
-    face.orientation, face.translation, face.head_pose = six_points(face.dlib68_points, picture.shape)
-
-
-def process_frame(image_cv2format, algo, cascade_files, already_grayscale=False):
+def batched_eye_features_extraction_step(picture, faces, algo):
     """
-    Preprocess and image and extract useful features
-    :param image_cv2format: cv2 image (numpy 2d array of ubyte)
-    :param algo: algorithm to use to preprocess / extract features
-    :return: tuple containing:
-        postprocessed image (in the skimage format, aka numpy 2d array of float)
-        right eye object (see classes.py)
-        left eye object (see classes.py)
-        debug string describing the detection method
-        list of Rect which could be eyes but were refused by the geometric estimator
+    Same as eye_features_extraction_step, for the eyes of all the faces at once
+    (see EyeFeaturesExtractor.detect_eye_features_batch)
     """
+    with timed("eye centers"):
+        eye_objects = [eye for face in faces for eye in (face.right_eye, face.left_eye)]
+        eyepatches = [cropped_rect(picture, eye.area) for eye in eye_objects]
+        algo.detect_eye_features_batch(eyepatches, eye_objects)
 
-    new_face = Face()
 
-    # pre-processing
+def face_spatial_tracking_step(face, picture):
+    with timed("head pose"):
+        if landmark_cache.active_cache is not None:
+            key = landmark_cache.head_pose_key(face.dlib68_points, picture.shape)
+            face.orientation, face.translation, face.head_pose = landmark_cache.active_cache.cached(
+                key, lambda: six_points(face.dlib68_points, picture.shape))
+        else:
+            face.orientation, face.translation, face.head_pose = six_points(face.dlib68_points, picture.shape)
+
+
+def preprocessing_step(image_cv2format, algo, already_grayscale, roi_equalization, buffers):
     if not already_grayscale:
-        single_channel = rgb_to_single_channel(image_cv2format)
+        with timed("grayscale"):
+            single_channel = rgb_to_single_channel(image_cv2format, buffers)
     else:
         single_channel = image_cv2format
-    picture, image_cv2format, image_cv2format_equalized = image_preprocessing_step(single_channel, algo)
+    with timed("equalization"):
+        if roi_equalization:
+            return roi_image_preprocessing_step(single_channel, buffers)
+        else:
+            return image_preprocessing_step(single_channel, algo, buffers)
+
+
+def landmarking_step(image_cv2format, algo, already_grayscale=False, roi_equalization=False,
+                     buffers=default_buffers):
+    """
+    First half of process_frame: everything but the eye features extraction
+    :return: same as process_frame, but the pupils of the eye objects are not computed yet
+    """
+    new_face = Face()
+
+    picture, image_cv2format, image_cv2format_equalized = preprocessing_step(image_cv2format, algo, already_grayscale,
+                                                                             roi_equalization, buffers)
 
     # eye area detection
     success, detect_method, eyes, points68 = eye_area_detection_step(image_cv2format, image_cv2format_equalized)
+    metrics.count("frames_processed_total")
+    metrics.count("face_detections_total", method=detect_method)
     #success, detect_method, eyes = eye_area_detection_step_haar(image_cv2format, image_cv2format_equalized, cascade_files)
     if not success:
         return picture, None, detect_method, []
@@ -93,15 +203,89 @@ def process_frame(image_cv2format, algo, cascade_files, already_grayscale=False)
     new_face.dlib68_points = points68
     face_spatial_tracking_step(new_face, picture)
 
+    if roi_equalization:
+        roi_equalization_step(picture, eyes, algo)
+
     # geometrically select right and left eye
     right_eye, left_eye, not_eyes = geometric_eye_area_selection_step(eyes)
     pick_eye_corners(right_eye, points68)
     pick_eye_corners(left_eye, points68)
 
-    # extract the eye features (updates the objects right_eye and left_eye)
-    eye_features_extraction_step(picture, right_eye, left_eye, algo)
-
     new_face.left_eye = left_eye
     new_face.right_eye = right_eye
 
     return picture, new_face, detect_method, not_eyes
+
+
+def process_frame(image_cv2format, algo, cascade_files, already_grayscale=False, roi_equalization=False,
+                  buffers=default_buffers):
+    """
+    Preprocess and image and extract useful features
+    :param image_cv2format: cv2 image (numpy 2d array of ubyte)
+    :param algo: algorithm to use to preprocess / extract features
+    :param roi_equalization: detect the face on the raw frame, and equalize only the eye regions
+    :param buffers: FrameBuffers to work in (callers processing frames concurrently need one each)
+    :return: tuple containing:
+        postprocessed image (in the skimage format, aka numpy 2d array of float; see FrameBuffers)
+        face object (see classes.py), None if no face was found
+        debug string describing the detection method
+        list of Rect which could be eyes but were refused by the geometric estimator
+    """
+    with timed("frame"):
+        picture, face, detect_method, not_eyes = landmarking_step(image_cv2format, algo, already_grayscale,
+                                                                  roi_equalization, buffers)
+        if face is not None:
+            # extract the eye features (updates the objects right_eye and left_eye)
+            eye_features_extraction_step(picture, face.right_eye, face.left_eye, algo)
+
+    return picture, face, detect_method, not_eyes
+
+
+def process_frame_multi(image_cv2format, algo, cascade_files, already_grayscale=False, roi_equalization=False,
+                        buffers=default_buffers):
+    """
+    Same as process_frame, for all the faces in the frame. The eye features of all the faces
+    are extracted in a single batch.
+    :return: tuple containing:
+        postprocessed image (in the skimage format, aka numpy 2d array of float; see FrameBuffers)
+        list of face objects (see classes.py), empty if no face was found
+        debug string describing the detection method
+        list of Rect which could be eyes but were refused by the geometric estimator
+    """
+    with timed("frame"):
+        picture, image_cv2format, image_cv2format_equalized = preprocessing_step(image_cv2format, algo,
+                                                                                 already_grayscale,
+                                                                                 roi_equalization, buffers)
+
+        # eye area detection
+        success, detect_method, detections = eye_area_detection_step_multi(image_cv2format, image_cv2format_equalized)
+        metrics.count("frames_processed_total")
+        metrics.count("face_detections_total", method=detect_method)
+        if not success:
+            return picture, [], detect_method, []
+
+        if roi_equalization:
+            # all the faces at once, as their padded eye regions may overlap
+            roi_equalization_step(picture, [rect for eyes, _ in detections for rect in eyes], algo)
+
+        faces = []
+        not_eyes = []
+        for eyes, points68 in detections:
+            new_face = Face()
+            new_face.dlib68_points = points68
+            face_spatial_tracking_step(new_face, picture)
+
+            # geometrically select right and left eye
+            right_eye, left_eye, refused = geometric_eye_area_selection_step(eyes)
+            pick_eye_corners(right_eye, points68)
+            pick_eye_corners(left_eye, points68)
+
+            new_face.left_eye = left_eye
+            new_face.right_eye = right_eye
+            faces.append(new_face)
+            not_eyes.extend(refused)
+
+        # extract the eye features of all the faces (updates their eye objects)
+        batched_eye_features_extraction_step(picture, faces, algo)
+
+    return picture, faces, detect_method, not_eyes
@@ -0,0 +1,143 @@
+"""
+Per-stage timing of the frame processing. The steps of the frame path are wrapped in
+"with timed(stage):" blocks, which do nothing (not even read the clock) until the profiler or the
+metrics are enabled.
+Every stage keeps its most recent samples, and reports their percentiles. When the metrics are enabled
+(see utils/metrics.py), the durations also go to the stage_duration_seconds histograms.
+"""
+import logging
+import time
+from collections import deque
+from threading import Thread
+
+import numpy as np
+
+from utils import metrics
+from utils.logging import LogMaster
+
+
+# see enable
+active_profiler = None
+
+
+class NullTimer:
+    """
+    Returned by timed() when neither the profiler nor the metrics are enabled
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+null_timer = NullTimer()
+
+
+class StageTimer:
+
+    __slots__ = ("stage", "started")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.started
+        if active_profiler is not None:
+            active_profiler.record(self.stage, elapsed)
+        metrics.observe("stage_duration_seconds", elapsed, stage=self.stage)
+        return False
+
+
+class Profiler(LogMaster):
+    """
+    Rolling window of the last durations of every stage (stages are created when first recorded, and
+    listed in that order). Safe to use from several threads (e.g. the pipelined live mode).
+    """
+
+    percentiles = (50, 95, 99)
+
+    def __init__(self, window=300, report_interval=5.0, loglevel=logging.INFO):
+        """
+        :param window: number of samples per stage the percentiles are computed on
+        :param report_interval: log the percentiles every N seconds (None to disable)
+        """
+        self.setLogger(self.__class__.__name__, loglevel)
+        self.window = window
+        self.report_interval = report_interval
+        self.samples = {}
+        self.stopped = False
+        self.overlay_cache = (0.0, [])
+
+    def record(self, stage, elapsed):
+        samples = self.samples.get(stage)
+        if samples is None:
+            samples = self.samples.setdefault(stage, deque(maxlen=self.window))
+        samples.append(elapsed)
+
+    def stage_percentiles(self):
+        """
+        :return: list of tuples (stage, number of samples, percentiles in ms)
+        """
+        stages = []
+        for stage, samples in list(self.samples.items()):
+            values = np.array(samples)
+            if len(values) > 0:
+                stages.append((stage, len(values), np.percentile(values, self.percentiles) * 1000))
+        return stages
+
+    def summary_lines(self):
+        return ["%s: %s ms" % (stage, " ".join("p%d %.1f" % (q, value) for q, value in zip(self.percentiles, values)))
+                for stage, count, values in self.stage_percentiles()]
+
+    def overlay_lines(self, refresh_interval=0.5):
+        """
+        Same as summary_lines, recomputed at most every refresh_interval seconds (to draw it on every frame)
+        """
+        computed, lines = self.overlay_cache
+        now = time.perf_counter()
+        if now - computed > refresh_interval:
+            lines = self.summary_lines()
+            self.overlay_cache = (now, lines)
+        return lines
+
+    def report(self):
+        return " | ".join(self.summary_lines())
+
+    def start(self):
+        if self.report_interval is not None:
+            Thread(target=self.report_loop, name="profiler report", daemon=True).start()
+        return self
+
+    def report_loop(self):
+        while not self.stopped:
+            time.sleep(self.report_interval)
+            if not self.stopped and len(self.samples) > 0:
+                self.logger.info(self.report())
+
+    def stop(self):
+        self.stopped = True
+
+
+def enable(window=300, report_interval=5.0):
+    """
+    Start timing the stages of the frame processing
+    :return: the Profiler
+    """
+    global active_profiler
+    active_profiler = Profiler(window=window, report_interval=report_interval).start()
+    return active_profiler
+
+
+def timed(stage):
+    """
+    :return: context manager recording the time spent in its block as a sample of stage
+    """
+    if active_profiler is None and metrics.active_metrics is None:
+        return null_timer
+    return StageTimer(stage)
@@ -0,0 +1,161 @@
+import csv
+
+import numpy as np
+
+from classes import face_dtype, records_absolute_points, records_normalized_eye_vectors
+
+
+class FrameResults:
+    """
+    Per-frame tracking results, stored as an array of face records (see classes.face_dtype), and saved by
+    column: one array per quantity, with one row per frame.
+    Frames without a detected face have detected=False, and NaN in every other column.
+    Saved as a numpy .npz archive or as a .csv table (see save), sorted by frame id.
+    """
+
+    # column name -> number of values per frame
+    columns = {
+        "right_pupil": 2,
+        "right_inner_corner": 2,
+        "right_outer_corner": 2,
+        "left_pupil": 2,
+        "left_inner_corner": 2,
+        "left_outer_corner": 2,
+        "right_eye_vector": 2,
+        "left_eye_vector": 2,
+        "head_pose": 2,
+        "orientation": 3,
+        "translation": 3,
+    }
+
+    def __init__(self, extra_columns=()):
+        """
+        :param extra_columns: names of additional scalar columns (see add)
+        """
+        self.frame_ids = []
+        self.timestamps = []
+        self.names = []
+        self.detected = []
+        # one face record per frame (see classes.face_dtype), NaN where no face was found;
+        # the array grows by doubling, only the first len(self) records are valid
+        self.records = np.empty(16, dtype=face_dtype)
+        self.extra = {column: [] for column in extra_columns}
+        self.gaze_mapper = None
+
+    def __len__(self):
+        return len(self.frame_ids)
+
+    def reserve(self, size):
+        if size > len(self.records):
+            records = np.empty(max(size, 2 * len(self.records)), dtype=face_dtype)
+            records[:len(self)] = self.records[:len(self)]
+            self.records = records
+
+    def add(self, frame_id, face, timestamp=np.nan, name="", extra=None):
+        """
+        :param face: face object (see classes.py), None if no face was found
+        :param timestamp: position of the frame in the source
+        :param name: name of the frame (e.g. the picture file)
+        :param extra: dict with the values of the extra columns (NaN for the missing ones)
+        """
+        for column in self.extra:
+            self.extra[column].append(float(extra.get(column, np.nan)) if extra is not None else np.nan)
+        detected = face is not None and face.right_eye is not None and face.left_eye is not None
+        self.reserve(len(self) + 1)
+        row = self.records[len(self):len(self) + 1].view(np.float64)
+        if detected:
+            face.as_vector(out=row)
+        else:
+            row[:] = np.nan
+        self.frame_ids.append(frame_id)
+        self.timestamps.append(timestamp)
+        self.names.append(name)
+        self.detected.append(detected)
+
+    def extend(self, other):
+        """
+        Append the rows of another FrameResults (e.g. computed by another process)
+        """
+        self.reserve(len(self) + len(other))
+        self.records[len(self):len(self) + len(other)] = other.records[:len(other)]
+        self.frame_ids.extend(other.frame_ids)
+        self.timestamps.extend(other.timestamps)
+        self.names.extend(other.names)
+        self.detected.extend(other.detected)
+        for column in self.extra:
+            self.extra[column].extend(other.extra[column])
+
+    def set_gaze_mapper(self, gaze_mapper):
+        """
+        Also save the on-screen gaze of every frame (right_gaze and left_gaze columns, not smoothed),
+        mapping the eye vectors of the whole session at once
+        :param gaze_mapper: object with a map_eye_vectors method (e.g. a calibrated classes.Tracker)
+        """
+        self.gaze_mapper = gaze_mapper
+
+    def column_values(self, records):
+        """
+        :return: dict column -> values of the column for the given face records (computed on the whole array)
+        """
+        right_eye = records["right_eye"]
+        left_eye = records["left_eye"]
+        return {
+            "right_pupil": records_absolute_points(right_eye, "pupil"),
+            "right_inner_corner": records_absolute_points(right_eye, "inner_corner"),
+            "right_outer_corner": records_absolute_points(right_eye, "outer_corner"),
+            "left_pupil": records_absolute_points(left_eye, "pupil"),
+            "left_inner_corner": records_absolute_points(left_eye, "inner_corner"),
+            "left_outer_corner": records_absolute_points(left_eye, "outer_corner"),
+            "right_eye_vector": records_normalized_eye_vectors(records, is_right=True),
+            "left_eye_vector": records_normalized_eye_vectors(records, is_right=False),
+            "head_pose": records["head_pose"],
+            "orientation": records["orientation"],
+            "translation": records["translation"],
+        }
+
+    def as_arrays(self):
+        order = np.argsort(self.frame_ids, kind="stable")
+        arrays = {
+            "frame_id": np.array(self.frame_ids, dtype=np.int64),
+            "timestamp": np.array(self.timestamps, dtype=np.float64),
+            "name": np.array(self.names, dtype=str),
+            "detected": np.array(self.detected, dtype=bool),
+        }
+        for column, values in self.column_values(self.records[:len(self)]).items():
+            arrays[column] = np.asarray(values, dtype=np.float64).reshape((-1, self.columns[column]))
+        if self.gaze_mapper is not None:
+            arrays["right_gaze"] = np.full((len(self), 2), np.nan)
+            arrays["left_gaze"] = np.full((len(self), 2), np.nan)
+            detected = arrays["detected"]
+            if detected.any():
+                arrays["right_gaze"][detected], arrays["left_gaze"][detected] = self.gaze_mapper.map_eye_vectors(
+                    arrays["right_eye_vector"][detected], arrays["left_eye_vector"][detected])
+        for column, values in self.extra.items():
+            arrays[column] = np.array(values, dtype=np.float64)
+        return {column: array[order] for column, array in arrays.items()}
+
+    def save(self, path):
+        """
+        :param path: a .csv file (one line per frame, easy to diff between runs), otherwise a .npz archive
+        """
+        if path.lower().endswith(".csv"):
+            self.save_csv(path)
+        else:
+            np.savez_compressed(path, **self.as_arrays())
+
+    def save_csv(self, path):
+        arrays = self.as_arrays()
+        header = []
+        fields = []
+        for column, array in arrays.items():
+            if array.ndim == 1:
+                header.append(column)
+                fields.append(array.astype(str) if array.dtype.kind != "f" else np.char.mod("%.6g", array))
+            else:
+                for axis in range(array.shape[1]):
+                    header.append("%s_%d" % (column, axis))
+                    fields.append(np.char.mod("%.6g", array[:, axis]))
+        with open(path, "w", newline="") as fp:
+            writer = csv.writer(fp)
+            writer.writerow(header)
+            writer.writerows(zip(*fields))
@@ -14,7 +14,7 @@ from utils.process_frame import process_frame
 from utils.gui.visualization import draw_routine
 
 from utils.eyecenter.hough import PyHoughEyecenter
-from utils.eyecenter.timm.timm_and_barth import TimmAndBarth
+from utils.eyecenter.timm.timm_and_barth import TimmAndBarth, NumpyTimmAndBarth
 from utils.eyecenter.int_proj import GeneralIntegralProjection
 from utils.histogram.lsh_equalization import lsh_equalization
 from utils.screen_mapping.mappers.fuzzy_mapper import FuzzyMapper
@@ -25,6 +25,7 @@ cal_param_storage_path = "calibration.dat"
 algos = {
     "hough": PyHoughEyecenter,
     "timm": TimmAndBarth,
+    "timm_np": NumpyTimmAndBarth,
     "gip": GeneralIntegralProjection,
 }
 equaliz = {
@@ -141,27 +142,23 @@ class CaptureCalibrator(LogMaster):
             mapper_left.before_training(stored_observations)
             mapper_right.train_from_data(stored_observations, is_left=False)
             mapper_left.train_from_data(stored_observations, is_left=True)
-            mean_errors_left=[]
-            mean_errors_right=[]
-            screen_pos = []
+            right_vectors = []
+            left_vectors = []
+            true_screen_points = []
             for obs in self.observations:
                 assert(isinstance(obs, Observation))
-                right_vectors = obs.right_eyevectors
-                left_vectors = obs.left_eyevectors
-                right_eye_screen_pos = mapper_right.map_point(np.mean(right_vectors, axis=0))
-                left_eye_screen_pos = mapper_left.map_point(np.mean(left_vectors, axis=0))
-                true_screen_point = np.array(obs.screen_point)
-                
-                estimated_screen_point = np.mean([right_eye_screen_pos, left_eye_screen_pos], axis=0)
-                screen_pos.append(estimated_screen_point)
-                
-                error_left = np.linalg.norm(left_eye_screen_pos-true_screen_point)
-                error_right = np.linalg.norm(right_eye_screen_pos-true_screen_point)
-                
-                mean_errors_left.append(error_left)
-                mean_errors_right.append(error_right)
-            mean_error_left = np.mean(mean_errors_left)
-            mean_error_right = np.mean(mean_errors_right)
+                right_vectors.append(np.mean(obs.right_eyevectors, axis=0))
+                left_vectors.append(np.mean(obs.left_eyevectors, axis=0))
+                true_screen_points.append(obs.screen_point)
+            # map the whole session at once
+            right_eye_screen_pos = mapper_right.map_points(np.array(right_vectors).reshape((-1, 2)))
+            left_eye_screen_pos = mapper_left.map_points(np.array(left_vectors).reshape((-1, 2)))
+            true_screen_points = np.array(true_screen_points, dtype=np.float64).reshape((-1, 2))
+
+            screen_pos = list((right_eye_screen_pos + left_eye_screen_pos) / 2)
+
+            mean_error_left = np.mean(np.linalg.norm(left_eye_screen_pos - true_screen_points, axis=1))
+            mean_error_right = np.mean(np.linalg.norm(right_eye_screen_pos - true_screen_points, axis=1))
            
             mean_error = (mean_error_left+mean_error_right)/2
             print("mean error")
@@ -1,3 +1,5 @@
+import numpy as np
+
 from classes import Point
 
 
@@ -12,3 +14,12 @@ class MapperInterface:
 
     def map_point(self, eyevector: Point):
         return Point(0,0)
+
+    def map_points(self, eyevectors):
+        """
+        Map many eye vectors at once (e.g. a whole recorded session)
+        :param eyevectors: (N,2) array
+        :return: (N,2) array of screen coordinates
+        """
+        return np.array([tuple(self.map_point(eyevector)) for eyevector in eyevectors],
+                        dtype=np.float64).reshape((-1, 2))
@@ -1,56 +1,149 @@
 import logging
 
 import numpy as np
-from math import sqrt, exp
-from itertools import combinations
+from scipy.spatial import cKDTree
 
 from utils.logging import LogMaster
 from utils.screen_mapping.mapper_interface import MapperInterface
 from classes import Observation, Point
 
 
+def convex_hull(points):
+    """
+    Andrew's monotone chain, O(n log n)
+    :param points: (N,2) array
+    :return: (H,2) array with the vertices of the convex hull of the points (all of them if N < 3)
+    """
+    points = np.unique(np.asarray(points, dtype=np.float64).reshape((-1, 2)), axis=0)
+    if len(points) < 3:
+        return points
+
+    def half_hull(ordered):
+        hull = []
+        for point in ordered:
+            while len(hull) >= 2 and ((hull[-1][0] - hull[-2][0]) * (point[1] - hull[-2][1]) -
+                                      (hull[-1][1] - hull[-2][1]) * (point[0] - hull[-2][0])) <= 0:
+                hull.pop()
+            hull.append(point)
+        return hull[:-1]
+
+    # np.unique sorts the points by x, then y
+    return np.array(half_hull(points) + half_hull(points[::-1]))
+
+
+def diameter(points):
+    """
+    :param points: (N,2) array (e.g. the vertices of a convex hull)
+    :return: largest distance between two of the points
+    """
+    if len(points) < 2:
+        return 0.0
+    return np.max(np.hypot(points[:, 0:1] - points[:, 0], points[:, 1:2] - points[:, 1]))
+
+
 class FuzzyMapper(LogMaster, MapperInterface):
 
+    """
+        eye_vectors, screen_points: (N,2) arrays with the mean eye vector and the screen point of every
+            calibration point
+        neighbourhood: largest distance between two eye vectors (the diameter of their convex hull, hull)
+        tree: kd-tree of the first indexed eye vectors; the ones added later are searched one by one, until
+            they are enough to rebuild the tree
+    """
+
+    top_n = 3
+
     def __init__(self, loglevel=logging.DEBUG):
         self.setLogger(self.__class__.__name__, loglevel)
 
-        self.screen_points = []
-        self.eye_vectors = []
+        self.screen_points = np.zeros((0, 2))
+        self.eye_vectors = np.zeros((0, 2))
         self.neighbourhood = 0.0
+        self.hull = np.zeros((0, 2))
+        self.tree = None
+        self.indexed = 0
 
         self.logger.debug("Fuzzy mapper ready")
 
     def train_from_data(self, observations, is_left=False):
+        self.screen_points = np.zeros((0, 2))
+        self.eye_vectors = np.zeros((0, 2))
+        self.hull = np.zeros((0, 2))
+        self.tree = None
+        self.indexed = 0
+        self.add_observations(observations, is_left)
+        self.build_tree()
+
+    def add_observations(self, observations, is_left=False):
+        """
+        Add calibration points, without retraining on the previous ones
+        """
+        screen_points = []
+        eye_vectors = []
         for obs in observations:
             assert(isinstance(obs, Observation))
             domain = obs.right_eyevectors
             if is_left:
                 domain = obs.left_eyevectors
+            if len(domain) == 0:
+                continue
+            eye_vectors.append(np.mean(domain, axis=0))
+            screen_points.append(obs.screen_point)
+        self.add_points(eye_vectors, screen_points)
 
-            eye_vector = np.mean(domain, axis=0)
-            self.screen_points.append(obs.screen_point)
-            self.eye_vectors.append(eye_vector)
+    def add_points(self, eye_vectors, screen_points):
+        """
+        :param eye_vectors: (N,2) array
+        :param screen_points: (N,2) array
+        """
+        eye_vectors = np.asarray(eye_vectors, dtype=np.float64).reshape((-1, 2))
+        self.eye_vectors = np.vstack([self.eye_vectors, eye_vectors])
+        self.screen_points = np.vstack([self.screen_points,
+                                        np.asarray(screen_points, dtype=np.float64).reshape((-1, 2))])
+        # the farthest points are on the hull: only its vertices need to be kept
+        self.hull = convex_hull(np.vstack([self.hull, eye_vectors]))
+        self.neighbourhood = diameter(self.hull)
+        if len(self.eye_vectors) - self.indexed > max(16, np.sqrt(len(self.eye_vectors))):
+            self.build_tree()
 
-        pairs = list(combinations(self.eye_vectors, 2))
-        self.neighbourhood = max(map(lambda pair: np.linalg.norm(pair[0] - pair[1]), pairs))
+    def build_tree(self):
+        self.tree = cKDTree(self.eye_vectors) if len(self.eye_vectors) > 0 else None
+        self.indexed = len(self.eye_vectors)
 
+    def nearest(self, eyevectors, count):
+        """
+        :return: tuple of (N,count) arrays (distances, indices) of the closest calibration points, in no particular
+            order (fewer than count if there are not enough calibration points)
+        """
+        distances = np.zeros((len(eyevectors), 0))
+        indices = np.zeros((len(eyevectors), 0), dtype=np.intp)
+        if self.tree is not None:
+            k = min(count, self.indexed)
+            distances, indices = self.tree.query(eyevectors, k=k)
+            distances = distances.reshape((len(eyevectors), k))
+            indices = indices.reshape((len(eyevectors), k))
+        if self.indexed < len(self.eye_vectors):
+            pending = self.eye_vectors[self.indexed:]
+            distances = np.hstack([distances, np.hypot(eyevectors[:, 0:1] - pending[:, 0],
+                                                       eyevectors[:, 1:2] - pending[:, 1])])
+            indices = np.hstack([indices, np.broadcast_to(np.arange(self.indexed, len(self.eye_vectors)),
+                                                          (len(eyevectors), len(pending)))])
+        if distances.shape[1] > count:
+            closest = np.argpartition(distances, count - 1, axis=1)[:, :count]
+            distances = np.take_along_axis(distances, closest, axis=1)
+            indices = np.take_along_axis(indices, closest, axis=1)
+        return distances, indices
 
     def map_point(self, eyevector: Point):
-        top_n = 3
-        x_component, y_component = 0.0, 0.0
-        def closeness(reference, candidate: Point):
-            dist = sqrt((reference[0] - candidate[0]) **2 + (reference[1] - candidate[1]) **2)
-            nd = dist / self.neighbourhood
-            return exp(-nd)
-
-        weights = list(map(lambda cand: closeness(cand, eyevector), self.eye_vectors))
-        top_n_weights = sorted(weights, reverse=True)[:top_n]
-        normalization = sum(top_n_weights) + 0.0001
-        for index, coordinates, weight in zip(range(len(weights)), self.screen_points, weights):
-            if weight in top_n_weights:
-                x_component += weight * coordinates[0]
-                y_component += weight * coordinates[1]
-        x_component /= normalization
-        y_component /= normalization
-
-        return Point(x=x_component, y=y_component)
\ No newline at end of file
+        return Point(*self.map_points(np.array([eyevector]))[0])
+
+    def map_points(self, eyevectors):
+        """
+        Average of the screen points of the top_n calibration points closest to every eye vector, weighted
+        by their closeness
+        """
+        eyevectors = np.asarray(eyevectors, dtype=np.float64).reshape((-1, 2))
+        distances, indices = self.nearest(eyevectors, self.top_n)
+        weights = np.exp(-distances / (self.neighbourhood if self.neighbourhood > 0 else 1.0))
+        mapped = np.einsum("nk,nkd->nd", weights, self.screen_points[indices])
+        return mapped / (weights.sum(axis=1)[:, np.newaxis] + 0.0001)
@@ -54,7 +54,10 @@ class NeuralMapper(LogMaster, MapperInterface):
         self.model.fit(X_train, Y_train)
 
     def map_point(self, eyevector: Point):
-        X_predict = self.scaler.transform(np.array([eyevector]))
-        #X_predict = np.array(np.array([eyevector]))
-        predicted = np.array(self.model.predict(X_predict)[0])
-        return Point(*(self.y_scaler.inverse_transform(predicted)))
+        return Point(*self.map_points(np.array([eyevector]))[0])
+
+    def map_points(self, eyevectors):
+        X_predict = self.scaler.transform(np.asarray(eyevectors, dtype=np.float64).reshape((-1, 2)))
+        #X_predict = np.array(eyevectors)
+        predicted = self.model.predict(X_predict).reshape((-1, 2))
+        return self.y_scaler.inverse_transform(predicted)
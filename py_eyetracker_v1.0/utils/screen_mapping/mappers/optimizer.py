@@ -29,3 +29,28 @@ def compute_params(screen_points, eye_vectors, mapfun, num_params):
     params_x = optimization_res_x.x
     params_y = optimization_res_y.x
     return params_x, params_y
+
+
+def solve_params(screen_points, design, ridge=0.0, weights=None):
+    """
+    Closed-form least squares fit of a mapping linear in its parameters (e.g. the polynomial mappers),
+    solving x and y together. Same result as compute_params, without the iterations.
+    :param screen_points: (N,2) array of screen coordinates
+    :param design: (N,num_params) design matrix, one row of features per point; the first column is the
+        constant term, which is not regularized
+    :param ridge: ridge regularization strength (0 to disable): penalizes the square of the other parameters
+    :param weights: (N,) weight of every point (e.g. the number of samples it is the mean of), None for all 1
+    :return: tuple (params_x, params_y)
+    """
+    design = np.asarray(design, dtype=np.float64)
+    targets = np.asarray(screen_points, dtype=np.float64).reshape((-1, 2))
+    num_params = design.shape[1]
+    if weights is not None:
+        root_weights = np.sqrt(np.asarray(weights, dtype=np.float64))[:, np.newaxis]
+        design = design * root_weights
+        targets = targets * root_weights
+    if ridge > 0:
+        design = np.vstack([design, np.sqrt(ridge) * np.eye(num_params)[1:]])
+        targets = np.vstack([targets, np.zeros((num_params - 1, 2))])
+    params = np.linalg.lstsq(design, targets, rcond=None)[0]
+    return params[:, 0], params[:, 1]
@@ -5,14 +5,25 @@ import numpy as np
 from utils.logging import LogMaster
 from utils.screen_mapping.mapper_interface import MapperInterface
 from classes import Observation, Point
-from utils.screen_mapping.mappers.optimizer import compute_params
+from utils.screen_mapping.mappers.optimizer import solve_params
 
 
 class PolyMapper(LogMaster, MapperInterface):
 
-    def __init__(self, num_params, loglevel=logging.DEBUG):
+    # training data: the mean eye vector of every calibration point ("means"), the same weighted by the
+    # number of samples of the point ("weighted_means"), or every sample ("samples")
+    fit_modes = ("means", "weighted_means", "samples")
+
+    def __init__(self, num_params, ridge=0.0, fit="means", loglevel=logging.DEBUG):
+        """
+        :param ridge: ridge regularization strength of the fit (see optimizer.solve_params)
+        :param fit: training data, one of fit_modes
+        """
+        assert(fit in self.fit_modes)
         self.setLogger(self.__class__.__name__, loglevel)
         self.num_params = num_params
+        self.ridge = ridge
+        self.fit = fit
         self.params_x = np.array((num_params,))
         self.params_y = np.array((num_params,))
         self.logger.debug("Polynomial mapper ready (%d parameters)" % (self.num_params,))
@@ -20,44 +31,75 @@ class PolyMapper(LogMaster, MapperInterface):
     def oneD_map_function(self, eye_vector, params):
         return 0
 
-    def train_from_data(self, observations, is_left=False):
+    def design_matrix(self, eye_vectors):
+        """
+        :param eye_vectors: (N,2) array
+        :return: (N,num_params) array, such that design_matrix(v).dot(params) = oneD_map_function(v, params)
+        """
+        return np.zeros((len(eye_vectors), self.num_params))
+
+    def training_data(self, observations, is_left=False):
+        """
+        :return: tuple (screen points, eye vectors, weights), as arrays, according to self.fit
+        """
         screen_points = []
-        eye_vectors = []
+        domains = []
         for obs in observations:
             assert(isinstance(obs, Observation))
             domain = obs.right_eyevectors
             if is_left:
                 domain = obs.left_eyevectors
+            if len(domain) > 0:
+                screen_points.append(obs.screen_point)
+                domains.append(np.asarray(domain, dtype=np.float64).reshape((-1, 2)))
+        screen_points = np.array(screen_points, dtype=np.float64).reshape((-1, 2))
+        counts = np.array([len(domain) for domain in domains], dtype=np.float64)
+        if len(domains) == 0:
+            return screen_points, np.zeros((0, 2)), None
+        if self.fit == "samples":
+            return np.repeat(screen_points, counts.astype(int), axis=0), np.concatenate(domains), None
+        eye_vectors = np.array([np.mean(domain, axis=0) for domain in domains])
+        return screen_points, eye_vectors, counts if self.fit == "weighted_means" else None
 
-            eye_vector = np.mean(domain, axis=0)
-            screen_points.append(obs.screen_point)
-            eye_vectors.append(eye_vector)
-
-        self.params_x, self.params_y = tuple(compute_params(screen_points, eye_vectors,
-                                                            self.oneD_map_function, self.num_params))
+    def train_from_data(self, observations, is_left=False):
+        screen_points, eye_vectors, weights = self.training_data(observations, is_left)
+        self.params_x, self.params_y = solve_params(screen_points, self.design_matrix(eye_vectors),
+                                                    ridge=self.ridge, weights=weights)
 
     def map_point(self, eyevector: Point):
         x_screen = self.oneD_map_function(eyevector, self.params_x)
         y_screen = self.oneD_map_function(eyevector, self.params_y)
         return Point(x=x_screen, y=y_screen)
 
+    def map_points(self, eyevectors):
+        eyevectors = np.asarray(eyevectors, dtype=np.float64).reshape((-1, 2))
+        return self.design_matrix(eyevectors).dot(np.column_stack([self.params_x, self.params_y]))
+
 
 class PolyQuadMapper(PolyMapper):
 
-    def __init__(self, loglevel=logging.DEBUG):
-        super().__init__(6, loglevel)
+    def __init__(self, ridge=0.0, fit="means", loglevel=logging.DEBUG):
+        super().__init__(6, ridge, fit, loglevel)
 
     def oneD_map_function(self, eye_vector: Point, params):
         (ex, ey) = eye_vector
         return params[0] + ex * params[1] + ey * params[2] + \
                ex * ey * params[3] + (ex ** 2) * params[4] + (ey ** 2) * params[5]
 
+    def design_matrix(self, eye_vectors):
+        ex, ey = np.asarray(eye_vectors, dtype=np.float64).T
+        return np.column_stack([np.ones_like(ex), ex, ey, ex * ey, ex ** 2, ey ** 2])
+
 
 class PolyLinMapper(PolyMapper):
 
-    def __init__(self, loglevel=logging.DEBUG):
-        super().__init__(3, loglevel)
+    def __init__(self, ridge=0.0, fit="means", loglevel=logging.DEBUG):
+        super().__init__(3, ridge, fit, loglevel)
 
     def oneD_map_function(self, eye_vector: Point, params):
         (ex, ey) = eye_vector
         return params[0] + ex * params[1] + ey * params[2]
+
+    def design_matrix(self, eye_vectors):
+        ex, ey = np.asarray(eye_vectors, dtype=np.float64).T
+        return np.column_stack([np.ones_like(ex), ex, ey])
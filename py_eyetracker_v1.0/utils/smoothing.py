@@ -0,0 +1,220 @@
+"""
+Smoothers of the tracking data: they filter a stream of vectors (e.g. the face data, see Face.as_vector, the
+eye vectors, or the gaze centroid on the screen), one sample per frame.
+Every smoother takes the timestamp of the samples, so that it works the same at any frame rate, and
+costs O(1) per frame (the moving average: O(window)).
+
+moving average: weighted average of the last N samples; the output lags behind by about N / 2 frames
+kalman: constant-velocity Kalman filter, one independent (position, velocity) state per component;
+    it predicts the motion, so it does not lag behind a steady movement
+one_euro: One-Euro filter (Casiez et al. 2012), a low-pass filter whose cutoff frequency grows with the
+    speed of the signal: smooth when still, responsive when moving
+"""
+import numpy as np
+
+
+class Smoother:
+
+    def update(self, vector, timestamp):
+        """
+        :param vector: 1-D array, the new sample (always of the same size)
+        :param timestamp: time of the sample, in seconds
+        """
+        pass
+
+    def estimate(self):
+        """
+        :return: the smoothed value (1-D array), None before the first sample
+        """
+        return None
+
+    def reset(self):
+        pass
+
+
+class MovingAverage(Smoother):
+
+    """
+        history: ring buffer with the most recent samples, one per row; history_next is the row the next
+            sample goes to, history_count the number of samples in it
+        weights: weight_fun(n) for n = 0 .. window - 1 (0 is the oldest sample)
+    """
+
+    def __init__(self, window=5, weight_fun=lambda x: 1.0):
+        """
+        :param window: average across the last N samples
+        :param weight_fun: weight of the n-th sample of the window, 0 being the oldest
+        """
+        self.window = max(int(window), 1)
+        self.weights = np.array([weight_fun(n) for n in range(self.window)], dtype=np.float64)
+        self.history = None
+        self.reset()
+
+    def reset(self):
+        self.history_next = 0
+        self.history_count = 0
+        self.cached = None
+
+    def update(self, vector, timestamp=None):
+        if self.history is None or self.history.shape[1] != len(vector):
+            self.history = np.zeros((self.window, len(vector)))
+        self.history[self.history_next] = vector
+        self.history_next = (self.history_next + 1) % self.window
+        self.history_count = min(self.history_count + 1, self.window)
+        self.cached = None
+
+    def estimate(self):
+        if self.history_count == 0:
+            return None
+        if self.cached is None:
+            # weighted average of the rows, oldest sample first
+            if self.history_count < self.window:
+                weights = self.weights[:self.history_count]
+                rows = self.history[:self.history_count]
+            else:
+                # the oldest sample is in the row history_next
+                weights = np.roll(self.weights, self.history_next)
+                rows = self.history
+            self.cached = weights.dot(rows) / weights.sum()
+        return self.cached
+
+
+class ConstantVelocityKalman(Smoother):
+
+    """
+        position, velocity: state of every component
+        p00, p01, p11: covariance matrix of the state of every component, [[p00, p01], [p01, p11]]
+    """
+
+    def __init__(self, process_noise=2000.0, measurement_noise=4.0, max_dt=0.5):
+        """
+        :param process_noise: spectral density of the (white noise) acceleration, in units^2 / s^3: the
+            higher, the faster the filter follows a change of speed
+        :param measurement_noise: variance of the measurement noise, in units^2: the higher, the smoother
+        :param max_dt: restart the filter after a gap of more than N seconds between two samples
+        """
+        self.process_noise = process_noise
+        self.measurement_noise = measurement_noise
+        self.max_dt = max_dt
+        self.reset()
+
+    def reset(self):
+        self.position = None
+        self.last_timestamp = None
+
+    def update(self, vector, timestamp):
+        vector = np.asarray(vector, dtype=np.float64)
+        dt = timestamp - self.last_timestamp if self.last_timestamp is not None else None
+        if self.position is None or len(vector) != len(self.position) or dt is None or dt > self.max_dt:
+            self.position = vector.copy()
+            self.velocity = np.zeros_like(vector)
+            self.p00 = np.full_like(vector, self.measurement_noise)
+            self.p01 = np.zeros_like(vector)
+            self.p11 = np.full_like(vector, self.process_noise * self.max_dt)
+            self.last_timestamp = timestamp
+            return
+        dt = max(dt, 1e-6)
+        self.last_timestamp = timestamp
+        q = self.process_noise
+        # predict: x = F x, P = F P F' + Q, with F = [[1, dt], [0, 1]]
+        self.position += self.velocity * dt
+        p00 = self.p00 + dt * (2 * self.p01 + dt * self.p11) + q * dt ** 3 / 3
+        p01 = self.p01 + dt * self.p11 + q * dt ** 2 / 2
+        p11 = self.p11 + q * dt
+        # correct with the measurement of the position
+        innovation = vector - self.position
+        s = p00 + self.measurement_noise
+        k0 = p00 / s
+        k1 = p01 / s
+        self.position += k0 * innovation
+        self.velocity += k1 * innovation
+        self.p00 = (1 - k0) * p00
+        self.p01 = (1 - k0) * p01
+        self.p11 = p11 - k1 * p01
+
+    def estimate(self):
+        return self.position
+
+
+class OneEuro(Smoother):
+
+    def __init__(self, min_cutoff=1.0, beta=0.05, derivative_cutoff=1.0):
+        """
+        :param min_cutoff: cutoff frequency when still, in Hz: the lower, the smoother
+        :param beta: growth of the cutoff frequency with the speed, in Hz per (units / s): the higher, the
+            less it lags behind a fast movement
+        :param derivative_cutoff: cutoff frequency of the speed estimate, in Hz
+        """
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.derivative_cutoff = derivative_cutoff
+        self.reset()
+
+    def reset(self):
+        self.value = None
+        self.last_timestamp = None
+
+    @staticmethod
+    def smoothing_factor(cutoff, dt):
+        tau = 1.0 / (2 * np.pi * cutoff)
+        return 1.0 / (1.0 + tau / dt)
+
+    def update(self, vector, timestamp):
+        vector = np.asarray(vector, dtype=np.float64)
+        if self.value is None or len(vector) != len(self.value):
+            self.value = vector.copy()
+            self.speed = np.zeros_like(vector)
+            self.last_timestamp = timestamp
+            return
+        dt = max(timestamp - self.last_timestamp, 1e-6)
+        self.last_timestamp = timestamp
+        a = self.smoothing_factor(self.derivative_cutoff, dt)
+        self.speed += a * ((vector - self.value) / dt - self.speed)
+        a = self.smoothing_factor(self.min_cutoff + self.beta * np.abs(self.speed), dt)
+        self.value += a * (vector - self.value)
+
+    def estimate(self):
+        return self.value
+
+
+# name -> smoother class (see make_smoother)
+smoothers = {
+    "average": MovingAverage,
+    "kalman": ConstantVelocityKalman,
+    "one_euro": OneEuro,
+}
+
+
+# default parameters of the smoothers of the normalized eye vectors (about -0.3 to 0.3, with a noise of about
+# 0.01): the defaults in __init__ are meant for screen pixels. Tuned with benchmark_smoothing.py
+eye_vector_params = {
+    "kalman": {"process_noise": 0.5, "measurement_noise": 1e-4},
+    "one_euro": {"min_cutoff": 0.5, "beta": 10.0},
+}
+
+
+def make_smoother(name, **params):
+    """
+    :param name: key of smoothers
+    :param params: parameters of the smoother (see its __init__)
+    """
+    return smoothers[name](**params)
+
+
+def make_eye_vector_smoother(name, **params):
+    """
+    Same as make_smoother, with the defaults of eye_vector_params for the parameters not given
+    """
+    return make_smoother(name, **dict(eye_vector_params.get(name, {}), **params))
+
+
+def parse_params(pairs):
+    """
+    :param pairs: list of "name=value" strings (e.g. from the command line)
+    :return: dict name -> float value
+    """
+    params = {}
+    for pair in pairs:
+        name, value = pair.split("=", 1)
+        params[name.strip().replace("-", "_")] = float(value)
+    return params